@@ -2,6 +2,8 @@
 import shutil
 from pathlib import Path
 
+from challenges import challenge_levels, challenge_types
+
 
 # %%
 def create_folders(folder_name):
@@ -13,16 +15,14 @@ def create_folders(folder_name):
     # create 5 sub-folders in each folder
     # do not create sub-folders for 00 folder (No-challenge)
     if folder_name != "00":
-        for sub_folder_name in ["01", "02", "03", "04", "05"]:
+        for sub_folder_name in challenge_levels:
             if not Path("CURE-TSD", folder_name, sub_folder_name).exists():
                 Path("CURE-TSD", folder_name, sub_folder_name).mkdir(parents=True)
 
 
 # {"00": "No-challenge", "09": "Rain", "11": "Snow", "12": "Haze"}
-create_folders("00")
-create_folders("09")
-create_folders("11")
-create_folders("12")
+for challenge_type in challenge_types:
+    create_folders(challenge_type)
 
 
 # %%
@@ -75,7 +75,7 @@ for file in files:
     # rename to sequence_number.mp4
     if sequence_type == "01":
 
-        if challenge_type in ["00", "09", "11", "12"]:
+        if challenge_type in challenge_types:
 
             move_file(
                 file,
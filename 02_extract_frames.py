@@ -1,15 +1,60 @@
 # %%
 import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import cv2
 
+from challenges import challenge_types
+
 # %%
-files = Path("CURE-TSD").rglob("*.mp4")
+# one worker process per core, each worker decodes one video at a time
+# prepare_data.py sets CURE_TSD_WORKERS to share the cores between extract_frames stages running in parallel
+workers = int(os.getenv("CURE_TSD_WORKERS", 0)) or os.cpu_count() or 1
+
+# threads per worker that encode and write JPEGs while the video is being decoded
+writer_threads = 2
+
+# max decoded frames waiting to be written per worker (bounds memory use)
+queue_size = 32
+
+# every video that has been fully extracted is recorded here so an interrupted run can resume
+done_file = Path("CURE-TSD", "extract_frames.done")
+
+
+# %%
+def write_frames(frames):
+    """write (dst, image) pairs from the queue until a None sentinel is received"""
+
+    while True:
 
-for file in files:
+        item = frames.get()
 
-    print(file)
+        if item is None:
+            break
+
+        dst, image = item
+        cv2.imwrite(str(dst), image)
+
+
+def extract_frames(file):
+    """extract every frame of file to file.parent > images > sequenceNumber_frameNo.jpg"""
+
+    # decoding and encoding already run in parallel across processes
+    cv2.setNumThreads(1)
+
+    dst_dir = Path(file.parent, "images")
+    dst_dir.mkdir(parents=True, exist_ok=True)
+
+    frames = queue.Queue(maxsize=queue_size)
+    writers = [
+        threading.Thread(target=write_frames, args=(frames,), daemon=True)
+        for _ in range(writer_threads)
+    ]
+    for writer in writers:
+        writer.start()
 
     cap = cv2.VideoCapture(str(file))
 
@@ -22,28 +67,71 @@ for file in files:
         # if no frames has been grabbed retval will be false and the image will be empty
         retval, image = cap.read()
 
-        if retval:
+        if not retval:
+            break
 
-            # write extracted frame as an image
-            dst = Path(
-                file.parent,
-                "images",
-                f"{file.stem}_{frame_no:03}.jpg",
-            )
+        # blocks when the writers fall behind
+        frames.put((Path(dst_dir, f"{file.stem}_{frame_no:03}.jpg"), image))
 
-            # if the destination does not exist, create it
-            if not dst.parent.exists():
-                dst.parent.mkdir(parents=True)
+        frame_no += 1
 
-            print(f"Saving image: {dst}")
+    cap.release()
 
-            cv2.imwrite(str(dst), image)
+    # one sentinel per writer, then wait for the queue to drain
+    for _ in writers:
+        frames.put(None)
+    for writer in writers:
+        writer.join()
 
-            frame_no += 1
+    return file, frame_no - 1
 
-        else:
-            cap.release()
-            os.remove(file)
-            break
+
+# %%
+def read_done():
+    """return the videos that have already been extracted"""
+
+    if not done_file.exists():
+        return set()
+
+    with done_file.open("r") as f:
+        return set(f.read().splitlines())
+
+
+def run(files):
+    """extract frames from files in parallel, skipping videos that are already done"""
+
+    done = read_done()
+    files = [file for file in files if str(file) not in done]
+
+    print(f"Extracting {len(files)} videos ({len(done)} already done)")
+
+    if not files:
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, done_file.open("a") as f:
+
+        futures = [pool.submit(extract_frames, file) for file in files]
+
+        for i, future in enumerate(as_completed(futures), 1):
+
+            file, n = future.result()
+
+            # only record a video once all of its frames are on disk
+            f.write(f"{file}\n")
+            f.flush()
+
+            print(f"[{i}/{len(files)}] {file}: {n} frames")
+
+
+# %%
+if __name__ == "__main__":
+    # source videos are kept so that extraction can be resumed or re-run
+    files = [
+        file
+        for challenge_type in challenge_types
+        for file in Path("CURE-TSD", challenge_type).rglob("*.mp4")
+    ]
+
+    run(sorted(files))
 
 # %%
@@ -6,7 +6,8 @@ import os
 # %%
 # change file name from sequenceType_sequenceNumber.txt to sequenceNumber.txt
 
-files = Path("CURE-TSD", "labels").glob("*.txt")
+# only match sequenceType_sequenceNumber.txt so frame labels written by extract_labels.py are never renamed
+files = Path("CURE-TSD", "labels").glob("??_??.txt")
 
 for file in files:
 
@@ -9,17 +9,6 @@ import pandas as pd
 image_width = 1628
 image_height = 1236
 
-# create a dict that will be used to create a df
-data = {
-    "file": [],
-    "sequence": [],
-    "frame": [],
-    "sign": [],
-    "width": [],
-    "height": [],
-    "area": [],
-}
-
 # create a dict to map signs
 signs = {
     "01": "speed_limit",
@@ -38,63 +27,61 @@ signs = {
     "14": "parking",
 }
 
-# %%
-files = Path("CURE-TSD", "labels").glob("*.txt")
-
-for file in files:
 
-    print(f"Processing {file.name}...")
+# %%
+def extract_labels(file):
+    """convert one annotation file to one YOLO label file per frame and return its rows for lables.csv"""
 
     sequence_number = file.stem
 
-    with file.open("r") as f:
-        lines = f.read().splitlines()
-
-    # skip first line
-    for line in lines[1:]:
-
-        # frameNumber_signType_llx_lly_lrx_lry_ulx_uly_urx_ury
-        (
-            frame_number,
-            sign_type,
-            llx,
-            lly,
-            lrx,
-            lry,
-            ulx,
-            uly,
-            urx,
-            ury,
-        ) = line.split("_")
-
-        # get the centre of box
-        x_center = (int(llx) + int(lrx)) / 2
-        y_center = (int(lly) + int(uly)) / 2
-
-        # get dims
-        width = abs(int(llx) - int(lrx))
-        height = abs(int(lly) - int(uly))
-
-        # box coordinates must be normalized from 0 - 1
-        # divide x_center and width by image width
-        x_center_norm = round(x_center / image_width, 6)
-        width_norm = round(width / image_width, 6)
-
-        # divide y_center and height by image height
-        y_center_norm = round(y_center / image_height, 6)
-        height_norm = round(height / image_height, 6)
-
-        # class numbers should be zero-indexed (start from 0)
-        class_number = int(sign_type) - 1
-
-        # concatenate each row as:
-        # class_number x_center y_center width height
-        row = f"{class_number} {x_center_norm} {y_center_norm} {width_norm} {height_norm}\n"
-
-        print(row)
-
-        # save output as:
-        # sequenceNumber_frameNumber.txt
+    # frameNumber_signType_llx_lly_lrx_lry_ulx_uly_urx_ury
+    # skip first line, keep frame and sign numbers as strings to keep their leading zeros
+    df = pd.read_csv(
+        file,
+        sep="_",
+        skiprows=1,
+        header=None,
+        names=["frame", "sign", "llx", "lly", "lrx", "lry", "ulx", "uly", "urx", "ury"],
+        dtype={"frame": str, "sign": str},
+    )
+
+    # get the centre of all boxes
+    x_center = (df["llx"] + df["lrx"]) / 2
+    y_center = (df["lly"] + df["uly"]) / 2
+
+    # get dims
+    width = (df["llx"] - df["lrx"]).abs()
+    height = (df["lly"] - df["uly"]).abs()
+
+    # box coordinates must be normalized from 0 - 1
+    # divide x_center and width by image width, y_center and height by image height
+    x_center_norm = (x_center / image_width).round(6)
+    width_norm = (width / image_width).round(6)
+    y_center_norm = (y_center / image_height).round(6)
+    height_norm = (height / image_height).round(6)
+
+    # class numbers should be zero-indexed (start from 0)
+    class_number = df["sign"].astype(int) - 1
+
+    # concatenate each row as:
+    # class_number x_center y_center width height
+    rows = (
+        class_number.astype(str)
+        + " "
+        + x_center_norm.astype(str)
+        + " "
+        + y_center_norm.astype(str)
+        + " "
+        + width_norm.astype(str)
+        + " "
+        + height_norm.astype(str)
+        + "\n"
+    )
+
+    # save output as:
+    # sequenceNumber_frameNumber.txt
+    # each file is written once with all of its boxes
+    for frame_number, frame_rows in rows.groupby(df["frame"], sort=False):
 
         dst = Path(
             "CURE-TSD",
@@ -102,27 +89,40 @@ for file in files:
             f"{sequence_number}_{frame_number}{file.suffix}",
         )
 
-        print(dst)
+        with dst.open("w") as f:
+            f.write("".join(frame_rows))
+
+    print(f"Processed {file.name}: {len(df)} boxes in {df['frame'].nunique()} frames")
+
+    return pd.DataFrame(
+        {
+            "file": sequence_number + "_" + df["frame"],
+            "sequence": sequence_number,
+            "frame": df["frame"],
+            "sign": df["sign"].map(signs),
+            "width": width_norm,
+            "height": height_norm,
+            "area": width_norm * height_norm,
+        }
+    )
 
-        # if file exists, it will be opened and the row appended
-        # otherwise, file will be created, opened and the row appended
-        # 'a' opens the file for appending and data is written to the end automatically
-        with dst.open("a") as f:
-            f.write(row)
 
-        data["file"].append(f"{sequence_number}_{frame_number}")
-        data["sequence"].append(sequence_number)
-        data["frame"].append(frame_number)
-        data["sign"].append(signs[sign_type])
-        data["width"].append(width_norm)
-        data["height"].append(height_norm)
-        data["area"].append(width_norm * height_norm)
+# %%
+# annotation files are named sequenceNumber.txt (see rename_labels.py)
+# frame label files (sequenceNumber_frameNumber.txt) are written to the same folder and are skipped
+files = [file for file in Path("CURE-TSD", "labels").glob("*.txt") if "_" not in file.stem]
+
+data = []
+
+for file in files:
+
+    data.append(extract_labels(file))
 
     # remvoe file after extracting its frames
     os.remove(file)
 
 # %%
-df = pd.DataFrame(data).sort_values(
+df = pd.concat(data, ignore_index=True).sort_values(
     by=["sequence", "frame"],
     ignore_index=True,
 )
@@ -1,59 +1,47 @@
 # %%
 import os
-import shutil
-from cProfile import label
 from pathlib import Path
 
+from challenges import challenge_levels, challenge_types
 
 # %%
-def copy_file(file, folder_name, sub_folder_name):
-    """move file to folder_name > sub_folder_name"""
+# annotations do not depend on the challenge type/level (see README)
+# so every challenge folder shares the labels in "CURE-TSD" > "labels" instead of holding its own copy
+labels = Path("CURE-TSD", "labels")
 
-    # 00 folder (No-challenge) does not have sub-folders
-    if folder_name != "00":
-
-        dst = Path(
-            "CURE-TSD",
-            folder_name,
-            sub_folder_name,
-            "labels",
-            f"{file.name}",
-        )
 
-        # if the destination does not exist, create it
-        if not dst.parent.exists():
-            dst.parent.mkdir(parents=True)
-
-        print(f"Copying {file.name} to {dst}")
+# %%
+def link_labels(folder_name, sub_folder_name):
+    """link folder_name > sub_folder_name > labels to the shared labels folder"""
 
+    # 00 folder (No-challenge) does not have sub-folders
+    if folder_name != "00":
+        dst = Path("CURE-TSD", folder_name, sub_folder_name, "labels")
     else:
+        dst = Path("CURE-TSD", folder_name, "labels")
 
-        dst = Path(
-            "CURE-TSD",
-            folder_name,
-            "labels",
-            f"{file.name}",
-        )
+    if dst.is_symlink() or dst.exists():
+        print(f"Skipping {dst}, it already exists")
+        return
 
-        # if the destination does not exist, create it
-        if not dst.parent.exists():
-            dst.parent.mkdir(parents=True)
+    dst.parent.mkdir(parents=True, exist_ok=True)
 
-        print(f"Copying {file.name} to {dst}")
+    # relative link so the dataset can be moved as a whole
+    src = os.path.relpath(labels, dst.parent)
 
-    shutil.copy(src=file, dst=dst)
+    print(f"Linking {dst} to {src}")
 
+    dst.symlink_to(src, target_is_directory=True)
 
-# %%
-files = Path("CURE-TSD", "labels").glob("*.txt")
 
-for file in files:
-    for folder_name in ["00", "09", "11", "12"]:
-        for sub_folder_name in ["01", "02", "03", "04", "05"]:
+# %%
+for folder_name in challenge_types:
+    for sub_folder_name in challenge_levels:
 
-            copy_file(file, folder_name, sub_folder_name)
+        link_labels(folder_name, sub_folder_name)
 
-    # remove file
-    os.remove(file)
+        # 00 folder (No-challenge) only needs one link
+        if folder_name == "00":
+            break
 
 # %%
@@ -1,11 +1,17 @@
 # %%
-import shutil
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
+from challenges import challenge_levels, challenge_types
+
+# %%
+# a different ratio or seed only rewrites the manifests, no image or label is moved
+test_size = 0.3
+random_state = 42
+
 # %%
 df = pd.read_csv(
     Path("CURE-TSD", "labels", "lables.csv"),
@@ -14,10 +20,10 @@ df = pd.read_csv(
 
 df_train, df_val = train_test_split(
     df,
-    test_size=0.3,
+    test_size=test_size,
     stratify=df["sign"],
     shuffle=True,
-    random_state=42,
+    random_state=random_state,
 )
 
 # since each sign has a row, the same frame/image per sequence can be duplicated
@@ -40,105 +46,67 @@ val_files = df_val["file"].to_list()
 df_train.to_csv(Path("CURE-TSD", "labels", "train.csv"))
 df_val.to_csv(Path("CURE-TSD", "labels", "val.csv"))
 
-
 # %%
-def move_files(files, src, to):
-
-    for file in files:
-
-        # move images
-        images_src = Path(src, "images", f"{file}.jpg")
-        images_dst = Path(src, "images", to)
-
-        # if the images destination does not exist, create it
-        if not images_dst.exists():
-            images_dst.mkdir(parents=True)
-
-        print(f"Moving {images_src} to {images_dst}")
-        shutil.move(
-            src=images_src,
-            dst=images_dst,
-        )
+# get remaining images (these do not have lables)
+# every challenge type/level has the same frames, so one folder is used for all of them
+labelled = set(df["file"])
 
-        # move lables
-        labels_src = Path(src, "labels", f"{file}.txt")
-        labels_dst = Path(src, "labels", to)
+if "00" in challenge_types:
+    images = Path("CURE-TSD", "00", "images").glob("*.jpg")
+else:
+    images = Path(
+        "CURE-TSD", challenge_types[0], challenge_levels[0], "images"
+    ).glob("*.jpg")
 
-        # if the labels destination does not exist, create it
-        if not labels_dst.exists():
-            labels_dst.mkdir(parents=True)
+train_images, val_images = train_test_split(
+    np.array(sorted(image.stem for image in images if image.stem not in labelled)),
+    test_size=test_size,
+    shuffle=True,
+    random_state=random_state,
+)
 
-        print(f"Moving {labels_src} to {labels_dst}")
-        shutil.move(
-            src=labels_src,
-            dst=labels_dst,
-        )
+train_files = sorted(train_files + train_images.tolist())
+val_files = sorted(val_files + val_images.tolist())
 
 
 # %%
-for challenge_type in ["00", "09", "11", "12"]:
+def write_manifest(files, src, to, manifest):
+    """write src > to.txt listing src > images > file.jpg for each file, relative to src"""
 
-    if challenge_type != "00":
-        for challenge_level in ["01", "02", "03", "04", "05"]:
+    lines = [f"./images/{file}.jpg\n" for file in files]
 
-            # create full path
-            src = Path("CURE-TSD", challenge_type, challenge_level)
+    dst = Path(src, f"{to}.txt")
 
-            move_files(files=train_files, src=src, to="train")
-            move_files(files=val_files, src=src, to="val")
+    print(f"Writing {len(lines)} images to {dst}")
 
-    else:
-        # create full path
-        src = Path("CURE-TSD", challenge_type)
+    with dst.open("w") as f:
+        f.writelines(lines)
 
-        move_files(files=train_files, src=src, to="train")
-        move_files(files=val_files, src=src, to="val")
-
-# %%
-# get remaining images (these do not have lables)
-images = Path("CURE-TSD", "00", "images").glob("*.jpg")
-
-train_images, val_images = train_test_split(
-    np.array([image.name for image in images]),
-    test_size=0.3,
-    shuffle=True,
-    random_state=42,
-)
+    # the combined manifest lives in "CURE-TSD" so paths are relative to it
+    prefix = f"./{src.relative_to('CURE-TSD').as_posix()}/"
+    manifest.writelines(prefix + line[2:] for line in lines)
 
 
 # %%
-def move_remaining_images(images, src, to):
-
-    for image in images:
-
-        # move images
-        images_src = Path(src, image)
-        images_dst = Path(src, to)
+for to, files in [("train", train_files), ("val", val_files)]:
 
-        print(f"Moving {images_src} to {images_dst}")
-        shutil.move(
-            src=images_src,
-            dst=images_dst,
-        )
+    # combined manifest for all challenge types/levels
+    with Path("CURE-TSD", f"{to}.txt").open("w") as manifest:
 
+        for challenge_type in challenge_types:
 
-# %%
-for challenge_type in ["00", "09", "11", "12"]:
-
-    if challenge_type != "00":
-        for challenge_level in ["01", "02", "03", "04", "05"]:
+            if challenge_type != "00":
+                for challenge_level in challenge_levels:
 
-            # create full path
-            src = Path("CURE-TSD", challenge_type, challenge_level, "images")
+                    # create full path
+                    src = Path("CURE-TSD", challenge_type, challenge_level)
 
-            move_remaining_images(images=train_images, src=src, to="train")
-            move_remaining_images(images=val_images, src=src, to="val")
+                    write_manifest(files=files, src=src, to=to, manifest=manifest)
 
-    else:
-        # create full path
-        src = Path("CURE-TSD", challenge_type, "images")
+            else:
+                # create full path
+                src = Path("CURE-TSD", challenge_type)
 
-        move_remaining_images(images=train_images, src=src, to="train")
-        move_remaining_images(images=val_images, src=src, to="val")
+                write_manifest(files=files, src=src, to=to, manifest=manifest)
 
 # %%
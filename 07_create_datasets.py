@@ -3,6 +3,8 @@ from pathlib import Path
 
 from yaml import dump
 
+from challenges import challenge_levels, challenge_types
+
 # %%
 data = {
     "nc": 14,
@@ -22,18 +24,20 @@ data = {
         "12-yield",
         "13-parking",
     ],
+    # labels are shared by every challenge type/level and looked up by image name
+    "labels": str(Path("CURE-TSD", "labels")),
 }
 
 # %%
-for challenge_type in ["00", "09", "11", "12"]:
+for challenge_type in challenge_types:
 
     if challenge_type != "00":
-        for challenge_level in ["01", "02", "03", "04", "05"]:
+        for challenge_level in challenge_levels:
 
             path = Path("CURE-TSD", challenge_type, challenge_level)
 
-            data["train"] = str(Path(path, "images", "train"))
-            data["val"] = str(Path(path, "images", "val"))
+            data["train"] = str(Path(path, "train.txt"))
+            data["val"] = str(Path(path, "val.txt"))
 
             with Path(path, "dataset.yaml").open("w") as stream:
                 dump(data, stream)
@@ -41,8 +45,8 @@ for challenge_type in ["00", "09", "11", "12"]:
     else:
         path = Path("CURE-TSD", challenge_type)
 
-        data["train"] = str(Path(path, "images", "train"))
-        data["val"] = str(Path(path, "images", "val"))
+        data["train"] = str(Path(path, "train.txt"))
+        data["val"] = str(Path(path, "val.txt"))
 
         with Path(path, "dataset.yaml").open("w") as stream:
             dump(data, stream)
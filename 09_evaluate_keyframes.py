@@ -0,0 +1,182 @@
+# %%
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from challenges import challenge_levels, challenge_types
+
+sys.path.append("yolov5")
+
+from detect import run  # noqa: E402
+
+# %%
+weights = Path("yolov5", "runs", "train", "exp", "weights", "best.pt")
+imgsz = 640
+conf_thres = 0.25
+
+# a prediction is a true positive if it overlaps an unmatched sign of the same class
+# by at least iou_thres
+iou_thres = 0.5
+
+# full inference on every n-th frame, 1 runs the model on every frame
+keyframes = [1, 3, 5, 10]
+
+# a scene change (mean grey difference to the last keyframe) also runs the full model
+motion_thres = 0.05
+
+project = Path("CURE-TSD", "keyframes")
+
+
+# %%
+def read_boxes(file):
+    """read a label file as rows of class, x1, y1, x2, y2 (normalised)
+    sorted by confidence if it is saved"""
+
+    if not file.exists():
+        return np.zeros((0, 5))
+
+    x = np.loadtxt(file, ndmin=2)
+
+    if x.shape[1] > 5:
+        x = x[np.argsort(-x[:, 5], kind="stable")]
+
+    xy, wh = x[:, 1:3], x[:, 3:5]
+
+    return np.concatenate([x[:, :1], xy - wh / 2, xy + wh / 2], 1)
+
+
+def area(x):
+    """area of class, x1, y1, x2, y2 rows"""
+
+    return (x[:, 3] - x[:, 1]) * (x[:, 4] - x[:, 2])
+
+
+def count_matches(pred, true):
+    """return the true positives, false positives and false negatives of one frame"""
+
+    # IoU is the same in normalised and pixel coordinates
+    lt = np.maximum(pred[:, None, 1:3], true[None, :, 1:3])
+    rb = np.minimum(pred[:, None, 3:5], true[None, :, 3:5])
+    inter = (rb - lt).clip(0).prod(2)
+    iou = inter / (area(pred)[:, None] + area(true)[None] - inter)
+    iou[pred[:, None, 0] != true[None, :, 0]] = 0
+
+    # greedy matching, most confident predictions first
+    tp = 0
+    for row in iou if len(true) else []:
+        j = row.argmax()
+        if row[j] >= iou_thres:
+            iou[:, j] = 0
+            tp += 1
+
+    return tp, len(pred) - tp, len(true) - tp
+
+
+def evaluate(folder, name, keyframe):
+    """run detect.py on the videos in folder
+    return frames, seconds, true positives, false positives and false negatives"""
+
+    videos = sorted(folder.glob("*.mp4"))
+
+    # seconds from the end of the model warmup to the last frame, loading the
+    # model is not timed
+    _, seconds = run(
+        weights=weights,
+        source=folder,
+        imgsz=(imgsz, imgsz),
+        conf_thres=conf_thres,
+        nosave=True,
+        save_txt=True,
+        save_conf=True,
+        project=project,
+        name=name,
+        exist_ok=True,
+        keyframe=keyframe,
+        motion_thres=motion_thres,
+    )
+
+    frames = tp = fp = fn = 0
+
+    for video in videos:
+
+        cap = cv2.VideoCapture(str(video))
+        n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        # detect.py saves video_frame.txt, labels are sequenceNumber_frameNumber.txt
+        for frame in range(1, n + 1):
+            pred = Path(project, name, "labels", f"{video.stem}_{frame}.txt")
+            true = Path("CURE-TSD", "labels", f"{video.stem}_{frame:03}.txt")
+            counts = count_matches(read_boxes(pred), read_boxes(true))
+            tp, fp, fn = tp + counts[0], fp + counts[1], fn + counts[2]
+
+        frames += n
+
+    return frames, seconds, tp, fp, fn
+
+
+# %%
+rows = []
+
+for challenge_type in challenge_types:
+
+    # 00 folder (No-challenge) does not have sub-folders
+    if challenge_type != "00":
+        folders = {
+            challenge_level: Path("CURE-TSD", challenge_type, challenge_level)
+            for challenge_level in challenge_levels
+        }
+    else:
+        folders = {"00": Path("CURE-TSD", challenge_type)}
+
+    for challenge_level, folder in folders.items():
+
+        if not any(folder.glob("*.mp4")):
+            print(f"Skipping {folder}, it has no videos")
+            continue
+
+        for keyframe in keyframes:
+
+            name = f"{challenge_type}_{challenge_level}_k{keyframe}"
+            frames, seconds, tp, fp, fn = evaluate(folder, name, keyframe)
+
+            rows.append(
+                {
+                    "challenge_type": challenge_type,
+                    "challenge_level": challenge_level,
+                    "keyframe": keyframe,
+                    "frames": frames,
+                    "seconds": seconds,
+                    "tp": tp,
+                    "fp": fp,
+                    "fn": fn,
+                }
+            )
+
+df = pd.DataFrame(rows)
+df.to_csv(Path(project, "keyframes.csv"))
+
+# %%
+# precision/recall and throughput per challenge type for each keyframe interval
+report = df.groupby(["challenge_type", "keyframe"])[
+    ["frames", "seconds", "tp", "fp", "fn"]
+].sum()
+
+report["precision"] = report["tp"] / (report["tp"] + report["fp"]).clip(lower=1)
+report["recall"] = report["tp"] / (report["tp"] + report["fn"]).clip(lower=1)
+report["fps"] = report["frames"] / report["seconds"]
+
+# relative to the model running on every frame (smallest keyframe interval)
+report["speedup"] = report["fps"] / report.groupby("challenge_type")["fps"].transform(
+    "first"
+)
+
+report = report[["precision", "recall", "fps", "speedup"]].round(3).unstack("keyframe")
+report.to_csv(Path(project, "report.csv"))
+
+print(report)
+
+# %%
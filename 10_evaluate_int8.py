@@ -0,0 +1,96 @@
+# %%
+import sys
+from pathlib import Path
+
+import pandas as pd
+from yaml import dump, safe_load
+
+sys.path.append("yolov5")
+
+from export import run as export  # noqa: E402
+from val import run_matrix  # noqa: E402
+
+# %%
+weights = Path("yolov5", "runs", "train", "exp", "weights", "best.pt")
+imgsz = 640
+
+# training images (of every challenge type/level) used to calibrate the INT8
+# activation ranges, spread evenly over the frames
+ncalib = 300
+
+project = Path("CURE-TSD", "int8")
+
+# FP32 and INT8 model of each CPU backend, the PyTorch FP32 model is the
+# TorchScript export so only the precision differs
+backends = {
+    "pytorch": (
+        weights.with_suffix(".torchscript"),
+        weights.with_name(f"{weights.stem}-int8.torchscript"),
+    ),
+    "onnxruntime": (
+        weights.with_suffix(".onnx"),
+        weights.with_name(f"{weights.stem}-int8.onnx"),
+    ),
+}
+
+# %%
+# dataset.yaml of the training images of every challenge type/level
+with next(Path("CURE-TSD").glob("**/dataset.yaml")).open() as stream:
+    data = safe_load(stream)
+
+data["train"] = str(Path("CURE-TSD", "train.txt"))
+
+project.mkdir(parents=True, exist_ok=True)
+
+with Path(project, "calibration.yaml").open("w") as stream:
+    dump(data, stream)
+
+export(
+    data=Path(project, "calibration.yaml"),
+    weights=weights,
+    imgsz=(imgsz, imgsz),
+    include=("torchscript", "onnx"),
+    int8=True,
+    ncalib=ncalib,
+)
+
+# %%
+# mAP delta and latency gain of INT8 over FP32 per challenge type/level,
+# reported by val.py for each backend
+reports = []
+
+for backend, (fp32, int8) in backends.items():
+
+    if not fp32.exists() or not int8.exists():
+        print(f"Skipping {backend}, {fp32} or {int8} was not exported")
+        continue
+
+    # batch size 1 on the CPU, latency is per image as served
+    df = run_matrix(
+        data=Path("CURE-TSD"),
+        weights=int8,
+        baseline=fp32,
+        batch_size=1,
+        imgsz=imgsz,
+        device="cpu",
+        half=False,
+        project=project,
+        name=backend,
+        exist_ok=True,
+        plots=False,
+    )
+
+    df["backend"] = backend
+    reports.append(df)
+
+df = pd.concat(reports)
+df.to_csv(Path(project, "int8.csv"))
+
+report = df.set_index(["type", "level", "backend"])[
+    ["mAP@.5 delta", "mAP@.5:.95 delta", "inference ms", "speedup"]
+].round(3)
+report.to_csv(Path(project, "report.csv"))
+
+print(report)
+
+# %%
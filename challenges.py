@@ -0,0 +1,9 @@
+import os
+
+# {"00": "No-challenge", "09": "Rain", "11": "Snow", "12": "Haze"}
+# prepare_data.py sets CURE_TSD_CHALLENGE_TYPES to run a stage for some challenge types only
+challenge_types = os.getenv("CURE_TSD_CHALLENGE_TYPES", "00 09 11 12").split()
+
+# 01 is the least severe and 05 is the most severe challenge
+# 00 (No-challenge) does not have levels
+challenge_levels = ["01", "02", "03", "04", "05"]
@@ -2,14 +2,16 @@
 import shutil
 from pathlib import Path
 
+from challenges import challenge_levels, challenge_types
+
 
 # %%
 def move_files(ext, folder):
     # move images to the images folder for each challenge level
-    for challenge_type in ["00", "09", "11", "12"]:
+    for challenge_type in challenge_types:
 
         if challenge_type != "00":
-            for challenge_level in ["01", "02", "03", "04", "05"]:
+            for challenge_level in challenge_levels:
 
                 files = Path(
                     "CURE-TSD",
@@ -0,0 +1,221 @@
+"""
+Run the CURE-TSD data preparation scripts (01 - 07) as a DAG of cached stages.
+
+Each stage runs one of the numbered scripts in a subprocess. A stage is skipped when its script, settings and
+input files are unchanged since its last successful run and its output files are still the ones it produced.
+Stages whose dependencies are done run in parallel, e.g. frame extraction for one challenge type alongside
+label conversion. Frame extraction stages running together share the CPU cores instead of each using all of them.
+
+Usage:
+    $ python prepare_data.py                                  # all stages, challenge types 00 09 11 12
+    $ python prepare_data.py --challenge-types 00 09 11 12 01  # only stages affected by adding 01 re-run
+    $ python prepare_data.py --force extract_labels          # re-run one stage (and whatever it changes)
+    $ python prepare_data.py --dry-run                       # show what would run
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import List, NamedTuple
+
+ROOT = Path(__file__).resolve().parent
+DATA = Path("CURE-TSD")
+CACHE = Path(DATA, ".pipeline")  # per-stage records and logs
+
+
+class Stage(NamedTuple):
+    name: str
+    script: str
+    deps: List[str]  # stages that must be done first
+    inputs: List[str]  # globs relative to CURE-TSD
+    outputs: List[str]  # globs relative to CURE-TSD
+    challenge_types: List[str]  # passed to the script through CURE_TSD_CHALLENGE_TYPES
+
+
+def build_stages(challenge_types):
+    """return the preparation DAG for challenge_types"""
+
+    def folders(challenge_type):
+        # 00 folder (No-challenge) does not have sub-folders
+        return [challenge_type] if challenge_type == "00" else [f"{challenge_type}/*"]
+
+    extract = [f"extract_frames_{challenge_type}" for challenge_type in challenge_types]
+
+    # split_train_val.py lists the frames of one challenge type, 00 if it is used
+    listed = "00" if "00" in challenge_types else challenge_types[0]
+
+    stages = [
+        Stage("move_data", "01_move_data.py", [], ["data/*.mp4"], [], challenge_types),
+        *(
+            Stage(
+                f"extract_frames_{challenge_type}",
+                "02_extract_frames.py",
+                ["move_data"],
+                [f"{x}/*.mp4" for x in folders(challenge_type)],
+                [f"{x}/images/*.jpg" for x in folders(challenge_type)],
+                [challenge_type],
+            )
+            for challenge_type in challenge_types
+        ),
+        # labels do not depend on the challenge type/level
+        Stage("rename_labels", "03_rename_labels.py", [], ["labels/??_??.txt"], [], []),
+        Stage(
+            "extract_labels",
+            "04_extract_labels.py",
+            ["rename_labels"],
+            ["labels/??.txt"],
+            ["labels/lables.csv"],
+            [],
+        ),
+        Stage("copy_labels", "05_copy_labels.py", ["move_data"], [], [], challenge_types),
+        Stage(
+            "split_train_val",
+            "06_split_train_val.py",
+            ["extract_labels", "copy_labels", *extract],
+            ["labels/lables.csv", *(f"{x}/images/*.jpg" for x in folders(listed))],
+            ["train.txt", "val.txt"],
+            challenge_types,
+        ),
+        Stage("create_datasets", "07_create_datasets.py", ["split_train_val"], [], [], challenge_types),
+    ]
+
+    return {stage.name: stage for stage in stages}
+
+
+def fingerprint(globs):
+    """hash the path, size and mtime of every file matching globs"""
+
+    h = hashlib.sha1()
+
+    for pattern in globs:
+        for file in sorted(DATA.glob(pattern)):
+            st = file.stat()
+            h.update(f"{file.as_posix()}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+
+    return h.hexdigest()
+
+
+def stage_key(stage):
+    """content address of a stage: script source, settings and input files"""
+
+    h = hashlib.sha1(Path(stage.script).read_bytes())
+    h.update(" ".join(stage.challenge_types).encode())
+    h.update(fingerprint(stage.inputs).encode())
+
+    return h.hexdigest()
+
+
+def is_cached(stage):
+    """True if stage already ran on the same inputs and its outputs are untouched"""
+
+    record = Path(CACHE, f"{stage.name}.json")
+
+    if not record.exists():
+        return False
+
+    with record.open("r") as f:
+        record = json.load(f)
+
+    # most scripts move or remove their inputs, so the key after the run is accepted too
+    key = stage_key(stage)
+    return key in (record["key"], record["key_after"]) and fingerprint(stage.outputs) == record["outputs"]
+
+
+def run_stage(stage, cpus):
+    """run the script of stage with at most cpus worker processes and record its key and outputs"""
+
+    key = stage_key(stage)
+
+    env = os.environ.copy()
+    env["CURE_TSD_CHALLENGE_TYPES"] = " ".join(stage.challenge_types)
+    env["CURE_TSD_WORKERS"] = str(cpus)
+
+    # one log per stage, stages run in parallel so their output is not interleaved
+    with Path(CACHE, f"{stage.name}.log").open("w") as log:
+        subprocess.run([sys.executable, stage.script], env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+
+    record = {"key": key, "key_after": stage_key(stage), "outputs": fingerprint(stage.outputs)}
+
+    with Path(CACHE, f"{stage.name}.json").open("w") as f:
+        json.dump(record, f, indent=2)
+
+    return stage
+
+
+def run(challenge_types=("00", "09", "11", "12"), workers=4, force=(), dry_run=False):
+    os.chdir(ROOT)  # scripts use paths relative to the repository root
+    CACHE.mkdir(parents=True, exist_ok=True)
+
+    stages = build_stages(list(challenge_types))
+
+    for name in force:
+        assert name == "all" or name in stages, f"unknown stage {name}, stages are {list(stages)}"
+
+    pending, running, done, failed = dict(stages), {}, set(), []
+
+    # extract_frames stages each start a process per core, the cores are split between those that can run together
+    parallel = min(workers, sum(name.startswith("extract_frames_") for name in stages)) or 1
+    cpus = max((os.cpu_count() or 1) // parallel, 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        while pending or running:
+
+            # start every stage whose dependencies are done
+            for name, stage in list(pending.items()):
+
+                if any(dep in failed for dep in stage.deps):
+                    print(f"{name}: skipped, a dependency failed")
+                    failed.append(pending.pop(name).name)
+
+                elif all(dep in done for dep in stage.deps):
+                    pending.pop(name)
+
+                    if name not in force and "all" not in force and is_cached(stage):
+                        print(f"{name}: cached")
+                        done.add(name)
+                    elif dry_run:
+                        print(f"{name}: would run {stage.script}")
+                        done.add(name)
+                    else:
+                        print(f"{name}: running {stage.script}")
+                        running[pool.submit(run_stage, stage, cpus)] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+
+                name = running.pop(future)
+
+                try:
+                    future.result()
+                    print(f"{name}: done")
+                    done.add(name)
+                except subprocess.CalledProcessError:
+                    print(f"{name}: failed, see {Path(CACHE, name + '.log')}")
+                    failed.append(name)
+
+    if failed:
+        raise SystemExit(f"Failed stages: {', '.join(failed)}")
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--challenge-types", nargs="+", default=["00", "09", "11", "12"], help="challenge types")
+    parser.add_argument("--workers", type=int, default=4, help="max stages running at the same time")
+    parser.add_argument("--force", nargs="+", default=[], help="stages to re-run even if cached, or all")
+    parser.add_argument("--dry-run", action="store_true", help="only show which stages would run")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    run(**vars(opt))
@@ -8,8 +8,8 @@ import pandas as pd
 from cv_utils import draw_polygons, poly_norm_to_abs
 
 # %%
-image = Path("CURE-TSD", "00", "images", "train", "01_063.jpg")
-labels = Path("CURE-TSD", "00", "labels", "train", "01_063.txt")
+image = Path("CURE-TSD", "00", "images", "01_063.jpg")
+labels = Path("CURE-TSD", "labels", "01_063.txt")
 
 # %%
 img = cv2.imread(
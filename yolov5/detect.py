@@ -40,11 +40,13 @@ if str(ROOT) not in sys.path:
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import DetectMultiBackend
+from models.yolo import Detect
 from utils.datasets import IMG_FORMATS, VID_FORMATS, LoadImages, LoadStreams
 from utils.general import (LOGGER, check_file, check_img_size, check_imshow, check_requirements, colorstr,
                            increment_path, non_max_suppression, print_args, scale_coords, strip_optimizer, xyxy2xywh)
 from utils.plots import Annotator, colors, save_one_box
-from utils.torch_utils import select_device, time_sync
+from utils.torch_utils import select_device, tile_img, time_sync, untile_pred
+from utils.tracking import KeyframeTracker
 
 
 @torch.no_grad()
@@ -74,6 +76,13 @@ def run(weights=ROOT / 'yolov5s.pt',  # model.pt path(s)
         hide_conf=False,  # hide confidences
         half=False,  # use FP16 half-precision inference
         dnn=False,  # use OpenCV DNN for ONNX inference
+        batch_size=1,  # frames per inference for file/video sources
+        workers=0,  # prefetch file/video sources with this many pre-processing threads, 0 to read synchronously
+        topk=0,  # decode only the top-k anchors per level above conf_thres before NMS, 0 for all (default)
+        tile=0,  # sliced inference on overlapping tile x tile crops of the imgsz image, 0 for none
+        tile_overlap=0.2,  # min overlap between neighbouring tiles, fraction of tile
+        keyframe=0,  # full inference on every n-th frame of file/video sources, boxes tracked in between, 0 for all
+        motion_thres=0.05,  # also full inference when the mean grey difference to the last keyframe exceeds this
         ):
     source = str(source)
     save_img = not nosave and not source.endswith('.txt')  # save inference images
@@ -92,11 +101,19 @@ def run(weights=ROOT / 'yolov5s.pt',  # model.pt path(s)
     model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data)
     stride, names, pt, jit, onnx, engine = model.stride, model.names, model.pt, model.jit, model.onnx, model.engine
     imgsz = check_img_size(imgsz, s=stride)  # check image size
+    tile = check_img_size(tile, s=stride) if tile else 0  # check tile size
 
     # Half
     half &= (pt or jit or onnx or engine) and device.type != 'cpu'  # FP16 supported on limited backends with CUDA
     if pt or jit:
         model.model.half() if half else model.model.float()
+    elif batch_size > 1:
+        batch_size = model.batch_size if engine else 1  # export.py models default to batch-size 1
+        LOGGER.info(f'Forcing --batch-size {batch_size} for non-PyTorch backends')
+    if pt and topk:  # pre-NMS filter
+        for m in model.model.modules():
+            if isinstance(m, Detect):
+                m.conf_thres, m.topk = conf_thres, topk
 
     # Dataloader
     if webcam:
@@ -105,13 +122,14 @@ def run(weights=ROOT / 'yolov5s.pt',  # model.pt path(s)
         dataset = LoadStreams(source, img_size=imgsz, stride=stride, auto=pt)
         bs = len(dataset)  # batch_size
     else:
-        dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt)
-        bs = 1  # batch_size
+        dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt, batch_size=batch_size, workers=workers)
+        bs = 1  # batch_size, frames of a batch come from one video
+    tracker = KeyframeTracker(keyframe, motion_thres) if keyframe > 1 and not webcam else None
     vid_path, vid_writer = [None] * bs, [None] * bs
 
     # Run inference
-    model.warmup(imgsz=(1, 3, *imgsz), half=half)  # warmup
-    dt, seen = [0.0, 0.0, 0.0], 0
+    model.warmup(imgsz=(1, 3, *([tile] * 2 if tile else imgsz)), half=half)  # warmup
+    dt, seen, t0 = [0.0, 0.0, 0.0], 0, time_sync()
     for path, im, im0s, vid_cap, s in dataset:
         t1 = time_sync()
         im = torch.from_numpy(im).to(device)
@@ -123,13 +141,29 @@ def run(weights=ROOT / 'yolov5s.pt',  # model.pt path(s)
         dt[0] += t2 - t1
 
         # Inference
-        visualize = increment_path(save_dir / Path(path).stem, mkdir=True) if visualize else False
-        pred = model(im, augment=augment, visualize=visualize)
+        p0 = path[0] if dataset.prefetch else path  # first frame of a batch
+        visualize = increment_path(save_dir / Path(p0).stem, mkdir=True) if visualize else False
+        if tracker:  # only keyframes go through the model
+            frames, paths = (im0s, path) if dataset.prefetch else ([im0s], [path])
+            keys = tracker.select(frames, [p if dataset.mode == 'video' else None for p in paths])
+            im = im[keys]
+        if not len(im):  # no keyframe in this batch
+            pred = []
+        elif tile:  # overlapping tiles of all frames in one batch, NMS below merges them across tiles
+            tiles, offsets = tile_img(im, tile, tile_overlap)
+            pred = untile_pred(model(tiles, augment=augment, visualize=visualize), offsets)
+        else:
+            pred = model(im, augment=augment, visualize=visualize)
         t3 = time_sync()
         dt[1] += t3 - t2
 
         # NMS
-        pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+        if len(pred):
+            pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+        if tracker:  # keyframe boxes to im0 size, boxes of the other frames from the tracker
+            for det, im0 in zip(pred, (im0 for im0, key in zip(frames, keys) if key)):
+                det[:, :4] = scale_coords(im.shape[2:], det[:, :4], im0.shape)
+            pred = tracker.update(pred)
         dt[2] += time_sync() - t3
 
         # Second-stage classifier (optional)
@@ -141,6 +175,8 @@ def run(weights=ROOT / 'yolov5s.pt',  # model.pt path(s)
             if webcam:  # batch_size >= 1
                 p, im0, frame = path[i], im0s[i].copy(), dataset.count
                 s += f'{i}: '
+            elif dataset.prefetch:  # batch of frames
+                p, im0, frame, s = path[i], im0s[i].copy(), dataset.frame[i], dataset.s[i]
             else:
                 p, im0, frame = path, im0s.copy(), getattr(dataset, 'frame', 0)
 
@@ -153,7 +189,9 @@ def run(weights=ROOT / 'yolov5s.pt',  # model.pt path(s)
             annotator = Annotator(im0, line_width=line_thickness, example=str(names))
             if len(det):
                 # Rescale boxes from img_size to im0 size
-                det[:, :4] = scale_coords(im.shape[2:], det[:, :4], im0.shape).round()
+                if not tracker:  # tracker boxes are already im0 size
+                    det[:, :4] = scale_coords(im.shape[2:], det[:, :4], im0.shape)
+                det[:, :4] = det[:, :4].round()
 
                 # Print results
                 for c in det[:, -1].unique():
@@ -189,10 +227,11 @@ def run(weights=ROOT / 'yolov5s.pt',  # model.pt path(s)
                 if dataset.mode == 'image':
                     cv2.imwrite(save_path, im0)
                 else:  # 'video' or 'stream'
-                    if vid_path[i] != save_path:  # new video
-                        vid_path[i] = save_path
-                        if isinstance(vid_writer[i], cv2.VideoWriter):
-                            vid_writer[i].release()  # release previous video writer
+                    j = i if webcam else 0  # one writer per stream
+                    if vid_path[j] != save_path:  # new video
+                        vid_path[j] = save_path
+                        if isinstance(vid_writer[j], cv2.VideoWriter):
+                            vid_writer[j].release()  # release previous video writer
                         if vid_cap:  # video
                             fps = vid_cap.get(cv2.CAP_PROP_FPS)
                             w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -200,17 +239,21 @@ def run(weights=ROOT / 'yolov5s.pt',  # model.pt path(s)
                         else:  # stream
                             fps, w, h = 30, im0.shape[1], im0.shape[0]
                             save_path += '.mp4'
-                        vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
-                    vid_writer[i].write(im0)
+                        vid_writer[j] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+                    vid_writer[j].write(im0)
 
     # Print results
+    seconds = time_sync() - t0  # wall time of all frames after warmup, reading and saving included
     t = tuple(x / seen * 1E3 for x in dt)  # speeds per image
     LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}' % t)
+    if tracker:
+        LOGGER.info(f'Keyframes: {tracker.keyframes}/{tracker.total} frames through the model, the others tracked')
     if save_txt or save_img:
         s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ''
         LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
     if update:
         strip_optimizer(weights)  # update model (to fix SourceChangeWarning)
+    return seen, seconds
 
 
 def parse_opt():
@@ -241,6 +284,13 @@ def parse_opt():
     parser.add_argument('--hide-conf', default=False, action='store_true', help='hide confidences')
     parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
     parser.add_argument('--dnn', action='store_true', help='use OpenCV DNN for ONNX inference')
+    parser.add_argument('--batch-size', type=int, default=1, help='frames per inference for file/video sources')
+    parser.add_argument('--workers', type=int, default=0, help='prefetch file/video sources with n threads, 0 for none')
+    parser.add_argument('--topk', type=int, default=0, help='max anchors per level before NMS, i.e. 1000, 0 for all')
+    parser.add_argument('--tile', type=int, default=0, help='sliced inference tile size (pixels), 0 for none')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='min overlap between tiles, fraction of tile')
+    parser.add_argument('--keyframe', type=int, default=0, help='full inference every n-th video frame, 0 for all')
+    parser.add_argument('--motion-thres', type=float, default=0.05, help='scene change threshold for a new keyframe')
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(FILE.stem, opt)
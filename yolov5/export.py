@@ -15,14 +15,19 @@ TensorFlow GraphDef         | `pb`                          | yolov5s.pb
 TensorFlow Lite             | `tflite`                      | yolov5s.tflite
 TensorFlow Edge TPU         | `edgetpu`                     | yolov5s_edgetpu.tflite
 TensorFlow.js               | `tfjs`                        | yolov5s_web_model/
+TorchScript INT8            | `torchscript --int8`          | yolov5s-int8.torchscript
+ONNX INT8                   | `onnx --int8`                 | yolov5s-int8.onnx
 
 Usage:
     $ python path/to/export.py --weights yolov5s.pt --include torchscript onnx openvino engine coreml tflite ...
+    $ python path/to/export.py --weights yolov5s.pt --include torchscript onnx --int8 --data dataset.yaml  # CPU INT8
 
 Inference:
     $ python path/to/detect.py --weights yolov5s.pt                 # PyTorch
                                          yolov5s.torchscript        # TorchScript
                                          yolov5s.onnx               # ONNX Runtime or OpenCV DNN with --dnn
+                                         yolov5s-int8.torchscript   # TorchScript INT8
+                                         yolov5s-int8.onnx          # ONNX Runtime INT8
                                          yolov5s.xml                # OpenVINO
                                          yolov5s.engine             # TensorRT
                                          yolov5s.mlmodel            # CoreML (MacOS-only)
@@ -45,8 +50,10 @@ import platform
 import subprocess
 import sys
 import time
+from copy import deepcopy
 from pathlib import Path
 
+import numpy as np
 import torch
 import torch.nn as nn
 from torch.utils.mobile_optimizer import optimize_for_mobile
@@ -57,11 +64,11 @@ if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))  # add ROOT to PATH
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
-from models.common import Conv
+from models.common import SPP, SPPF, Conv
 from models.experimental import attempt_load
 from models.yolo import Detect
 from utils.activations import SiLU
-from utils.datasets import LoadImages
+from utils.datasets import LoadImages, LoadImagesAndLabels, LoadVideosAndLabels
 from utils.general import (LOGGER, check_dataset, check_img_size, check_requirements, check_version, colorstr,
                            file_size, print_args, url2file)
 from utils.torch_utils import select_device
@@ -86,6 +93,130 @@ def export_torchscript(model, im, file, optimize, prefix=colorstr('TorchScript:'
         LOGGER.info(f'{prefix} export failure: {e}')
 
 
+def calibration_images(data, im, ncalib, stride, prefix=colorstr('Calibration:')):
+    # Yields batches shaped as im of ncalib training images of dataset.yaml data, spread evenly over the (sequential)
+    # frames, for static INT8 quantization
+    data = check_dataset(data)
+    dataset = (LoadVideosAndLabels if data.get('video') else LoadImagesAndLabels)(
+        data['train'], max(im.shape[2:]), stride=stride, label_dir=data.get('labels'), prefix=f'{prefix} ')
+    LOGGER.info(f'{prefix} {min(ncalib, len(dataset))} of {len(dataset)} images of {data["train"]}')
+    batch = []
+    for i in np.linspace(0, len(dataset) - 1, min(ncalib, len(dataset))).round().astype(int):
+        x = dataset[i][0].float()[None] / 255  # uint8 to float32, letterboxed square
+        batch.append(x if x.shape[2:] == im.shape[2:] else nn.functional.interpolate(x, im.shape[2:]))
+        if len(batch) == im.shape[0]:
+            yield torch.cat(batch).to(im)
+            batch = []
+
+
+class QuantBody(nn.Module):
+    # YOLOv5 layers up to Detect() as one FX-traceable forward, returning the Detect() inputs
+    def __init__(self, model):
+        super().__init__()
+        self.model, self.save, self.f = model.model[:-1], model.save, model.model[-1].f
+
+    def forward(self, x):
+        y = []  # outputs
+        for m in self.model:
+            if m.f != -1:  # if not from previous layer
+                x = y[m.f] if isinstance(m.f, int) else [x if j == -1 else y[j] for j in m.f]  # from earlier layers
+            x = m(x)  # run
+            y.append(x if m.i in self.save else None)  # save output
+        return [y[j] for j in self.f]
+
+
+class QuantModel(nn.Module):
+    # Static INT8 YOLOv5 body with an FP32 Detect() head, which keeps box decoding and confidences at full precision
+    def __init__(self, body, detect):
+        super().__init__()
+        self.body, self.detect = body, detect
+
+    def forward(self, x):
+        return self.detect(self.body(x))
+
+
+def export_torchscript_int8(model, im, file, data, ncalib, prefix=colorstr('TorchScript INT8:')):
+    # YOLOv5 TorchScript static INT8 post-training quantization for CPU, loads as a TorchScript model
+    try:
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        engine = next(x for x in ('x86', 'fbgemm', 'qnnpack') if x in torch.backends.quantized.supported_engines)
+        LOGGER.info(f'\n{prefix} starting export with torch {torch.__version__} ({engine})...')
+        assert im.device.type == 'cpu' and im.dtype == torch.float32, 'INT8 export requires FP32 --device cpu'
+        f = str(file).replace('.pt', '-int8.torchscript')
+
+        torch.backends.quantized.engine = engine
+        # SPP()/SPPF() stay FP32, the TorchScript profiling executor rewrites their INT8 max-pools to an op without
+        # INT8 kernels, which fails from the second forward of the loaded model on
+        qconfig = get_default_qconfig_mapping(engine)
+        for i, m in enumerate(model.model[:-1]):
+            if isinstance(m, (SPP, SPPF)):
+                qconfig.set_module_name(f'model.{i}', None)
+        body = prepare_fx(QuantBody(deepcopy(model)), qconfig, (im,))  # Conv(+SiLU)
+        for x in calibration_images(data, im, ncalib, int(max(model.stride))):
+            body(x)  # observe activation ranges
+        qmodel = QuantModel(convert_fx(body), deepcopy(model.model[-1])).eval()
+
+        ts = torch.jit.trace(qmodel, im, strict=False)
+        d = {"shape": im.shape, "stride": int(max(model.stride)), "names": model.names}
+        ts.save(f, _extra_files={'config.txt': json.dumps(d)})
+
+        # Check, the loaded model optimizes its graph after the first forward (differently with autograd on), and must
+        # run at other batch sizes too
+        for grad in False, True:
+            ts = torch.jit.load(f)
+            with torch.set_grad_enabled(grad):
+                for n in im.shape[0], im.shape[0] + 1, im.shape[0]:
+                    ts(im[:1].expand(n, -1, -1, -1))
+
+        LOGGER.info(f'{prefix} export success, saved as {f} ({file_size(f):.1f} MB)')
+    except Exception as e:
+        LOGGER.info(f'\n{prefix} export failure: {e}')
+
+
+def export_onnx_int8(model, im, file, data, ncalib, prefix=colorstr('ONNX INT8:')):
+    # YOLOv5 ONNX Runtime static INT8 post-training quantization (QDQ), requires the ONNX export
+    try:
+        import onnx  # environment.yml, not installed here as pip could upgrade numpy in this process
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, quantize_static
+
+        LOGGER.info(f'\n{prefix} starting export with onnx {onnx.__version__}...')
+        f, f_onnx = str(file).replace('.pt', '-int8.onnx'), file.with_suffix('.onnx')
+        model_onnx = onnx.load(f_onnx)
+        graph, opset = model_onnx.graph, max(x.version for x in model_onnx.opset_import if x.domain in ('', 'ai.onnx'))
+
+        # Detect() output convs and everything after them stay FP32, as in export_torchscript_int8()
+        consumers = {}
+        for node in graph.node:
+            for x in node.input:
+                consumers.setdefault(x, []).append(node)
+        head = [n for n in graph.node if n.op_type == 'Conv' and
+                any(c.op_type == 'Reshape' for x in n.output for c in consumers.get(x, []))]  # conv, view()
+        exclude = set()
+        while head:
+            n = head.pop()
+            if n.name not in exclude:
+                exclude.add(n.name)
+                head += [c for x in n.output for c in consumers.get(x, [])]
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self.images = calibration_images(data, im, ncalib, int(max(model.stride)))
+
+            def get_next(self):
+                x = next(self.images, None)
+                return None if x is None else {graph.input[0].name: x.cpu().numpy()}
+
+        ops = {n.op_type for n in graph.node} - {'Constant', 'Resize'}  # not the empty Resize() roi constants
+        quantize_static(str(f_onnx), f, Reader(), quant_format=QuantFormat.QDQ, per_channel=opset >= 13,
+                        op_types_to_quantize=sorted(ops), nodes_to_exclude=list(exclude))
+
+        LOGGER.info(f'{prefix} export success, saved as {f} ({file_size(f):.1f} MB)')
+    except Exception as e:
+        LOGGER.info(f'\n{prefix} export failure: {e}')
+
+
 def export_onnx(model, im, file, opset, train, dynamic, simplify, prefix=colorstr('ONNX:')):
     # YOLOv5 ONNX export
     try:
@@ -102,7 +233,8 @@ def export_onnx(model, im, file, opset, train, dynamic, simplify, prefix=colorst
                           output_names=['output'],
                           dynamic_axes={'images': {0: 'batch', 2: 'height', 3: 'width'},  # shape(1,3,640,640)
                                         'output': {0: 'batch', 1: 'anchors'}  # shape(1,25200,85)
-                                        } if dynamic else None)
+                                        } if dynamic else None,
+                          **({'dynamo': False} if check_version(torch.__version__, '2.5.0') else {}))  # TorchScript
 
         # Checks
         model_onnx = onnx.load(f)  # load onnx model
@@ -379,7 +511,8 @@ def run(data=ROOT / 'data/coco128.yaml',  # 'dataset.yaml path'
         inplace=False,  # set YOLOv5 Detect() inplace=True
         train=False,  # model.train() mode
         optimize=False,  # TorchScript: optimize for mobile
-        int8=False,  # CoreML/TF INT8 quantization
+        int8=False,  # CoreML/TF/TorchScript/ONNX INT8 quantization
+        ncalib=300,  # TorchScript/ONNX INT8: calibration images
         dynamic=False,  # ONNX/TF: dynamic axes
         simplify=False,  # ONNX: simplify model
         opset=12,  # ONNX: opset version
@@ -400,6 +533,7 @@ def run(data=ROOT / 'data/coco128.yaml',  # 'dataset.yaml path'
     # Checks
     imgsz *= 2 if len(imgsz) == 1 else 1  # expand
     opset = 12 if ('openvino' in include) else opset  # OpenVINO requires opset <= 12
+    opset = max(opset, 13) if (int8 and 'onnx' in include and 'openvino' not in include) else opset  # per-channel QDQ
 
     # Load PyTorch model
     device = select_device(device)
@@ -432,10 +566,14 @@ def run(data=ROOT / 'data/coco128.yaml',  # 'dataset.yaml path'
     # Exports
     if 'torchscript' in include:
         export_torchscript(model, im, file, optimize)
+        if int8:
+            export_torchscript_int8(model, im, file, data, ncalib)
     if 'engine' in include:  # TensorRT required before ONNX
         export_engine(model, im, file, train, half, simplify, workspace, verbose)
     if ('onnx' in include) or ('openvino' in include):  # OpenVINO requires ONNX
         export_onnx(model, im, file, opset, train, dynamic, simplify)
+        if int8 and 'onnx' in include:
+            export_onnx_int8(model, im, file, data, ncalib)
     if 'openvino' in include:
         export_openvino(model, im, file)
     if 'coreml' in include:
@@ -476,7 +614,8 @@ def parse_opt():
     parser.add_argument('--inplace', action='store_true', help='set YOLOv5 Detect() inplace=True')
     parser.add_argument('--train', action='store_true', help='model.train() mode')
     parser.add_argument('--optimize', action='store_true', help='TorchScript: optimize for mobile')
-    parser.add_argument('--int8', action='store_true', help='CoreML/TF INT8 quantization')
+    parser.add_argument('--int8', action='store_true', help='CoreML/TF/TorchScript/ONNX INT8 quantization')
+    parser.add_argument('--ncalib', type=int, default=300, help='TorchScript/ONNX INT8: calibration images')
     parser.add_argument('--dynamic', action='store_true', help='ONNX/TF: dynamic axes')
     parser.add_argument('--simplify', action='store_true', help='ONNX: simplify model')
     parser.add_argument('--opset', type=int, default=12, help='ONNX: opset version')
@@ -25,7 +25,7 @@ from utils.datasets import exif_transpose, letterbox
 from utils.general import (LOGGER, check_requirements, check_suffix, check_version, colorstr, increment_path,
                            make_divisible, non_max_suppression, scale_coords, xywh2xyxy, xyxy2xywh)
 from utils.plots import Annotator, colors, save_one_box
-from utils.torch_utils import copy_attr, time_sync
+from utils.torch_utils import copy_attr, tile_img, time_sync, untile_pred
 
 
 def autopad(k, p=None):  # kernel, padding
@@ -326,7 +326,9 @@ class DetectMultiBackend(nn.Module):
             check_requirements(('onnx', 'onnxruntime-gpu' if cuda else 'onnxruntime'))
             import onnxruntime
             providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if cuda else ['CPUExecutionProvider']
-            session = onnxruntime.InferenceSession(w, providers=providers)
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()  # follow torch.set_num_threads(), i.e. per replica
+            session = onnxruntime.InferenceSession(w, sess_options=options, providers=providers)
         elif xml:  # OpenVINO
             LOGGER.info(f'Loading {w} for OpenVINO inference...')
             check_requirements(('openvino-dev',))  # requires openvino-dev: https://pypi.org/project/openvino-dev/
@@ -452,10 +454,10 @@ class DetectMultiBackend(nn.Module):
         y = torch.tensor(y) if isinstance(y, np.ndarray) else y
         return (y, []) if val else y
 
-    def warmup(self, imgsz=(1, 3, 640, 640), half=False):
+    def warmup(self, imgsz=(1, 3, 640, 640), half=False, cpu=False):
         # Warmup model by running inference once
         if self.pt or self.jit or self.onnx or self.engine:  # warmup types
-            if isinstance(self.device, torch.device) and self.device.type != 'cpu':  # only warmup GPU models
+            if isinstance(self.device, torch.device) and (self.device.type != 'cpu' or cpu):  # GPU models unless cpu
                 im = torch.zeros(*imgsz).to(self.device).type(torch.half if half else torch.float)  # input image
                 self.forward(im)  # warmup
 
@@ -469,6 +471,8 @@ class AutoShape(nn.Module):
     classes = None  # (optional list) filter by class, i.e. = [0, 15, 16] for COCO persons, cats and dogs
     max_det = 1000  # maximum number of detections per image
     amp = False  # Automatic Mixed Precision (AMP) inference
+    tile = None  # (optional int) sliced inference on overlapping tile x tile crops of the size image, i.e. = 640
+    tile_overlap = 0.2  # min overlap between neighbouring tiles, fraction of tile
 
     def __init__(self, model):
         super().__init__()
@@ -535,11 +539,17 @@ class AutoShape(nn.Module):
 
         with amp.autocast(enabled=autocast):
             # Inference
-            y = self.model(x, augment, profile)  # forward
+            if self.tile:  # overlapping tiles of all images in one batch, NMS below merges them across tiles
+                tiles, offsets = tile_img(x, make_divisible(self.tile, self.stride), self.tile_overlap)
+                y = self.model(tiles, augment, profile)  # forward
+                y = untile_pred(y if self.dmb else y[0], offsets)
+            else:
+                y = self.model(x, augment, profile)  # forward
+                y = y if self.dmb else y[0]
             t.append(time_sync())
 
             # Post-process
-            y = non_max_suppression(y if self.dmb else y[0], self.conf, iou_thres=self.iou, classes=self.classes,
+            y = non_max_suppression(y, self.conf, iou_thres=self.iou, classes=self.classes,
                                     agnostic=self.agnostic, multi_label=self.multi_label, max_det=self.max_det)  # NMS
             for i in range(n):
                 scale_coords(shape1, y[i][:, :4], shape0[i])
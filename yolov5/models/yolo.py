@@ -8,6 +8,7 @@ Usage:
 
 import argparse
 import sys
+from collections import OrderedDict
 from copy import deepcopy
 from pathlib import Path
 
@@ -33,6 +34,9 @@ except ImportError:
 class Detect(nn.Module):
     stride = None  # strides computed during build
     onnx_dynamic = False  # ONNX export parameter
+    conf_thres = None  # inference: decode only anchors with objectness > conf_thres, see _topk()
+    topk = 1000  # inference with conf_thres: max anchors per level
+    max_grids = 32  # grids cached for input shapes seen, see _cached_grid()
 
     def __init__(self, nc=80, anchors=(), ch=(), inplace=True):  # detection layer
         super().__init__()
@@ -54,8 +58,14 @@ class Detect(nn.Module):
             x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
 
             if not self.training:  # inference
-                if self.onnx_dynamic or self.grid[i].shape[2:4] != x[i].shape[2:4]:
+                if self.conf_thres is not None:
+                    z.append(self._topk(x[i], i))
+                    continue
+                if self.onnx_dynamic:  # traced, computed from the input shape
                     self.grid[i], self.anchor_grid[i] = self._make_grid(nx, ny, i)
+                elif self.grid[i].shape[2:4] != x[i].shape[2:4] or self.grid[i].dtype != x[i].dtype or \
+                        self.grid[i].device != x[i].device:
+                    self.grid[i], self.anchor_grid[i] = self._cached_grid(nx, ny, i, x[i])
 
                 y = x[i].sigmoid()
                 if self.inplace:
@@ -69,6 +79,35 @@ class Detect(nn.Module):
 
         return x if self.training else (torch.cat(z, 1), x)
 
+    def _topk(self, x, i):
+        # Decode the topk anchors of level i by objectness, anchors with objectness <= conf_thres get 0 for NMS
+        bs, na, ny, nx, no = x.shape
+        x = x.view(bs, -1, no)
+        j = x[..., 4].topk(min(self.topk, x.shape[1]), 1, sorted=False)[1]  # sigmoid is monotonic, select on logits
+        y = x.gather(1, j[..., None].expand(-1, -1, no)).sigmoid()  # (bs, k, no)
+        y[..., 4] *= y[..., 4] > self.conf_thres
+        a, j = j // (ny * nx), j % (ny * nx)  # anchor, grid cell
+        grid = torch.stack((j % nx, j // nx), -1).to(y.dtype)
+        xy = (y[..., 0:2] * 2 - 0.5 + grid) * self.stride[i]  # xy
+        wh = (y[..., 2:4] * 2) ** 2 * (self.anchors[i] * self.stride[i]).to(y.dtype)[a]  # wh
+        return torch.cat((xy, wh, y[..., 4:]), -1)
+
+    def _cached_grid(self, nx, ny, i, x):
+        # LRU of (grid, anchor_grid) by level and shape for mixed-resolution inference, i.e. rect LoadImages, AutoShape
+        grids = self.__dict__.setdefault('grids', OrderedDict())  # missing in older pickled models
+        key = i, ny, nx, x.dtype, x.device
+        if key in grids:
+            grids.move_to_end(key)
+        else:
+            grids[key] = tuple(g.to(x.dtype) for g in self._make_grid(nx, ny, i))
+            if len(grids) > self.max_grids:
+                grids.popitem(last=False)  # least recently used
+        return grids[key]
+
+    def __getstate__(self):
+        # Grids are rebuilt on demand, keep them out of checkpoints and deepcopies
+        return {k: v for k, v in self.__dict__.items() if k != 'grids'}
+
     def _make_grid(self, nx=20, ny=20, i=0):
         d = self.anchors[i].device
         if check_version(torch.__version__, '1.10.0'):  # torch>=1.10.0 meshgrid workaround for torch>=0.7 compatibility
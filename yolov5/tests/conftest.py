@@ -0,0 +1,43 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Unit tests, run from the YOLOv5 root directory
+
+Usage:
+    $ python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    # Returns write(n, polygons), which writes n images of alternating aspect ratio to tmp_path/images and their labels
+    # (1-3 boxes, or polygons of 4 points) to tmp_path/labels, and returns the images directory
+    def write(n=6, polygons=False):
+        rng = np.random.default_rng(0)
+        (tmp_path / 'images').mkdir(exist_ok=True)
+        (tmp_path / 'labels').mkdir(exist_ok=True)
+        for i in range(n):
+            h, w = (48, 96) if i % 2 else (96, 48)
+            cv2.imwrite(str(tmp_path / 'images' / f'{i}.jpg'), rng.integers(0, 255, (h, w, 3), dtype=np.uint8))
+            rows = []
+            for _ in range(i % 3 + 1):
+                xy = rng.uniform(0.2, 0.8, 2)
+                if polygons:
+                    rows.append([i % 3, *np.clip(xy + rng.uniform(-0.1, 0.1, (4, 2)), 0, 1).ravel()])
+                else:
+                    rows.append([i % 3, *xy, *rng.uniform(0.05, 0.3, 2)])
+            np.savetxt(tmp_path / 'labels' / f'{i}.txt', rows, fmt='%g')
+        return tmp_path / 'images'
+
+    return write
@@ -0,0 +1,224 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Tests of utils/datasets.py
+"""
+
+import os
+import shutil
+
+import cv2
+import numpy as np
+import torch
+
+from utils.datasets import (LoadImagesAndLabels, LoadVideosAndLabels, RaggedArray, RaggedSegments, SequenceSampler,
+                            file_fingerprints, load_label_cache)
+from utils.general import segments2boxes
+
+
+def test_shard_images_match_files(dataset):
+    path = dataset()
+    files = LoadImagesAndLabels(path, 64, 2)
+    shard = LoadImagesAndLabels(path, 64, 2, cache_images='disk')
+    assert shard.shard is not None and files.shard is None
+    for i in range(files.n):
+        im, hw0, hw = shard.load_image(i)
+        assert not im.flags.writeable  # view of the memory map
+        ref = files.load_image(i)
+        assert np.array_equal(im, ref[0]) and hw0 == ref[1] and hw == ref[2]
+    for a, b in zip(shard, files):
+        assert all(np.array_equal(x, y) for x, y in zip(a[:2], b[:2]))  # im, labels
+
+
+def test_shard_reused_until_inputs_change(dataset):
+    path = dataset()
+    LoadImagesAndLabels(path, 64, 2, cache_images='disk')
+    images = path.parent / 'labels.shard' / 'images.bin'
+    t = images.stat().st_mtime_ns
+    LoadImagesAndLabels(path, 64, 2, cache_images='disk')
+    assert images.stat().st_mtime_ns == t  # same images and settings
+
+    # Labels change, images are kept
+    (path.parent / 'labels' / '1.txt').write_text('2 0.5 0.5 0.2 0.2\n')
+    d = LoadImagesAndLabels(path, 64, 2, cache_images='disk')
+    assert np.allclose(d.labels[1], [[2, 0.5, 0.5, 0.2, 0.2]])
+    d = LoadImagesAndLabels(path, 64, 2, cache_images='disk', single_cls=True)
+    assert (d.labels.data[:, 0] == 0).all() and np.allclose(d.labels[1], [[0, 0.5, 0.5, 0.2, 0.2]])
+    d = LoadImagesAndLabels(path, 64, 2, cache_images='disk')
+    assert d.labels.data[:, 0].any()
+    assert images.stat().st_mtime_ns == t
+
+    LoadImagesAndLabels(path, 32, 2, cache_images='disk')
+    assert images.stat().st_mtime_ns != t  # resized again
+
+
+def ragged():
+    # rows [0, 1], [], [2, 3, 4], [5] of data 0-5 as (6, 2)
+    return RaggedArray.from_offsets(np.arange(12).reshape(6, 2), np.array([0, 2, 2, 5, 6]))
+
+
+def test_ragged_array():
+    x = ragged()
+    assert len(x) == 4 and [len(r) for r in x] == [2, 0, 3, 1]
+    assert np.array_equal(x[2], [[4, 5], [6, 7], [8, 9]])
+    y = x.take([3, 0, 1])  # reordered, data shared
+    assert y.data is x.data and [r[:, 0].tolist() for r in y] == [[10], [0, 2], []]
+    z = y.filter(np.array([True, False, True, True, False, True]))  # drop data rows 1 and 4
+    assert [r[:, 0].tolist() for r in z] == [[10], [0], []] and len(z.data) == 4
+
+
+def test_ragged_segments():
+    boxes = ragged()  # 6 labels in 4 images
+    points = RaggedArray.from_offsets(np.arange(26.).reshape(13, 2), np.array([0, 3, 6, 9, 10, 12, 13]))
+    segments = RaggedSegments(points, boxes.take([2, 0, 1]))
+    assert len(segments) == 3
+    assert [s[:, 0].tolist() for s in segments[0]] == [[12, 14, 16], [18], [20, 22]]  # labels 2-4
+    assert [s[:, 0].tolist() for s in list(segments)[1]] == [[0, 2, 4], [6, 8, 10]]  # labels 0-1
+    assert segments[2] == []  # no labels
+    empty = RaggedArray.from_offsets(np.zeros((0, 2)), np.zeros(7, dtype=np.int64))  # box labels only
+    assert all(s == [] for s in RaggedSegments(empty, boxes))
+
+
+def test_label_cache(dataset):
+    path = dataset()
+    d = LoadImagesAndLabels(path, 64, 2)
+    cache = load_label_cache(path.parent / 'labels.cache')
+    assert cache['files'] == d.img_files and isinstance(cache['labels'], np.memmap)
+    for f, labels in zip(d.label_files, d.labels):
+        assert np.allclose(labels, np.loadtxt(f, ndmin=2), atol=1e-6)
+    d2 = LoadImagesAndLabels(path, 64, 2)  # from the cache
+    assert all(np.array_equal(a, b) for a, b in zip(d.labels, d2.labels))
+
+
+def test_segments_follow_boxes(dataset):
+    # Polygons stay with their boxes through the rect sort and the packed shard
+    path = dataset(polygons=True)
+    for cache in False, 'disk':
+        d = LoadImagesAndLabels(path, 64, 2, rect=True, cache_images=cache)
+        assert d.indices == range(6) and not np.array_equal(d.img_files, sorted(d.img_files))  # sorted by aspect
+        for labels, segments in zip(d.labels, d.segments):
+            assert len(segments) == len(labels)
+            assert np.allclose(segments2boxes([np.asarray(s) for s in segments]), labels[:, 1:], atol=1e-4)
+
+
+def test_file_fingerprints(tmp_path):
+    a, b = tmp_path / 'a.txt', tmp_path / 'b.txt'
+    a.write_text('0 0.5 0.5 0.1 0.1')
+    x = file_fingerprints([str(a)], [str(b)])  # b missing
+    assert x.shape == (1, 6) and (x[0, 3:] == -1).all()
+    st = a.stat()
+    shutil.copy(a, tmp_path / 'c.txt')
+    os.replace(tmp_path / 'c.txt', a)  # replaced by a copy of the same size and mtime
+    os.utime(a, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert not np.array_equal(file_fingerprints([str(a)], [str(b)]), x)
+
+
+def test_label_cache_updates_changed_files(dataset, caplog):
+    path = dataset()
+    LoadImagesAndLabels(path, 64, 2)
+    labels = path.parent / 'labels'
+    with caplog.at_level('INFO'):
+        caplog.clear()
+        LoadImagesAndLabels(path, 64, 2)
+        assert 'Updating' not in caplog.text  # unchanged
+
+        (labels / '1.txt').write_text('2 0.5 0.5 0.2 0.2\n')  # modified
+        (path / '5.jpg').unlink()  # removed
+        shutil.copy(path / '0.jpg', path / '6.jpg')  # added
+        shutil.copy(labels / '0.txt', labels / '6.txt')
+        caplog.clear()
+        d = LoadImagesAndLabels(path, 64, 2)
+        assert '1 added, 1 modified, 1 removed, 4 unchanged' in caplog.text
+    assert [os.path.basename(f) for f in d.img_files] == [f'{i}.jpg' for i in (0, 1, 2, 3, 4, 6)]
+    assert np.allclose(d.labels[1], [[2, 0.5, 0.5, 0.2, 0.2]])
+    assert np.array_equal(d.labels[5], d.labels[0])
+    d2 = LoadImagesAndLabels(path, 64, 2)  # updated cache, as a full rescan
+    shutil.rmtree(path.parent / 'labels.cache')
+    d3 = LoadImagesAndLabels(path, 64, 2)
+    assert all(np.array_equal(a, b) and np.array_equal(a, c) for a, b, c in zip(d.labels, d2.labels, d3.labels))
+
+
+class Frames:
+    # Stand-in for LoadVideosAndLabels with 'n' frames of each video, only what SequenceSampler reads
+    def __init__(self, videos=3, n=25):
+        self.videos = [(f'{v}.mp4', f) for v in range(videos) for f in range(n)]
+
+    def __len__(self):
+        return len(self.videos)
+
+
+def test_sequence_sampler_runs():
+    dataset = Frames()
+    indices = list(SequenceSampler(dataset, gop=10))
+    assert sorted(indices) == list(range(len(dataset)))  # every frame once
+    runs = {}  # (video, frame // gop): positions in the order
+    for i, j in enumerate(indices):
+        v, f = dataset.videos[j]
+        runs.setdefault((v, f // 10), []).append(i)
+    assert all(x == list(range(x[0], x[0] + len(x))) for x in runs.values())  # runs are yielded whole
+    assert all(indices[i] < indices[i + 1] for x in runs.values() for i in x[:-1])  # frames of a run in order
+
+
+def test_sequence_sampler_ddp(monkeypatch):
+    # Every process gets an equal, disjoint (up to padding) part of the same order, without an initialized process group
+    dataset, world = Frames(), 4
+    monkeypatch.setattr(torch.distributed, 'get_world_size', lambda: world)
+    parts = []
+    for rank in range(world):
+        monkeypatch.setattr(torch.distributed, 'get_rank', lambda: rank)
+        sampler = SequenceSampler(dataset, gop=10, rank=rank)
+        sampler.set_epoch(1)
+        parts.append(list(sampler))
+        assert sampler.num_replicas == world and sampler.rank == rank and len(parts[-1]) == len(sampler) == 19
+    indices = [i for x in parts for i in x]
+    assert sorted(set(indices)) == list(range(len(dataset)))  # all frames
+    assert len(indices) - len(dataset) == 1  # padding
+    sampler.set_epoch(2)
+    assert list(sampler) != parts[-1]  # new order every epoch
+
+
+def write_video(tmp_path, n=6):
+    # Writes tmp_path/01.mp4 of n 96x48 frames and labels of its frames: a polygon, a corrupt row, boxes of 2 classes
+    writer = cv2.VideoWriter(str(tmp_path / '01.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), 30, (96, 48))
+    for i in range(n):
+        writer.write(np.full((48, 96, 3), i * 40, dtype=np.uint8))
+    writer.release()
+    (tmp_path / 'labels').mkdir()
+    for i in range(n):
+        rows = ['1 0.5 0.5 0.2 0.2', '2 0.3 0.3 0.1 0.1']
+        rows = ['1 0.2 0.2 0.6 0.2 0.6 0.8 0.2 0.8'] if i == 0 else ['0 -0.5 0.5 0.2 0.2'] if i == 1 else rows
+        (tmp_path / 'labels' / f'01_{i + 1:03}.txt').write_text('\n'.join(rows) + '\n')
+    return tmp_path
+
+
+def test_video_labels_verified(tmp_path):
+    d = LoadVideosAndLabels(write_video(tmp_path), 64, 2, rect=True)
+    assert [f for _, f in d.videos] == [0, 2, 3, 4, 5]  # corrupt label dropped, frames in video order
+    assert np.allclose(d.shapes, [96, 48])
+    assert np.allclose(d.labels[0], [[1, 0.4, 0.5, 0.4, 0.6]])  # polygon to box
+    assert len(d.segments[0]) == 1 and np.allclose(d.segments[0][0][2], [0.6, 0.8])
+    assert d.segments[1] == [] and len(d.labels[1]) == 2
+    im, labels, _, _ = d[0]
+    assert im.shape == (3, 32, 64) and len(labels) == 1
+    assert np.array_equal(d.load_image(4)[0], LoadVideosAndLabels(tmp_path, 64, 2).load_image(4)[0])
+
+
+def test_single_cls_keeps_shared_labels(tmp_path):
+    shared = {}
+    a = LoadVideosAndLabels(write_video(tmp_path), 64, 2, single_cls=True, shared_labels=shared)
+    b = LoadVideosAndLabels(tmp_path, 64, 2, shared_labels=shared)
+    assert len(shared) == 1 and b.labels is next(iter(shared.values()))[0]
+    assert (a.labels.data[:, 0] == 0).all() and set(b.labels.data[:, 0]) == {1, 2}
+
+
+def test_label_store_sees_new_labels(dataset):
+    # Labels added to a shared label store are found by the next dataset of the same process
+    path = dataset()
+    store = path.parent / 'store'
+    (store / '09').mkdir(parents=True)
+    d = LoadImagesAndLabels(path, 64, 2, label_dir=str(store))
+    assert len(d.labels.data) == 0
+    for f in (path.parent / 'labels').glob('*.txt'):
+        shutil.copy(f, store / '09' / f.name)
+    d = LoadImagesAndLabels(path, 64, 2, label_dir=str(store))
+    assert d.label_files[0] == str(store.resolve() / '09' / '0.txt')
+    assert all(np.array_equal(a, b) for a, b in zip(d.labels, LoadImagesAndLabels(path, 64, 2).labels))
@@ -0,0 +1,56 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Tests of export.py
+"""
+
+import pytest
+import torch
+import yaml
+
+from export import export_onnx, export_onnx_int8, export_torchscript_int8
+from models.yolo import Model
+from utils.general import ROOT
+
+
+@pytest.fixture
+def exportable(dataset, tmp_path):
+    # Fused random YOLOv5n with 3 classes after a dry run as in export.run(), an image batch, a weights path and a
+    # calibration dataset.yaml
+    torch.manual_seed(0)
+    model, im = Model(ROOT / 'models' / 'yolov5n.yaml', nc=3).fuse().eval(), torch.zeros(2, 3, 64, 64)
+    with torch.no_grad():
+        model(im)  # dry run
+    data = tmp_path / 'dataset.yaml'
+    data.write_text(yaml.safe_dump({'train': str(dataset()), 'val': str(tmp_path / 'images'), 'nc': 3}))
+    return model, im, tmp_path / 'yolov5n.pt', str(data)
+
+
+@torch.no_grad()
+def test_torchscript_int8(exportable):
+    # The saved model loads and keeps running, with autograd on or off and at any batch size
+    model, im, file, data = exportable
+    export_torchscript_int8(model, im, file, data, ncalib=4)
+    f = file.parent / 'yolov5n-int8.torchscript'
+    assert f.exists()
+    y = model(im)[0]
+    for grad in False, True:
+        ts = torch.jit.load(str(f))
+        with torch.set_grad_enabled(grad):
+            for n in 2, 3, 1, 2:
+                x = torch.rand(n, 3, 64, 64)
+                assert ts(x)[0].shape == (n, *y.shape[1:])
+
+
+def test_onnx_int8(exportable):
+    ort = pytest.importorskip('onnxruntime')
+    pytest.importorskip('onnx')
+    model, im, file, data = exportable
+    im = im[:1]
+    export_onnx(model, im, file, 13, False, False, False)
+    export_onnx_int8(model, im, file, data, ncalib=4)
+    f = file.parent / 'yolov5n-int8.onnx'
+    assert f.exists()
+    session = ort.InferenceSession(str(f), providers=['CPUExecutionProvider'])
+    for _ in range(2):
+        y = session.run(None, {session.get_inputs()[0].name: torch.rand(1, 3, 64, 64).numpy()})[0]
+        assert y.shape == (1, model(im)[0].shape[1], 8)
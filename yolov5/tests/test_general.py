@@ -0,0 +1,68 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Tests of utils/general.py
+"""
+
+import pytest
+import torch
+import torchvision
+
+from utils.general import non_max_suppression, xywh2xyxy
+
+
+def predictions(bs=4, n=500, nc=5, seed=0):
+    # Random (bs,n,5+nc) inference output with clustered boxes, so NMS has overlaps to suppress
+    g = torch.Generator().manual_seed(seed)
+    x = torch.rand(bs, n, 5 + nc, generator=g)
+    x[..., :2] = x[..., :2] * 200 + torch.randint(0, 4, (bs, n, 1), generator=g) * 150  # centers in 4 clusters
+    x[..., 2:4] = x[..., 2:4] * 60 + 10  # wh
+    return x
+
+
+@pytest.mark.parametrize('multi_label', [False, True])
+@pytest.mark.parametrize('agnostic', [False, True])
+def test_nms_batch_matches_single_images(multi_label, agnostic):
+    # Batched NMS of all images at once gives the detections of every image on its own
+    x = predictions()
+    out = non_max_suppression(x, 0.3, 0.45, agnostic=agnostic, multi_label=multi_label)
+    assert len(out) == len(x)
+    for xi, o in zip(x, out):
+        ref = non_max_suppression(xi[None], 0.3, 0.45, agnostic=agnostic, multi_label=multi_label)[0]
+        assert len(ref) and torch.equal(o, ref)
+
+
+def test_nms_matches_torchvision():
+    # Best class per box, then torchvision.ops.batched_nms() image by image
+    x = predictions()
+    for xi, o in zip(x, non_max_suppression(x.clone(), 0.3, 0.45)):
+        xi = xi[xi[:, 4] > 0.3]
+        conf, j = (xi[:, 5:] * xi[:, 4:5]).max(1)
+        box, i = xywh2xyxy(xi[:, :4]), conf > 0.3
+        k = torchvision.ops.batched_nms(box[i], conf[i], j[i], 0.45)[:300]  # max_det
+        assert torch.allclose(o, torch.cat((box[i], conf[i, None], j[i, None].float()), 1)[k])
+
+
+def test_nms_max_det_per_image():
+    out = non_max_suppression(predictions(n=2000), 0.01, 0.9, max_det=7)
+    assert [len(o) for o in out] == [7] * 4
+    assert all((o[:-1, 4] >= o[1:, 4]).all() for o in out)  # confidence order
+
+
+def test_nms_classes_and_empty_images():
+    x = predictions(bs=3)
+    x[1, :, 4] = 0  # no candidates in image 1
+    out = non_max_suppression(x, 0.3, 0.45, classes=[2])
+    assert len(out[1]) == 0 and len(out[0]) and len(out[2])
+    assert all((o[:, 5] == 2).all() for o in out)
+
+
+def test_nms_overlaps():
+    # Two overlapping boxes: one kept if they share a class (or with agnostic), both if their classes differ
+    x = torch.zeros(1, 2, 7)
+    x[0, :, :4] = torch.tensor([[50, 50, 20, 20], [52, 50, 20, 20]])
+    x[0, :, 4] = torch.tensor([0.9, 0.8])
+    x[0, :, 5] = 1  # class 0
+    assert len(non_max_suppression(x)[0]) == 1
+    x[0, 1, 5:] = torch.tensor([0, 1])  # class 1
+    assert len(non_max_suppression(x)[0]) == 2
+    assert len(non_max_suppression(x, agnostic=True)[0]) == 1
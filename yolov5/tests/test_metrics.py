@@ -0,0 +1,103 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Tests of utils/metrics.py
+"""
+
+import numpy as np
+import pytest
+import torch
+
+from utils.metrics import APAccumulator, ap_per_class
+
+IOUV = np.linspace(0.5, 0.95, 10)
+
+
+def predictions(n=2000, nc=15, bins=None, seed=0):
+    # Valid val.py statistics: correct(n,10) of n predictions, conf(n), pred_cls(n) and target_cls(m) labels
+    # Each label is matched by at most one prediction of its class, at a random IoU. With bins conf are distinct bins
+    rng = np.random.default_rng(seed)
+    target_cls = rng.integers(0, nc, n // 3)
+    pred_cls = np.concatenate((target_cls, rng.integers(0, nc, n - len(target_cls))))  # one per label, then others
+    iou = np.where(rng.random(n) < 0.6, rng.uniform(0.3, 1, n), 0)  # matched IoU
+    iou[len(target_cls):] = 0  # unmatched
+    correct = iou[:, None] >= IOUV
+    conf = rng.permutation(bins)[:n] / bins if bins else rng.random(n)
+    return correct, conf, pred_cls.astype(float), target_cls.astype(float)
+
+
+def ap_per_class_loop(tp, conf, pred_cls, target_cls, eps=1e-16):
+    # ap_per_class() class by class before it was vectorized, the reference
+    from utils.metrics import compute_ap
+    i = np.argsort(-conf, kind='stable')
+    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
+    unique_classes, nt = np.unique(target_cls, return_counts=True)
+    px = np.linspace(0, 1, 1000)
+    ap, p, r = np.zeros((len(unique_classes), tp.shape[1])), np.zeros((len(nt), 1000)), np.zeros((len(nt), 1000))
+    for ci, c in enumerate(unique_classes):
+        i = pred_cls == c
+        if i.sum() == 0:
+            continue
+        fpc, tpc = (1 - tp[i]).cumsum(0), tp[i].cumsum(0)
+        recall = tpc / (nt[ci] + eps)
+        r[ci] = np.interp(-px, -conf[i], recall[:, 0], left=0)
+        precision = tpc / (tpc + fpc)
+        p[ci] = np.interp(-px, -conf[i], precision[:, 0], left=1)
+        for j in range(tp.shape[1]):
+            ap[ci, j] = compute_ap(recall[:, j], precision[:, j])[0]
+    f1 = 2 * p * r / (p + r + eps)
+    i = f1.mean(0).argmax()
+    p, r, f1 = p[:, i], r[:, i], f1[:, i]
+    tp = (r * nt).round()
+    fp = (tp / (p + eps) - tp).round()
+    return tp, fp, p, r, f1, ap, unique_classes.astype('int32')
+
+
+def assert_results_equal(a, b):
+    for x, y in zip(a, b):
+        np.testing.assert_allclose(x, y, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('nc', [1, 15, 80])
+def test_ap_per_class_matches_loop(nc):
+    x = predictions(nc=nc)
+    assert_results_equal(ap_per_class(*x, names={}), ap_per_class_loop(*x))
+
+
+def test_ap_per_class_class_without_predictions():
+    correct, conf, pred_cls, target_cls = predictions(nc=5)
+    i = pred_cls != 3  # labels of class 3 but no predictions
+    x = correct[i], conf[i], pred_cls[i], target_cls
+    results = ap_per_class(*x, names={})
+    assert_results_equal(results, ap_per_class_loop(*x))
+    assert (results[5][3] == 0).all()
+
+
+def accumulate(correct, conf, pred_cls, target_cls, bins, chunks=1):
+    stats = APAccumulator(int(target_cls.max()) + 1, len(IOUV), bins=bins)
+    for c, f, p, t in zip(*(np.array_split(x, chunks) for x in (correct, conf, pred_cls, target_cls))):
+        stats.update(*(torch.from_numpy(x) for x in (c, f, p, t)))
+    return stats
+
+
+def test_ap_accumulator_exact_at_bin_edges():
+    # One prediction per bin, conf at its lower edge: the same as ap_per_class() and no error
+    correct, conf, pred_cls, target_cls = predictions(bins=10000)
+    stats = accumulate(correct, conf + 0.5 / 10000, pred_cls, target_cls, 10000, chunks=7)
+    assert_results_equal(stats.result(names={}), ap_per_class(correct, conf, pred_cls, target_cls, names={}))
+    assert (stats.error == 0).all()
+
+
+def test_ap_accumulator_error_bound():
+    # Few bins mix true and false positives, AP stays within the reported error of ap_per_class()
+    x = predictions()
+    stats = accumulate(*x, bins=50)
+    ap, ap_exact = stats.result(names={})[5], ap_per_class(*x, names={})[5]
+    assert stats.error.shape == ap.shape and (stats.error > 0).any()
+    assert (np.abs(ap - ap_exact) <= stats.error + 1e-3).all()  # + compute_ap() 101-point sampling
+
+
+def test_ap_accumulator_chunks():
+    # Streaming the statistics batch by batch is the same as one update
+    x = predictions()
+    a, b = accumulate(*x, bins=1000), accumulate(*x, bins=1000, chunks=13)
+    assert_results_equal(a.result(names={}), b.result(names={}))
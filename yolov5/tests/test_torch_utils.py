@@ -0,0 +1,46 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Tests of utils/torch_utils.py
+"""
+
+import pytest
+import torch
+
+from utils.torch_utils import tile_img, untile_pred
+
+
+@pytest.mark.parametrize('shape', [(100, 150), (64, 64), (40, 200), (30, 20)])
+@pytest.mark.parametrize('overlap', [0, 0.2, 0.5])
+def test_tile_img(shape, overlap):
+    # Tiles are crops of the (padded) images at their offsets, cover them, and overlap by at least overlap * tile
+    img = torch.rand(2, 3, *shape)
+    crops, offsets = tile_img(img, 64, overlap)
+    n = len(offsets)
+    assert crops.shape == (2 * n, 3, 64, 64)
+    covered = torch.zeros(max(shape[0], 64), max(shape[1], 64), dtype=torch.bool)
+    for k, (x, y) in enumerate(offsets.tolist()):
+        crop = crops[k::n]  # tile k of every image
+        h, w = min(64, shape[0] - y), min(64, shape[1] - x)
+        assert torch.equal(crop[..., :h, :w], img[..., y:y + h, x:x + w])
+        assert (crop[..., h:, :] == 114 / 255).all() and (crop[..., :, w:] == 114 / 255).all()  # padding
+        covered[y:y + 64, x:x + 64] = True
+    assert covered.all()
+    for axis in 0, 1:
+        starts = offsets[:, axis].unique()
+        assert (starts.diff() <= 64 * (1 - overlap) + 1).all()
+
+
+def test_untile_pred():
+    # Predictions of every tile shifted back to image pixels, one row of all tiles per image
+    img = torch.rand(3, 3, 100, 150)
+    crops, offsets = tile_img(img, 64, 0.2)
+    pred = torch.rand(len(crops), 5, 7) * 64  # (bs*n, anchors, xywh...)
+    ref = pred.clone()
+    out = untile_pred(pred, offsets)
+    n = len(offsets)
+    assert out.shape == (3, n * 5, 7)
+    for b in range(3):
+        for k in range(n):
+            p, o = pred[b * n + k], out[b, k * 5:(k + 1) * 5]
+            assert torch.allclose(o[:, :2], p[:, :2] + offsets[k]) and torch.equal(o[:, 2:], p[:, 2:])
+    assert torch.equal(pred, ref)  # input unchanged
@@ -0,0 +1,36 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Tests of utils/tracking.py
+"""
+
+import numpy as np
+import torch
+
+from utils.tracking import KeyframeTracker
+
+
+def test_keyframes_of_videos_and_images():
+    tracker = KeyframeTracker(interval=3, size=32)
+    im = np.zeros((48, 64, 3), dtype=np.uint8)  # same frame, no motion
+    keys = tracker.select([im] * 4, ['a.mp4'] * 4)
+    assert keys.tolist() == [True, False, False, True]  # every 3rd frame
+    keys = tracker.select([im] * 2, ['a.mp4', 'b.mp4'])
+    assert keys.tolist() == [False, True]  # same video continues, a new one starts over
+    keys = tracker.select([im] * 3, [None] * 3)
+    assert keys.tolist() == [True] * 3  # still images are never tracked
+    keys = tracker.select([im] * 2, ['b.mp4'] * 2)
+    assert keys.tolist() == [True, False]  # an image in between
+    assert tracker.keyframes == 7 and tracker.total == 11
+
+
+def test_boxes_carried_over_within_a_video():
+    tracker = KeyframeTracker(interval=3, size=64)
+    im = np.zeros((64, 64, 3), dtype=np.uint8)
+    im[16:32, 16:32] = 255
+    det = torch.tensor([[16.0, 16, 32, 32, 0.9, 0]])
+    keys = tracker.select([im] * 3, ['a.mp4'] * 3)
+    out = tracker.update([det] * int(keys.sum()))
+    assert keys.tolist() == [True, False, False] and all(torch.allclose(x, det, atol=0.5) for x in out)
+    keys = tracker.select([im], [None])
+    assert keys.tolist() == [True]  # no boxes of the video in the image
+    assert len(tracker.update([det[:0]])[0]) == 0
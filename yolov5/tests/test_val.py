@@ -0,0 +1,66 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Tests of val.py
+"""
+
+import numpy as np
+import torch
+
+from utils.metrics import box_iou
+from val import process_batch
+
+IOUV = torch.linspace(0.5, 0.95, 10)
+
+
+def process_image(detections, labels, iouv):
+    # process_batch() of a single image before it matched whole batches, the reference
+    correct = torch.zeros(detections.shape[0], iouv.shape[0], dtype=torch.bool)
+    iou = box_iou(labels[:, 1:], detections[:, :4])
+    x = torch.where((iou >= iouv[0]) & (labels[:, 0:1] == detections[:, 5]))
+    if x[0].shape[0]:
+        matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).numpy()
+        if x[0].shape[0] > 1:
+            matches = matches[matches[:, 2].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        matches = torch.Tensor(matches)
+        correct[matches[:, 1].long()] = matches[:, 2:3] >= iouv
+    return correct
+
+
+def image(n, m, nc=3, seed=0):
+    # n detections jittered around m labels plus some unrelated ones, (n,6) and (m,5) in xyxy
+    g = torch.Generator().manual_seed(seed)
+    xy = torch.rand(m, 2, generator=g) * 400
+    wh = torch.rand(m, 2, generator=g) * 60 + 20
+    labels = torch.cat((torch.randint(0, nc, (m, 1), generator=g).float(), xy, xy + wh), 1)
+    i = torch.randint(0, max(m, 1), (n,), generator=g)
+    boxes = labels[i, 1:] + torch.randn(n, 4, generator=g) * 8 if m else torch.rand(n, 4, generator=g) * 400
+    boxes[n // 2:] = torch.rand(n - n // 2, 4, generator=g) * 400  # unrelated
+    boxes = torch.cat((boxes[:, :2].minimum(boxes[:, 2:]), boxes[:, :2].maximum(boxes[:, 2:])), 1)
+    cls = labels[i, :1] if m else torch.zeros(n, 1)
+    cls[torch.rand(n, generator=g) < 0.2] = 0  # some wrong classes
+    return torch.cat((boxes, torch.rand(n, 1, generator=g), cls), 1), labels
+
+
+def test_process_batch_matches_single_images():
+    images = [image(n, m, seed=s) for s, (n, m) in enumerate([(40, 10), (0, 5), (30, 0), (1, 1), (80, 25), (0, 0)])]
+    detections, labels = zip(*images)
+    correct = process_batch(list(detections), list(labels), IOUV)
+    assert correct.shape == (len(images), 80, 10) and 0 < correct[..., 0].sum() < correct[..., -1].numel()
+    for c, d, l in zip(correct, detections, labels):
+        assert torch.equal(c[:len(d)], process_image(d, l, IOUV))
+        assert not c[len(d):].any()  # padding
+
+
+def test_process_batch_one_detection_per_label():
+    # Two detections of one label, only the first one counts
+    labels = torch.tensor([[0, 10, 10, 50, 50.]])
+    detections = torch.tensor([[10, 10, 50, 50, 0.9, 0], [12, 10, 50, 50, 0.8, 0], [10, 10, 50, 50, 0.7, 1]])
+    correct = process_batch([detections], [labels], IOUV)[0]
+    assert correct[0].all() and not correct[1:].any()
+
+
+def test_process_batch_empty():
+    assert process_batch([], [], IOUV).shape == (0, 0, 10)
+    assert process_batch([torch.zeros(3, 6)], [torch.zeros(0, 5)], IOUV).shape == (1, 3, 10)
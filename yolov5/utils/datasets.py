@@ -10,11 +10,13 @@ import math
 import os
 import random
 import shutil
+import queue
 import time
+from collections import OrderedDict
 from itertools import repeat
 from multiprocessing.pool import Pool, ThreadPool
 from pathlib import Path
-from threading import Thread
+from threading import Event, Thread
 from zipfile import ZipFile
 
 import cv2
@@ -23,10 +25,11 @@ import torch
 import torch.nn.functional as F
 import yaml
 from PIL import ExifTags, Image, ImageOps
-from torch.utils.data import DataLoader, Dataset, dataloader, distributed
+from torch.utils.data import ConcatDataset, DataLoader, Dataset, dataloader, distributed
 from tqdm import tqdm
 
-from utils.augmentations import Albumentations, augment_hsv, copy_paste, letterbox, mixup, random_perspective
+from utils.augmentations import (Albumentations, augment_hsv, copy_paste, letterbox, letterbox_shape, mixup,
+                                 random_perspective)
 from utils.general import (LOGGER, NUM_THREADS, check_dataset, check_requirements, check_yaml, clean_str,
                            segments2boxes, xyn2xy, xywh2xyxy, xywhn2xyxy, xyxy2xywhn)
 from utils.torch_utils import torch_distributed_zero_first
@@ -51,6 +54,22 @@ def get_hash(paths):
     return h.hexdigest()  # return hash
 
 
+def file_fingerprint(path):
+    # Returns (size, mtime_ns, inode) of a file, (-1, -1, -1) if it does not exist
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+    except OSError:
+        return -1, -1, -1
+
+
+def file_fingerprints(img_files, label_files):
+    # Returns int64 (n, 6) image and label fingerprints, a row changes when either file is added, modified or replaced
+    with ThreadPool(NUM_THREADS) as pool:
+        x = pool.map(lambda f: file_fingerprint(f[0]) + file_fingerprint(f[1]), zip(img_files, label_files), 256)
+    return np.array(x, dtype=np.int64).reshape(-1, 6)
+
+
 def exif_size(img):
     # Returns exif-corrected PIL size
     s = img.size  # (width, height)
@@ -93,25 +112,30 @@ def exif_transpose(image):
 
 
 def create_dataloader(path, imgsz, batch_size, stride, single_cls=False, hyp=None, augment=False, cache=False, pad=0.0,
-                      rect=False, rank=-1, workers=8, image_weights=False, quad=False, prefix='', shuffle=False):
+                      rect=False, rank=-1, workers=8, image_weights=False, quad=False, prefix='', shuffle=False,
+                      label_dir=None, video=False):
     if rect and shuffle:
         LOGGER.warning('WARNING: --rect is incompatible with DataLoader shuffle, setting shuffle=False')
         shuffle = False
     with torch_distributed_zero_first(rank):  # init dataset *.cache only once if DDP
-        dataset = LoadImagesAndLabels(path, imgsz, batch_size,
-                                      augment=augment,  # augmentation
-                                      hyp=hyp,  # hyperparameters
-                                      rect=rect,  # rectangular batches
-                                      cache_images=cache,
-                                      single_cls=single_cls,
-                                      stride=int(stride),
-                                      pad=pad,
-                                      image_weights=image_weights,
-                                      prefix=prefix)
+        dataset_class = LoadVideosAndLabels if video else LoadImagesAndLabels  # decode frames straight from videos
+        dataset = dataset_class(path, imgsz, batch_size,
+                                augment=augment,  # augmentation
+                                hyp=hyp,  # hyperparameters
+                                rect=rect,  # rectangular batches
+                                cache_images=cache,
+                                single_cls=single_cls,
+                                stride=int(stride),
+                                pad=pad,
+                                image_weights=image_weights,
+                                prefix=prefix,
+                                label_dir=label_dir)
 
     batch_size = min(batch_size, len(dataset))
     nw = min([os.cpu_count() // WORLD_SIZE, batch_size if batch_size > 1 else 0, workers])  # number of workers
     sampler = None if rank == -1 else distributed.DistributedSampler(dataset, shuffle=shuffle)
+    if video and shuffle:  # shuffled runs of consecutive frames, see SequenceSampler
+        sampler = SequenceSampler(dataset, dataset.gop, rank=rank)
     loader = DataLoader if image_weights else InfiniteDataLoader  # only DataLoader allows for attribute updates
     return loader(dataset,
                   batch_size=batch_size,
@@ -122,6 +146,131 @@ def create_dataloader(path, imgsz, batch_size, stride, single_cls=False, hyp=Non
                   collate_fn=LoadImagesAndLabels.collate_fn4 if quad else LoadImagesAndLabels.collate_fn), dataset
 
 
+def create_dataloaders(paths, imgsz, batch_size, stride, single_cls=False, pad=0.0, rect=False, workers=8, prefix='',
+                       label_dirs=None, videos=None):
+    # Returns a dataloader for each of paths, i.e. the val.txt of every challenge type/level, all served by the same
+    # persistent DataLoader workers. Each pass over one of them starts at its own first batch, one pass at a time
+    label_dirs, videos = label_dirs or [None] * len(paths), videos or [False] * len(paths)
+    datasets, shared_labels = [], {}  # labels of the same label files, i.e. a shared label store, are held once
+    for path, label_dir, video in zip(paths, label_dirs, videos):
+        dataset_class = LoadVideosAndLabels if video else LoadImagesAndLabels
+        datasets.append(dataset_class(path, imgsz, batch_size, rect=rect, single_cls=single_cls, stride=int(stride),
+                                      pad=pad, prefix=prefix, label_dir=label_dir, shared_labels=shared_labels))
+    LOGGER.info(f'{prefix}{len(datasets)} datasets, {len(datasets) - len(shared_labels)} sharing the labels of another')
+
+    # Batches never span two datasets, each keeps its own rectangular batch shapes
+    offsets = np.cumsum([0] + [len(x) for x in datasets])
+    batches = [[range(o + i, o + min(i + batch_size, len(x))) for i in range(0, len(x), batch_size)]
+               for o, x in zip(offsets, datasets)]
+    nw = min([os.cpu_count() // WORLD_SIZE, batch_size if batch_size > 1 else 0, workers])  # number of workers
+    loader = DataLoader(ConcatDataset(datasets),
+                        batch_sampler=SharedBatchSampler(batches),
+                        num_workers=nw,
+                        pin_memory=True,
+                        persistent_workers=nw > 0,
+                        collate_fn=LoadImagesAndLabels.collate_fn)
+    return [SharedDataLoader(loader, x, i) for i, x in enumerate(datasets)]
+
+
+class SharedBatchSampler:
+    # Batch sampler yielding the batches of one dataset of a ConcatDataset, selected by SharedDataLoader
+    def __init__(self, batches):
+        self.batches, self.i = batches, 0  # batches of every dataset, selected dataset
+
+    def __len__(self):
+        return len(self.batches[self.i])
+
+    def __iter__(self):
+        return iter(self.batches[self.i])
+
+
+class SharedDataLoader:
+    # Dataset i of a DataLoader shared by several datasets, see create_dataloaders()
+    def __init__(self, loader, dataset, i):
+        self.loader, self.dataset, self.i = loader, dataset, i
+
+    def __len__(self):
+        return len(self.loader.batch_sampler.batches[self.i])
+
+    def __iter__(self):
+        # A new pass of the persistent workers, batches still in flight from an earlier unfinished pass are dropped
+        self.loader.batch_sampler.i = self.i
+        return iter(self.loader)
+
+
+class CachedDataLoader:
+    # Batches of a dataloader without augmentation or shuffling (i.e. val_loader) kept letterboxed and collated between
+    # passes, uint8 images in RAM or in memory-mapped *.npy files in dir, up to max_bytes with the least recently used
+    # batch out first. Batches still to come in the current pass are never evicted, so a budget smaller than the
+    # dataset keeps a fixed part of it instead of cycling everything out. Only uncached batches are loaded, by the
+    # workers of loader on a full miss (i.e. the first pass) and by a DataLoader of their own otherwise
+    def __init__(self, loader, max_bytes, dir=None, prefix=''):
+        self.loader, self.dataset, self.max_bytes, self.prefix = loader, loader.dataset, max_bytes, prefix
+        sampler = loader.batch_sampler
+        self.batches = list(sampler.sampler if isinstance(sampler, _RepeatSampler) else sampler)  # indices per batch
+        self.dir = Path(dir) if dir else None
+        if self.dir:
+            self.dir.mkdir(parents=True, exist_ok=True)
+        self.cache, self.bytes = OrderedDict(), 0  # batch index: (im, targets, paths, shapes, nbytes), cached bytes
+        self.hits, self.misses, self.saved = 0, 0, 0  # batches served from cache and loaded, bytes not loaded
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        todo = [i for i in range(len(self)) if i not in self.cache]
+        if len(todo) == len(self):
+            loads = iter(self.loader)
+        else:
+            loads = iter(DataLoader(self.dataset, batch_sampler=[self.batches[i] for i in todo],
+                                    num_workers=self.loader.num_workers if todo else 0,
+                                    pin_memory=self.loader.pin_memory, collate_fn=self.loader.collate_fn))
+        served = set()  # batches of this pass, the only ones evicted
+        for i in range(len(self)):
+            if i in self.cache:
+                self.cache.move_to_end(i)
+                im, targets, paths, shapes, nbytes = self.cache[i]
+                im = torch.from_numpy(im)
+                self.hits, self.saved = self.hits + 1, self.saved + nbytes
+            else:
+                im, targets, paths, shapes = next(loads)
+                self.misses += 1
+                self.put(i, im, targets, paths, shapes, served)
+            served.add(i)
+            yield im, targets.clone(), paths, shapes  # val.run() scales targets in place
+
+        n = self.hits + self.misses
+        LOGGER.info(f'{self.prefix}Cached batches: {self.hits}/{n} hits ({self.hits / max(n, 1):.0%}), '
+                    f'{self.saved / 1E9:.2f}GB loading saved, {self.bytes / 1E9:.2f}/{self.max_bytes / 1E9:.2f}GB '
+                    f'{"disk" if self.dir else "ram"} used')
+
+    def put(self, i, im, targets, paths, shapes, served):
+        # Caches batch i if it fits after evicting batches of this pass, least recently used first
+        nbytes = im.numel() * im.element_size()
+        for j in [j for j in self.cache if j in served]:
+            if self.bytes + nbytes <= self.max_bytes:
+                break
+            self.bytes -= self.cache.pop(j)[4]
+            if self.dir:
+                (self.dir / f'{j}.npy').unlink(missing_ok=True)
+        if self.bytes + nbytes > self.max_bytes:
+            return
+        if self.dir:  # copy-on-write memory map, writable for torch.from_numpy()
+            np.save(self.dir / f'{i}.npy', im.numpy())
+            x = np.load(self.dir / f'{i}.npy', mmap_mode='c')
+        else:
+            x = im.numpy().copy()  # out of pinned memory
+        self.cache[i] = x, targets.clone(), paths, shapes, nbytes
+        self.bytes += nbytes
+
+    def close(self):
+        # Empties the cache and removes dir
+        self.cache.clear()
+        self.bytes = 0
+        if self.dir:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+
 class InfiniteDataLoader(dataloader.DataLoader):
     """ Dataloader that reuses workers
 
@@ -158,7 +307,8 @@ class _RepeatSampler:
 
 class LoadImages:
     # YOLOv5 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`
-    def __init__(self, path, img_size=640, stride=32, auto=True):
+    # With batch_size > 1 or workers > 0 frames are prefetched and returned in (B,3,H,W) batches, see prefetch()
+    def __init__(self, path, img_size=640, stride=32, auto=True, batch_size=1, workers=0, buffers=3):
         p = str(Path(path).resolve())  # os-agnostic absolute path
         if '*' in p:
             files = sorted(glob.glob(p, recursive=True))  # glob
@@ -180,6 +330,10 @@ class LoadImages:
         self.video_flag = [False] * ni + [True] * nv
         self.mode = 'image'
         self.auto = auto
+        self.batch_size = batch_size
+        self.workers = max(workers, 1) if batch_size > 1 else workers
+        self.buffers = buffers  # batches in flight
+        self.prefetch = self.workers > 0
         if any(videos):
             self.new_video(videos[0])  # new video
         else:
@@ -189,9 +343,13 @@ class LoadImages:
 
     def __iter__(self):
         self.count = 0
+        if self.prefetch:
+            self.batches = self.prefetch_batches()
         return self
 
     def __next__(self):
+        if self.prefetch:
+            return next(self.batches)
         if self.count == self.nf:
             raise StopIteration
         path = self.files[self.count]
@@ -234,10 +392,118 @@ class LoadImages:
         self.cap = cv2.VideoCapture(path)
         self.frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
+    def read_frames(self):
+        # Yields (batch key, count, path, img0, frame, info) for every frame, frames with the same key can be batched
+        # Videos are decoded here in order, images only have their header read, img0 is None and read in load_frame()
+        for count, (path, video) in enumerate(zip(self.files, self.video_flag)):
+            if video:
+                cap = cv2.VideoCapture(path)
+                try:
+                    info = VideoInfo(cap)
+                    w, h = int(info.get(cv2.CAP_PROP_FRAME_WIDTH)), int(info.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                    key, frame = (path, letterbox_shape((h, w), self.img_size, self.auto, stride=self.stride)), 0
+                    while True:
+                        ret_val, img0 = cap.read()
+                        if not ret_val:
+                            break
+                        frame += 1
+                        yield key, count, path, img0, frame, info
+                finally:
+                    cap.release()
+            else:
+                w, h = exif_size(Image.open(path))  # cv2.imread() applies EXIF orientation too
+                key = '', letterbox_shape((h, w), self.img_size, self.auto, stride=self.stride)
+                yield key, count, path, None, 0, None
+
+    def load_frame(self, buffer, j, img0, path):
+        # Letterbox a frame into batch buffer row j, runs on the thread pool
+        if img0 is None:
+            img0 = cv2.imread(path)  # BGR
+            assert img0 is not None, f'Image Not Found {path}'
+        img = letterbox(img0, self.img_size, stride=self.stride, auto=self.auto)[0]
+        if img.shape[:2] != buffer.shape[2:]:  # header size was off, i.e. unusual EXIF orientation
+            img = letterbox(img0, buffer.shape[2:], stride=self.stride, auto=False)[0]
+        buffer[j] = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        return img0
+
+    def prefetch_batches(self):
+        # Yields (paths, (B,3,H,W) uint8, im0s, VideoInfo, s) with up to batch_size frames of one video or consecutive
+        # images of the same shape. A reader thread decodes videos and passes every frame to a thread pool, which
+        # letterboxes it into a ring of preallocated (pinned) batch buffers so the model does not wait for pre-processing
+        ring, free, ready = [None] * self.buffers, queue.Queue(), queue.Queue()
+        for b in range(self.buffers):
+            free.put(b)
+        pool, stop = ThreadPool(self.workers), Event()
+
+        def read():
+            frames = self.read_frames()  # the capture is only ever used by this thread
+            try:
+                key, b, jobs, meta = None, None, [], []
+                for k, count, path, img0, frame, info in frames:
+                    if jobs and (k != key or len(jobs) == self.batch_size):
+                        ready.put((b, jobs, meta))
+                        jobs, meta = [], []
+                    if not jobs:  # new batch
+                        key, b, shape = k, free.get(), (self.batch_size, 3, *k[1])  # blocks until a buffer is free
+                        if stop.is_set():  # consumer is gone
+                            return
+                        if ring[b] is None or ring[b].shape != shape:
+                            pin = torch.cuda.is_available()  # page-locked for faster host to device copies
+                            ring[b] = torch.empty(shape, dtype=torch.uint8, pin_memory=pin).numpy()
+                    jobs.append(pool.apply_async(self.load_frame, (ring[b], len(jobs), img0, path)))
+                    meta.append((count, path, frame, info))
+                if jobs:
+                    ready.put((b, jobs, meta))
+                ready.put(None)
+            except Exception as e:
+                ready.put(e)
+            finally:
+                frames.close()  # releases the capture
+
+        thread = Thread(target=read, daemon=True)
+        thread.start()
+        try:
+            b = None
+            while True:
+                if b is not None:
+                    free.put(b)  # previous batch has been used
+                x = ready.get()
+                if isinstance(x, Exception):
+                    raise x
+                if x is None:
+                    return
+                b, jobs, meta = x
+                im0s = [job.get() for job in jobs]
+                counts, paths, self.frame, infos = zip(*meta)
+                info, self.count = infos[0], counts[-1] + 1
+                self.mode = 'image' if info is None else 'video'
+                if info is None:
+                    self.s = [f'image {c + 1}/{self.nf} {p}: ' for c, p in zip(counts, paths)]
+                else:
+                    self.frames = int(info.get(cv2.CAP_PROP_FRAME_COUNT))
+                    self.s = [f'video {c + 1}/{self.nf} ({f}/{self.frames}) {p}: '
+                              for c, p, f in zip(counts, paths, self.frame)]
+                yield list(paths), ring[b][:len(jobs)], im0s, info, self.s
+        finally:  # exhausted, failed or abandoned
+            stop.set()
+            free.put(None)  # wakes the reader if it waits for a buffer
+            thread.join()
+            pool.close()
+
     def __len__(self):
         return self.nf  # number of files
 
 
+class VideoInfo:
+    # cv2.VideoCapture.get() values read by the thread that decodes the video, the capture is not thread-safe
+    def __init__(self, cap):
+        self.props = {p: cap.get(p) for p in (cv2.CAP_PROP_FRAME_COUNT, cv2.CAP_PROP_FPS,
+                                              cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT)}
+
+    def get(self, prop):
+        return self.props[prop]
+
+
 class LoadWebcam:  # for inference
     # YOLOv5 local webcam dataloader, i.e. `python detect.py --source 0`
     def __init__(self, pipe='0', img_size=640, stride=32):
@@ -369,18 +635,120 @@ class LoadStreams:
         return len(self.sources)  # 1E12 frames = 32 streams at 30 FPS for 30 years
 
 
-def img2label_paths(img_paths):
+def label_index(label_dir):
+    # Returns {stem: label path} for every *.txt in a shared label store, i.e. CURE-TSD/labels/**/01_001.txt
+    # Listed again on every call, labels may be added while the process runs (i.e. by prepare_data.py stages)
+    return {Path(x).stem: x for x in glob.glob(os.path.join(label_dir, '**', '*.txt'), recursive=True)}
+
+
+def img2label_paths(img_paths, label_dir=None):
     # Define label paths as a function of image paths
+    if label_dir:  # shared label store, labels are looked up by image stem for every challenge type/level
+        index = label_index(str(Path(label_dir).resolve()))
+        return [index.get(Path(x).stem, os.path.join(label_dir, Path(x).stem + '.txt')) for x in img_paths]
     sa, sb = os.sep + 'images' + os.sep, os.sep + 'labels' + os.sep  # /images/, /labels/ substrings
     return [sb.join(x.rsplit(sa, 1)).rsplit('.', 1)[0] + '.txt' for x in img_paths]
 
 
+class RaggedArray:
+    # Sequence of variable-length rows sharing one array, row i is data[starts[i]:ends[i]]
+    # Holds the labels of a dataset as 3 (memory-mapped) arrays instead of one small array per image
+    def __init__(self, data, starts, ends):
+        self.data = data
+        self.starts, self.ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_offsets(cls, data, offsets):
+        return cls(data, offsets[:-1], offsets[1:])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return self.data[self.starts[i]:self.ends[i]]
+
+    def __iter__(self):
+        return (self.data[a:b] for a, b in zip(self.starts, self.ends))
+
+    def take(self, index):
+        # Rows in index order, i.e. sorted by aspect ratio, data is shared
+        return RaggedArray(self.data, self.starts[index], self.ends[index])
+
+    def filter(self, mask):
+        # Keep the data rows where mask is True, rows must not overlap
+        c = np.concatenate(([0], np.cumsum(mask)))  # new position of every data row
+        return RaggedArray(self.data[mask], c[self.starts], c[self.ends])
+
+
+class RaggedSegments:
+    # Polygon segments per image, image i owns boxes[i] and box j owns points[j], i.e. [(k, 2), ...] per image
+    def __init__(self, points, boxes):
+        self.points, self.boxes = points, boxes  # RaggedArray of points per box, RaggedArray of labels per image
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, i):
+        a, b = self.boxes.starts[i], self.boxes.ends[i]
+        if a == b or self.points.starts[a] == self.points.ends[a]:  # box labels only
+            return []
+        return [self.points[j] for j in range(a, b)]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+LABEL_CACHE_ARRAYS = 'fingerprints', 'status', 'labels', 'label_offsets', 'shapes', 'segments', 'segment_offsets'
+
+
+def load_label_cache(path):
+    # Load a *.cache directory written by LoadImagesAndLabels.cache_labels(), arrays are memory-mapped
+    with open(path / 'meta.json') as f:
+        x = json.load(f)
+    for k in 'files', 'label_files':
+        with open(path / f'{k}.txt') as f:
+            x[k] = f.read().splitlines()
+    for k in LABEL_CACHE_ARRAYS:
+        x[k] = np.load(path / f'{k}.npy', mmap_mode='r')
+    return x
+
+
+def save_label_cache(path, x):
+    # Save a label cache as a directory of plain arrays, no pickle:
+    #   files.txt             image paths, one per line, including corrupted images
+    #   label_files.txt       label paths, one per line
+    #   fingerprints.npy      int64 (n, 6) image and label (size, mtime_ns, inode), see file_fingerprints()
+    #   status.npy            int64 (n, 4) number missing, found, empty, corrupt per image
+    #   labels.npy            float32 (n_labels, 5) labels of all images
+    #   label_offsets.npy     int64 (n + 1) start of each image's labels in labels.npy
+    #   shapes.npy            float64 (n, 2) image width, height
+    #   segments.npy          float32 (n_points, 2) polygon points of all labels
+    #   segment_offsets.npy   int64 (n_labels + 1) start of each label's points in segments.npy
+    #   meta.json             version, results and msgs by image, written last
+    if path.is_file():
+        path.unlink()  # pickled cache of an older version
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'meta.json').unlink(missing_ok=True)  # invalid until fully written
+    for k in 'files', 'label_files':
+        with open(path / f'{k}.txt.tmp', 'w') as f:
+            f.writelines(x + '\n' for x in x[k])
+        os.replace(path / f'{k}.txt.tmp', path / f'{k}.txt')
+    for k in LABEL_CACHE_ARRAYS:  # replaced, not overwritten, the previous cache may still be memory-mapped
+        with open(path / f'{k}.npy.tmp', 'wb') as f:
+            np.save(f, x[k])
+        os.replace(path / f'{k}.npy.tmp', path / f'{k}.npy')
+    with open(path / 'meta.json', 'w') as f:
+        json.dump({k: x[k] for k in ('version', 'results', 'msgs')}, f)
+
+
 class LoadImagesAndLabels(Dataset):
     # YOLOv5 train_loader/val_loader, loads images and labels for training and validation
-    cache_version = 0.6  # dataset labels *.cache version
+    cache_version = 0.8  # dataset labels *.cache version
+    cache_suffix = '.cache'  # dataset labels *.cache suffix
 
     def __init__(self, path, img_size=640, batch_size=16, augment=False, hyp=None, rect=False, image_weights=False,
-                 cache_images=False, single_cls=False, stride=32, pad=0.0, prefix=''):
+                 cache_images=False, single_cls=False, stride=32, pad=0.0, prefix='', label_dir=None,
+                 shared_labels=None):
         self.img_size = img_size
         self.augment = augment
         self.hyp = hyp
@@ -390,6 +758,7 @@ class LoadImagesAndLabels(Dataset):
         self.mosaic_border = [-img_size // 2, -img_size // 2]
         self.stride = stride
         self.path = path
+        self.label_dir = label_dir  # optional shared label store
         self.albumentations = Albumentations() if augment else None
 
         try:
@@ -397,8 +766,7 @@ class LoadImagesAndLabels(Dataset):
             for p in path if isinstance(path, list) else [path]:
                 p = Path(p)  # os-agnostic
                 if p.is_dir():  # dir
-                    f += glob.glob(str(p / '**' / '*.*'), recursive=True)
-                    # f = list(p.rglob('*.*'))  # pathlib
+                    f += self.dir_files(p)
                 elif p.is_file():  # file
                     with open(p) as t:
                         t = t.read().strip().splitlines()
@@ -414,14 +782,19 @@ class LoadImagesAndLabels(Dataset):
             raise Exception(f'{prefix}Error loading data from {path}: {e}\nSee {HELP_URL}')
 
         # Check cache
-        self.label_files = img2label_paths(self.img_files)  # labels
-        cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix('.cache')
+        self.label_files = img2label_paths(self.img_files, label_dir)  # labels
+        cache_dir = Path(self.img_files[0] if label_dir else self.label_files[0]).parent  # by images if shared
+        cache_path = (p if p.is_file() else cache_dir).with_suffix(self.cache_suffix)
+        fingerprints = self.fingerprints()
         try:
-            cache, exists = np.load(cache_path, allow_pickle=True).item(), True  # load dict
+            cache = load_label_cache(cache_path)  # load arrays
             assert cache['version'] == self.cache_version  # same version
-            assert cache['hash'] == get_hash(self.label_files + self.img_files)  # same hash
-        except:
-            cache, exists = self.cache_labels(cache_path, prefix), False  # cache
+            exists = cache['files'] == self.img_files and cache['label_files'] == self.label_files and \
+                np.array_equal(cache['fingerprints'], fingerprints)  # same files
+        except Exception:
+            cache, exists = None, False
+        if not exists:
+            cache = self.cache_labels(cache_path, prefix, cache, fingerprints)  # verify added and modified files
 
         # Display cache
         nf, nm, ne, nc, n = cache.pop('results')  # found, missing, empty, corrupted, total
@@ -429,17 +802,22 @@ class LoadImagesAndLabels(Dataset):
             d = f"Scanning '{cache_path}' images and labels... {nf} found, {nm} missing, {ne} empty, {nc} corrupted"
             tqdm(None, desc=prefix + d, total=n, initial=n)  # display cache results
             if cache['msgs']:
-                LOGGER.info('\n'.join(cache['msgs']))  # display warnings
+                LOGGER.info('\n'.join(cache['msgs'].values()))  # display warnings
         assert nf > 0 or not augment, f'{prefix}No labels in {cache_path}. Can not train without labels. See {HELP_URL}'
 
-        # Read cache
-        [cache.pop(k) for k in ('hash', 'version', 'msgs')]  # remove items
-        labels, shapes, self.segments = zip(*cache.values())
-        self.labels = list(labels)
-        self.shapes = np.array(shapes, dtype=np.float64)
-        self.img_files = list(cache.keys())  # update
-        self.label_files = img2label_paths(cache.keys())  # update
-        n = len(shapes)  # number of images
+        # Read cache, labels stay memory-mapped and are shared by DataLoader workers through page cache
+        self.labels = RaggedArray.from_offsets(cache['labels'], cache['label_offsets'])
+        points = RaggedArray.from_offsets(cache['segments'], cache['segment_offsets'])  # polygon points per label
+        self.shapes = np.array(cache['shapes'], dtype=np.float64)
+        valid = np.flatnonzero(np.asarray(cache['status'])[:, 3] == 0)  # drop corrupted images
+        if len(valid) < len(self.shapes):
+            self.labels, self.shapes = self.labels.take(valid), self.shapes[valid]
+            self.img_files = [self.img_files[i] for i in valid]  # update
+            self.label_files = [self.label_files[i] for i in valid]  # update, without listing a label store again
+        if shared_labels is not None:  # {label files: labels} of other datasets, i.e. challenge variants
+            self.labels, points = shared_labels.setdefault(tuple(self.label_files), (self.labels, points))
+        self.segments = RaggedSegments(points, self.labels)
+        n = len(self.shapes)  # number of images
         bi = np.floor(np.arange(n) / batch_size).astype(np.int)  # batch index
         nb = bi[-1] + 1  # number of batches
         self.batch = bi  # batch index of image
@@ -448,27 +826,26 @@ class LoadImagesAndLabels(Dataset):
 
         # Update labels
         include_class = []  # filter labels to include only these classes (optional)
-        include_class_array = np.array(include_class).reshape(1, -1)
-        for i, (label, segment) in enumerate(zip(self.labels, self.segments)):
-            if include_class:
-                j = (label[:, 0:1] == include_class_array).any(1)
-                self.labels[i] = label[j]
-                if segment:
-                    self.segments[i] = segment[j]
-            if single_cls:  # single-class training, merge all classes into 0
-                self.labels[i][:, 0] = 0
-                if segment:
-                    self.segments[i][:, 0] = 0
+        if include_class:
+            j = np.isin(self.labels.data[:, 0], include_class)
+            self.labels = self.labels.filter(j)
+            self.segments = RaggedSegments(self.segments.points.take(np.flatnonzero(j)), self.labels)
+        if single_cls:  # single-class training, merge all classes into 0
+            l = self.labels  # copy out of the read-only cache, labels may be shared with other datasets
+            self.labels = RaggedArray(np.array(l.data), l.starts, l.ends)
+            self.labels.data[:, 0] = 0
+            self.segments = RaggedSegments(self.segments.points, self.labels)
 
         # Rectangular Training
         if self.rect:
             # Sort by aspect ratio
             s = self.shapes  # wh
             ar = s[:, 1] / s[:, 0]  # aspect ratio
-            irect = ar.argsort()
+            irect = ar.argsort(kind='stable')  # stable keeps the frames of a video in order, see LoadVideosAndLabels
             self.img_files = [self.img_files[i] for i in irect]
             self.label_files = [self.label_files[i] for i in irect]
-            self.labels = [self.labels[i] for i in irect]
+            self.labels = self.labels.take(irect)
+            self.segments = RaggedSegments(self.segments.points, self.labels)
             self.shapes = s[irect]  # wh
             ar = ar[irect]
 
@@ -485,63 +862,180 @@ class LoadImagesAndLabels(Dataset):
             self.batch_shapes = np.ceil(np.array(shapes) * img_size / stride + pad).astype(np.int) * stride
 
         # Cache images into memory for faster training (WARNING: large datasets may exceed system RAM)
-        self.imgs, self.img_npy = [None] * n, [None] * n
-        if cache_images:
-            if cache_images == 'disk':
-                self.im_cache_dir = Path(Path(self.img_files[0]).parent.as_posix() + '_npy')
-                self.img_npy = [self.im_cache_dir / Path(f).with_suffix('.npy').name for f in self.img_files]
-                self.im_cache_dir.mkdir(parents=True, exist_ok=True)
+        self.imgs, self.shard = [None] * n, None
+        if cache_images == 'disk':  # packed shard, memory-mapped and shared by DataLoader workers through page cache
+            self.cache_shard(cache_path.with_suffix('.shard'), prefix)  # i.e. train.shard next to train.cache
+        elif cache_images:
             gb = 0  # Gigabytes of cached images
             self.img_hw0, self.img_hw = [None] * n, [None] * n
-            results = ThreadPool(NUM_THREADS).imap(lambda x: load_image(*x), zip(repeat(self), range(n)))
+            results = ThreadPool(NUM_THREADS).imap(self.load_image, range(n))
             pbar = tqdm(enumerate(results), total=n)
             for i, x in pbar:
-                if cache_images == 'disk':
-                    if not self.img_npy[i].exists():
-                        np.save(self.img_npy[i].as_posix(), x[0])
-                    gb += self.img_npy[i].stat().st_size
-                else:
-                    self.imgs[i], self.img_hw0[i], self.img_hw[i] = x  # im, hw_orig, hw_resized = load_image(self, i)
-                    gb += self.imgs[i].nbytes
+                self.imgs[i], self.img_hw0[i], self.img_hw[i] = x  # im, hw_orig, hw_resized = self.load_image(i)
+                gb += self.imgs[i].nbytes
                 pbar.desc = f'{prefix}Caching images ({gb / 1E9:.1f}GB {cache_images})'
             pbar.close()
 
-    def cache_labels(self, path=Path('./labels.cache'), prefix=''):
+    def dir_files(self, p):
+        # Returns the files in directory p and its subdirectories
+        return glob.glob(str(p / '**' / '*.*'), recursive=True)
+        # return list(p.rglob('*.*'))  # pathlib
+
+    def fingerprints(self):
+        # Returns the fingerprints of the images and labels, see file_fingerprints()
+        return file_fingerprints(self.img_files, self.label_files)
+
+    def verify_args(self, todo, prefix=''):
+        # Returns the arguments of verify_image_label() for the images at indices 'todo'
+        return zip([self.img_files[k] for k in todo], [self.label_files[k] for k in todo], repeat(prefix))
+
+    def cache_labels(self, path=Path('./labels.cache'), prefix='', cache=None, fingerprints=None):
         # Cache dataset labels, check images and read shapes
-        x = {}  # dict
-        nm, nf, ne, nc, msgs = 0, 0, 0, 0, []  # number missing, found, empty, corrupt, messages
+        # Images whose image and label fingerprints match a row of cache are not verified again
+        n = len(self.img_files)
+        if fingerprints is None:
+            fingerprints = self.fingerprints()
+        labels, shapes, segments = [None] * n, np.zeros((n, 2)), [None] * n  # segments are points per label
+        status, msgs = np.zeros((n, 4), dtype=np.int64), {}  # number missing, found, empty, corrupt, messages
+        reuse = np.full(n, -1)  # row of each unchanged image in cache
+        if cache is not None:
+            index = {f: i for i, f in enumerate(cache['files'])}
+            reuse = np.array([index.get(f, -1) for f in self.img_files], dtype=np.int64)
+            j = np.flatnonzero(reuse >= 0)
+            same = (np.asarray(cache['fingerprints'])[reuse[j]] == fingerprints[j]).all(1)
+            same &= [cache['label_files'][i] == self.label_files[k] for i, k in zip(reuse[j], j)]
+            reuse[j[~same]] = -1  # modified
+            LOGGER.info(f"{prefix}Updating '{path}': {n - len(j)} added, {(~same).sum()} modified, "
+                        f"{len(index) - len(j)} removed, {same.sum()} unchanged")
+            cl = RaggedArray.from_offsets(cache['labels'], cache['label_offsets'])
+            cp = RaggedArray.from_offsets(cache['segments'], cache['segment_offsets'])
+            for k in np.flatnonzero(reuse >= 0):
+                i = reuse[k]
+                labels[k], segments[k] = cl[i], [cp[b] for b in range(cl.starts[i], cl.ends[i])]
+                if self.img_files[k] in cache['msgs']:
+                    msgs[self.img_files[k]] = cache['msgs'][self.img_files[k]]
+            j = np.flatnonzero(reuse >= 0)
+            shapes[j], status[j] = cache['shapes'][reuse[j]], cache['status'][reuse[j]]
+
+        todo = np.flatnonzero(reuse < 0)  # images to verify
+        nm, nf, ne, nc = status.sum(0)
+        new_msgs = []
         desc = f"{prefix}Scanning '{path.parent / path.stem}' images and labels..."
         with Pool(NUM_THREADS) as pool:
-            pbar = tqdm(pool.imap(verify_image_label, zip(self.img_files, self.label_files, repeat(prefix))),
-                        desc=desc, total=len(self.img_files))
-            for im_file, l, shape, segments, nm_f, nf_f, ne_f, nc_f, msg in pbar:
+            pbar = tqdm(pool.imap(verify_image_label, self.verify_args(todo, prefix)), desc=desc, total=len(todo))
+            for k, (im_file, l, shape, segs, nm_f, nf_f, ne_f, nc_f, msg) in zip(todo, pbar):
                 nm += nm_f
                 nf += nf_f
                 ne += ne_f
                 nc += nc_f
+                status[k] = nm_f, nf_f, ne_f, nc_f
+                labels[k], segments[k] = np.zeros((0, 5), dtype=np.float32), []
                 if im_file:
-                    x[im_file] = [l, shape, segments]
+                    labels[k], shapes[k] = l, shape
+                    segments[k] = list(segs) or [np.zeros((0, 2), dtype=np.float32)] * len(l)
                 if msg:
-                    msgs.append(msg)
+                    msgs[self.img_files[k]] = msg
+                    new_msgs.append(msg)
                 pbar.desc = f"{desc}{nf} found, {nm} missing, {ne} empty, {nc} corrupted"
 
         pbar.close()
-        if msgs:
-            LOGGER.info('\n'.join(msgs))
+        if new_msgs:
+            LOGGER.info('\n'.join(new_msgs))
         if nf == 0:
             LOGGER.warning(f'{prefix}WARNING: No labels found in {path}. See {HELP_URL}')
-        x['hash'] = get_hash(self.label_files + self.img_files)
-        x['results'] = nf, nm, ne, nc, len(self.img_files)
-        x['msgs'] = msgs  # warnings
+        segments = [x for s in segments for x in s]  # points per label
+        x = {'files': self.img_files,
+             'label_files': self.label_files,
+             'fingerprints': fingerprints,
+             'status': status,
+             'labels': np.concatenate(labels or [np.zeros((0, 5))], 0).astype(np.float32),
+             'label_offsets': np.cumsum([0] + [len(l) for l in labels]).astype(np.int64),
+             'shapes': shapes,
+             'segments': np.concatenate(segments or [np.zeros((0, 2))], 0).astype(np.float32),
+             'segment_offsets': np.cumsum([0] + [len(s) for s in segments]).astype(np.int64)}
+        x['results'] = int(nf), int(nm), int(ne), int(nc), n
+        x['msgs'] = msgs  # warnings by image
         x['version'] = self.cache_version  # cache version
         try:
-            np.save(path, x)  # save cache for next time
-            path.with_suffix('.cache.npy').rename(path)  # remove .npy suffix
-            LOGGER.info(f'{prefix}New cache created: {path}')
+            save_label_cache(path, x)  # save cache for next time
+            LOGGER.info(f"{prefix}{'Cache updated' if cache is not None else 'New cache created'}: {path}")
         except Exception as e:
             LOGGER.warning(f'{prefix}WARNING: Cache directory {path.parent} is not writeable: {e}')  # not writeable
         return x
 
+    def cache_shard(self, path, prefix=''):
+        # Cache resized images and labels into a packed shard directory:
+        #   images.bin          uint8 images back to back
+        #   index.npy           int64 (offset, h0, w0, h, w, c) per image
+        #   labels.npy          float32 (n_labels, 5) labels of all images
+        #   label_offsets.npy   int64 (n + 1) start of each image's labels in labels.npy
+        #   meta.json           hash of the images and resize settings, written last, and hash of the labels
+        # Images are packed again only when the image files or resize settings change, labels whenever they change
+        # load_image() slices zero-copy views out of the memory-mapped images.bin
+        n = len(self.img_files)
+        labels = np.concatenate(self.labels, 0) if n else np.zeros((0, 5), dtype=np.float32)
+        lo = np.cumsum([0] + [len(x) for x in self.labels]).astype(np.int64)  # label offsets
+        rows = np.arange(lo[-1]) + np.repeat(self.labels.starts - lo[:-1], np.diff(lo))  # source row of every label
+        h = hashlib.md5(get_hash(self.img_files).encode())  # files
+        h.update(str((self.img_size, self.augment, self.cache_version)).encode())  # resize settings
+        h = h.hexdigest()
+        hl = hashlib.md5(labels.astype(np.float32).tobytes()).hexdigest()  # labels after filtering, i.e. --single-cls
+        try:
+            with open(path / 'meta.json') as f:
+                meta = json.load(f)
+            assert meta['hash'] == h  # same images and settings
+            LOGGER.info(f'{prefix}Using cached images from {path}')
+        except Exception:
+            path.mkdir(parents=True, exist_ok=True)
+            (path / 'meta.json').unlink(missing_ok=True)  # invalid until fully written
+            index, gb = np.zeros((n, 6), dtype=np.int64), 0
+            results = ThreadPool(NUM_THREADS).imap(self.load_image, range(n))
+            pbar = tqdm(enumerate(results), total=n)
+            with open(path / 'images.bin', 'wb') as f:
+                for i, (im, hw0, _) in pbar:
+                    index[i] = gb, *hw0, *im.shape
+                    f.write(np.ascontiguousarray(im).tobytes())
+                    gb += im.nbytes
+                    pbar.desc = f'{prefix}Caching images ({gb / 1E9:.1f}GB disk)'
+            pbar.close()
+            np.save(path / 'index.npy', index)
+            meta = {'hash': h, 'images': n, 'bytes': gb}
+        if meta.get('labels') != hl:  # new shard, or labels changed
+            for k, x in ('labels', labels.astype(np.float32)), ('label_offsets', lo):  # the old ones may be mapped
+                with open(path / f'{k}.npy.tmp', 'wb') as f:
+                    np.save(f, x)
+                os.replace(path / f'{k}.npy.tmp', path / f'{k}.npy')
+            meta['labels'] = hl
+            with open(path / 'meta.json.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(path / 'meta.json.tmp', path / 'meta.json')
+
+        # Memory-map, labels become read-only views (copied in __getitem__ and load_mosaic before use)
+        self.shard = np.memmap(path / 'images.bin', dtype=np.uint8, mode='r')
+        self.shard_index = np.load(path / 'index.npy')
+        labels, lo = np.load(path / 'labels.npy', mmap_mode='r'), np.load(path / 'label_offsets.npy')
+        self.labels = RaggedArray.from_offsets(labels, lo)
+        self.segments = RaggedSegments(self.segments.points.take(rows), self.labels)  # points in shard label order
+
+    def load_image(self, i):
+        # loads 1 image from dataset index 'i', returns im, original hw, resized hw
+        im = self.imgs[i]
+        if im is None and self.shard is not None:  # cached in packed shard, zero-copy view of the memory map
+            o, h0, w0, h, w, c = self.shard_index[i]
+            return self.shard[o:o + h * w * c].reshape(h, w, c), (h0, w0), (h, w)
+        if im is None:  # not cached in ram, read image
+            path = self.img_files[i]
+            im = cv2.imread(path)  # BGR
+            assert im is not None, f'Image Not Found {path}'
+            h0, w0 = im.shape[:2]  # orig hw
+            r = self.img_size / max(h0, w0)  # ratio
+            if r != 1:  # if sizes are not equal
+                im = cv2.resize(im, (int(w0 * r), int(h0 * r)),
+                                interpolation=cv2.INTER_AREA if r < 1 and not self.augment else cv2.INTER_LINEAR)
+            return im, (h0, w0), im.shape[:2]  # im, hw_original, hw_resized
+        else:
+            return self.imgs[i], self.img_hw0[i], self.img_hw[i]  # im, hw_original, hw_resized
+
     def __len__(self):
         return len(self.img_files)
 
@@ -567,7 +1061,7 @@ class LoadImagesAndLabels(Dataset):
 
         else:
             # Load image
-            img, (h0, w0), (h, w) = load_image(self, index)
+            img, (h0, w0), (h, w) = self.load_image(index)
 
             # Letterbox
             shape = self.batch_shapes[self.batch[index]] if self.rect else self.img_size  # final letterboxed shape
@@ -658,28 +1152,143 @@ class LoadImagesAndLabels(Dataset):
         return torch.stack(img4, 0), torch.cat(label4, 0), path4, shapes4
 
 
-# Ancillary functions --------------------------------------------------------------------------------------------------
-def load_image(self, i):
-    # loads 1 image from dataset index 'i', returns im, original hw, resized hw
-    im = self.imgs[i]
-    if im is None:  # not cached in ram
-        npy = self.img_npy[i]
-        if npy and npy.exists():  # load npy
-            im = np.load(npy)
-        else:  # read image
-            path = self.img_files[i]
-            im = cv2.imread(path)  # BGR
-            assert im is not None, f'Image Not Found {path}'
+class VideoReader:
+    # Video frame decoder keeping the last few cv2.VideoCapture objects open, frames can be read in any order
+    # A frame up to 'gop' frames after the last one read from an open capture is reached by decoding forward, any other
+    # frame costs one seek and one decode. There is no cache of decoded frames, shuffled access (i.e. the 3 random
+    # images of a mosaic) decodes only the frames it reads, SequenceSampler keeps the rest of the reads sequential
+    def __init__(self, transform=None, gop=30, max_caps=4):
+        self.transform = transform  # applied to each decoded frame, i.e. resize
+        self.gop = gop  # frames decoded forward instead of seeking
+        self.max_caps = max_caps  # open cv2.VideoCapture objects kept
+        self.caps = OrderedDict()  # slot: [video, cv2.VideoCapture, next frame index]
+        self.pid = os.getpid()  # readers can not be shared across DataLoader workers
+
+    def __call__(self, video, frame):
+        # Returns 0-indexed 'frame' of 'video'
+        ahead = {k: frame - x[2] for k, x in self.caps.items() if x[0] == video and 0 <= frame - x[2] <= self.gop}
+        if ahead:  # decode forward from the closest capture
+            k = min(ahead, key=ahead.get)
+        else:  # seek a new capture, or the least recently used one
+            k = len(self.caps) if len(self.caps) < self.max_caps else next(iter(self.caps))
+            if k not in self.caps or self.caps[k][0] != video:
+                if k in self.caps:
+                    self.caps[k][1].release()
+                self.caps[k] = [video, cv2.VideoCapture(video), 0]
+            if self.caps[k][2] != frame:
+                self.caps[k][1].set(cv2.CAP_PROP_POS_FRAMES, frame)
+        self.caps.move_to_end(k)
+        cap, pos = self.caps[k][1:]
+        for _ in range(frame - pos if ahead else 0):
+            cap.grab()  # decode without conversion to BGR
+        ret_val, im = cap.read()
+        self.caps[k][2] = frame + 1
+        assert ret_val, f'Frame {frame} Not Found in {video}'
+        return self.transform(im) if self.transform else im
+
+
+class SequenceSampler:
+    # Shuffles the runs of 'gop' consecutive frames of each video in a LoadVideosAndLabels dataset and yields the frames
+    # of a run in order, so a batch is decoded sequentially by VideoReader instead of seeking to every frame
+    # With rank != -1 the runs are split between DDP processes like DistributedSampler, call set_epoch() every epoch
+    def __init__(self, dataset, gop=30, shuffle=True, rank=-1, seed=0):
+        runs = {}  # (video, frame // gop): [(frame, index), ...]
+        for i, (v, f) in enumerate(dataset.videos):
+            runs.setdefault((v, f // gop), []).append((f, i))
+        self.runs = [[i for _, i in sorted(x)] for x in runs.values()]
+        self.shuffle, self.seed, self.epoch, self.n = shuffle, seed, 0, len(dataset)
+        self.num_replicas, self.rank = 1, 0
+        if rank != -1:  # DDP
+            self.num_replicas, self.rank = torch.distributed.get_world_size(), torch.distributed.get_rank()
+
+    def __len__(self):
+        return math.ceil(self.n / self.num_replicas)
+
+    def __iter__(self):
+        order = range(len(self.runs))
+        if self.shuffle:
+            g = None  # new order every pass
+            if self.num_replicas > 1:  # same order in every process
+                g = torch.Generator()
+                g.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(len(self.runs), generator=g).tolist()
+        indices = [i for r in order for i in self.runs[r]]
+        n = len(self)
+        indices += indices[:n * self.num_replicas - len(indices)]  # pad to split evenly
+        return iter(indices[self.rank * n:(self.rank + 1) * n])  # contiguous part keeps the runs together
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+
+def img2video_paths(img_paths):
+    # Define (video, 0-indexed frame) as a function of extracted image paths, i.e. .../09/01/images/01_001.jpg to
+    # (.../09/01/01.mp4, 0), matching the frame names written by 02_extract_frames.py
+    videos = []
+    for x in img_paths:
+        p = Path(x)
+        sequence, frame = p.stem.rsplit('_', 1)
+        videos.append((str(p.parent.parent / f'{sequence}.mp4'), int(frame) - 1))
+    return videos
+
+
+class LoadVideosAndLabels(LoadImagesAndLabels):
+    # YOLOv5 train_loader/val_loader that decodes frames straight from videos instead of extracted images
+    # 'path' is the same as for LoadImagesAndLabels (i.e. train.txt manifests of ./images/01_001.jpg) or directories
+    # of videos for all of their frames. Images do not need to exist, frames are read from ../01.mp4
+    cache_suffix = '.video.cache'  # labels *.cache of the frames, fingerprinted by video instead of image
+
+    def __init__(self, path, img_size=640, batch_size=16, augment=False, hyp=None, rect=False, image_weights=False,
+                 cache_images=False, single_cls=False, stride=32, pad=0.0, prefix='', label_dir=None,
+                 shared_labels=None, gop=30, max_caps=4):
+        self.gop, self.max_caps, self.reader = gop, max_caps, None  # per-worker VideoReader, see load_image()
+        if cache_images:  # frames are decoded on demand
+            LOGGER.warning(f'{prefix}WARNING: --cache is not supported for video datasets, ignoring')
+        super().__init__(path, img_size, batch_size, augment, hyp, rect, image_weights, False, single_cls, stride, pad,
+                         prefix, label_dir, shared_labels)
+        self.videos = img2video_paths(self.img_files)  # (video, frame) of every frame, in dataset order
+
+    def dir_files(self, p):
+        # Returns the frames of the videos in directory p and its subdirectories as image files, i.e. images/01_001.jpg
+        f = []
+        for v in sorted(glob.glob(str(p / '**' / '*.*'), recursive=True)):
+            if v.split('.')[-1].lower() in VID_FORMATS:
+                n = int(cv2.VideoCapture(v).get(cv2.CAP_PROP_FRAME_COUNT))  # number of frames
+                f += [str(Path(v).parent / 'images' / f'{Path(v).stem}_{j + 1:03}.jpg') for j in range(n)]
+        return f
+
+    def fingerprints(self):
+        # Returns the fingerprints of the videos and labels, a frame is verified again when its video changes
+        return file_fingerprints([v for v, _ in img2video_paths(self.img_files)], self.label_files)
+
+    def verify_args(self, todo, prefix=''):
+        # Returns the arguments of verify_image_label() with the (width, height) of each frame, videos are opened once
+        videos = [v for v, _ in img2video_paths([self.img_files[k] for k in todo])]
+        wh = {}  # video: (width, height), (0, 0) if it can not be opened
+        for v in set(videos):
+            cap = cv2.VideoCapture(v)
+            wh[v] = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            cap.release()
+        return zip([self.img_files[k] for k in todo], [self.label_files[k] for k in todo], repeat(prefix),
+                   [wh[v] for v in videos])
+
+    def load_image(self, i):
+        # loads 1 frame from dataset index 'i' through this worker's VideoReader, returns im, original hw, resized hw
+        if self.reader is None or self.reader.pid != os.getpid():  # new DataLoader worker
+            self.reader = VideoReader(self.resize, gop=self.gop, max_caps=self.max_caps)
+        return self.reader(*self.videos[i])
+
+    def resize(self, im):
+        # Resize a decoded frame like LoadImagesAndLabels.load_image()
         h0, w0 = im.shape[:2]  # orig hw
         r = self.img_size / max(h0, w0)  # ratio
         if r != 1:  # if sizes are not equal
             im = cv2.resize(im, (int(w0 * r), int(h0 * r)),
                             interpolation=cv2.INTER_AREA if r < 1 and not self.augment else cv2.INTER_LINEAR)
         return im, (h0, w0), im.shape[:2]  # im, hw_original, hw_resized
-    else:
-        return self.imgs[i], self.img_hw0[i], self.img_hw[i]  # im, hw_original, hw_resized
 
 
+# Ancillary functions --------------------------------------------------------------------------------------------------
 def load_mosaic(self, index):
     # YOLOv5 4-mosaic loader. Loads 1 image + 3 random images into a 4-image mosaic
     labels4, segments4 = [], []
@@ -689,7 +1298,7 @@ def load_mosaic(self, index):
     random.shuffle(indices)
     for i, index in enumerate(indices):
         # Load image
-        img, _, (h, w) = load_image(self, index)
+        img, _, (h, w) = self.load_image(index)
 
         # place img in img4
         if i == 0:  # top left
@@ -745,7 +1354,7 @@ def load_mosaic9(self, index):
     random.shuffle(indices)
     for i, index in enumerate(indices):
         # Load image
-        img, _, (h, w) = load_image(self, index)
+        img, _, (h, w) = self.load_image(index)
 
         # place img in img9
         if i == 0:  # center
@@ -885,22 +1494,25 @@ def autosplit(path='../datasets/coco128/images', weights=(0.9, 0.1, 0.0), annota
 
 
 def verify_image_label(args):
-    # Verify one image-label pair
-    im_file, lb_file, prefix = args
+    # Verify one image-label pair, or one video frame-label pair if the frame (width, height) is given
+    im_file, lb_file, prefix, *shape = args
     nm, nf, ne, nc, msg, segments = 0, 0, 0, 0, '', []  # number (missing, found, empty, corrupt), message, segments
     try:
         # verify images
-        im = Image.open(im_file)
-        im.verify()  # PIL verify
-        shape = exif_size(im)  # image size
+        if shape:  # frame of a video, the image is not read
+            shape = tuple(shape[0])
+        else:
+            im = Image.open(im_file)
+            im.verify()  # PIL verify
+            shape = exif_size(im)  # image size
+            assert im.format.lower() in IMG_FORMATS, f'invalid image format {im.format}'
+            if im.format.lower() in ('jpg', 'jpeg'):
+                with open(im_file, 'rb') as f:
+                    f.seek(-2, 2)
+                    if f.read() != b'\xff\xd9':  # corrupt JPEG
+                        ImageOps.exif_transpose(Image.open(im_file)).save(im_file, 'JPEG', subsampling=0, quality=100)
+                        msg = f'{prefix}WARNING: {im_file}: corrupt JPEG restored and saved'
         assert (shape[0] > 9) & (shape[1] > 9), f'image size {shape} <10 pixels'
-        assert im.format.lower() in IMG_FORMATS, f'invalid image format {im.format}'
-        if im.format.lower() in ('jpg', 'jpeg'):
-            with open(im_file, 'rb') as f:
-                f.seek(-2, 2)
-                if f.read() != b'\xff\xd9':  # corrupt JPEG
-                    ImageOps.exif_transpose(Image.open(im_file)).save(im_file, 'JPEG', subsampling=0, quality=100)
-                    msg = f'{prefix}WARNING: {im_file}: corrupt JPEG restored and saved'
 
         # verify labels
         if os.path.isfile(lb_file):
@@ -992,7 +1604,7 @@ def dataset_stats(path='coco128.yaml', autodownload=False, verbose=False, profil
             stats[split] = None  # i.e. no test set
             continue
         x = []
-        dataset = LoadImagesAndLabels(data[split])  # load dataset
+        dataset = LoadImagesAndLabels(data[split], label_dir=data.get('labels'))  # load dataset
         for label in tqdm(dataset.labels, total=dataset.n, desc='Statistics'):
             x.append(np.bincount(label[:, 0].astype(int), minlength=data['nc']))
         x = np.array(x)  # shape(128x80)
@@ -0,0 +1,170 @@
+"""
+Run an asyncio REST API serving a YOLOv5 model with dynamic micro-batching
+
+Concurrent requests are collected into batches of up to --max-batch images, waiting at most --max-delay ms after the
+first one, so throughput grows with the batch size instead of staying at one image per forward
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from aiohttp import web
+
+try:
+    import msgpack  # for Accept: application/x-msgpack responses
+except ImportError:
+    msgpack = None
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[2]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from models.common import DetectMultiBackend
+from utils.general import LOGGER, check_img_size
+from utils.serving import BatchServer, ReplicaPool, ServerBusy, benchmark_replicas
+from utils.torch_utils import select_device
+
+DETECTION_URL = "/v1/object-detection/yolov5s"
+RAW_URL = DETECTION_URL + "/raw"  # binary request and response
+
+
+async def detect(request, data, shape=None):
+    # optional per-request deadline in ms, i.e. ?timeout=200
+    timeout = float(request.query["timeout"]) / 1000 if "timeout" in request.query else None
+    try:
+        return await request.app["server"].detect(data, timeout, shape)
+    except ServerBusy:
+        raise web.HTTPServiceUnavailable(headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        raise web.HTTPGatewayTimeout()
+    except AssertionError as e:  # not an image
+        raise web.HTTPBadRequest(text=str(e))
+
+
+async def predict(request):
+    post = await request.post()
+    image = post.get("image")
+    if image is None:
+        raise web.HTTPBadRequest(text="image field missing")
+
+    det = await detect(request, image.file.read())
+    names = request.app["server"].model.names
+    keys = "xmin", "ymin", "xmax", "ymax", "confidence", "class"
+    return web.json_response([{**dict(zip(keys, (*x[:5], int(x[5])))), "name": names[int(x[5])]}
+                              for x in det.tolist()])  # same records as restapi.py
+
+
+async def predict_raw(request):
+    # Body is an encoded image (i.e. Content-Type: image/jpeg) or a raw BGR frame with an X-Shape: height,width header
+    # Returns rows of xyxy, conf, cls as little-endian float32 (n,6), or as msgpack with Accept: application/x-msgpack
+    shape = request.headers.get("X-Shape")
+    try:
+        shape = tuple(map(int, shape.split(","))) if shape else None
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"X-Shape {shape} is not height,width")
+
+    det = await detect(request, await request.read(), shape)
+    if "application/x-msgpack" in request.headers.get("Accept", ""):
+        if msgpack is None:
+            raise web.HTTPNotAcceptable(text="msgpack not installed, pip install msgpack")
+        body = msgpack.packb(det.tolist(), use_single_float=True)
+        return web.Response(body=body, content_type="application/x-msgpack", headers={"X-Detections": str(len(det))})
+    body = det.numpy().astype("<f4", copy=False).tobytes()
+    return web.Response(body=body, content_type="application/octet-stream", headers={"X-Detections": str(len(det))})
+
+
+def create_app(opt):
+    # Loads a local model (fused *.pt, *.torchscript, *.onnx, ...) without touching the network and warms it up
+    t0 = time.time()
+    assert Path(opt.weights).is_file(), f"{opt.weights} not found, only local models are served"
+    device = select_device(opt.device)
+    nms = dict(conf_thres=opt.conf_thres, iou_thres=opt.iou_thres, max_det=opt.max_det)
+    if opt.replicas > 1 and device.type == "cpu":  # processes on disjoint cores, loaded and warmed up in parallel
+        imgsz = check_img_size(opt.imgsz)
+        pool = ReplicaPool(opt.weights, opt.replicas, opt.threads, (imgsz, imgsz), opt.max_batch, nms)
+        LOGGER.info(f"{pool.replicas} replica processes x {pool.threads} threads")
+        server = BatchServer([pool] * pool.replicas, imgsz=imgsz, max_batch=opt.max_batch,
+                             max_delay=opt.max_delay / 1000, max_queue=opt.max_queue, timeout=opt.timeout / 1000,
+                             workers=opt.workers, **nms)
+        return serve(server, t0, time.time(), 0.0, opt.max_batch, pool.close)
+
+    models = [DetectMultiBackend(opt.weights, device=device) for _ in range(opt.replicas)]  # threads on GPU
+    model = models[0]
+    pt, jit, engine = model.pt, model.jit, model.engine
+    imgsz = check_img_size(opt.imgsz, s=model.stride)
+    half = opt.half and (pt or jit or engine) and device.type != "cpu"  # FP16 supported on limited backends with CUDA
+    if pt or jit:
+        for m in models:
+            m.model.half() if half else m.model.float()
+    elif opt.max_batch > 1:
+        opt.max_batch = model.batch_size if engine else 1  # export.py models default to batch-size 1
+        LOGGER.info(f"Forcing --max-batch {opt.max_batch} for non-PyTorch backends")
+    t1 = time.time()
+
+    server = BatchServer(models, imgsz=imgsz, max_batch=opt.max_batch, max_delay=opt.max_delay / 1000,
+                         max_queue=opt.max_queue, timeout=opt.timeout / 1000, half=half, workers=opt.workers, **nms)
+    t2 = time.time()
+    server.warmup()  # every batch size, so no request pays for lazy allocation
+    return serve(server, t0, t1, time.time() - t2, opt.max_batch)
+
+
+def serve(server, t0, t1, warmup, max_batch, close=None):
+    # Returns the aiohttp app of server, startup times t0 (start), t1 (model loaded) and warmup (s) are logged
+
+    async def start(app):
+        await server.start()
+
+        # one request through the whole pipeline, as a client would see it
+        im = cv2.imencode(".jpg", np.full((*server.imgsz, 3), 114, np.uint8))[1].tobytes()
+        t = time.time()
+        await server.detect(im, timeout=60)
+        LOGGER.info(f"Started in {time.time() - t0:.1f}s (load {t1 - t0:.1f}s, warmup {warmup:.1f}s "
+                    f"for batch sizes 1-{max_batch}), first request {(time.time() - t) * 1000:.1f}ms")
+
+    async def stop(app):
+        await server.stop()
+        if close:
+            close()
+
+    app = web.Application(client_max_size=32 * 1024 ** 2)  # 32 MB uploads
+    app["server"] = server
+    app.router.add_post(DETECTION_URL, predict)
+    app.router.add_post(RAW_URL, predict_raw)
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="asyncio API exposing a YOLOv5 model")
+    parser.add_argument("--port", default=5000, type=int, help="port number")
+    parser.add_argument("--weights", default=ROOT / "yolov5s.pt", help="model path")
+    parser.add_argument("--imgsz", "--img", "--img-size", default=640, type=int, help="inference size (pixels)")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
+    parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
+    parser.add_argument("--conf-thres", default=0.25, type=float, help="confidence threshold")
+    parser.add_argument("--iou-thres", default=0.45, type=float, help="NMS IoU threshold")
+    parser.add_argument("--max-det", default=1000, type=int, help="maximum detections per image")
+    parser.add_argument("--max-batch", default=16, type=int, help="maximum images per forward")
+    parser.add_argument("--max-delay", default=5, type=float, help="maximum ms a request waits for a batch to fill")
+    parser.add_argument("--max-queue", default=256, type=int, help="queued requests before answering 503")
+    parser.add_argument("--timeout", default=1000, type=float, help="default request deadline (ms)")
+    parser.add_argument("--workers", default=4, type=int, help="decoding and NMS threads")
+    parser.add_argument("--replicas", default=1, type=int, help="model replicas, processes on disjoint cores on CPU")
+    parser.add_argument("--threads", default=None, type=int, help="intra-op threads per CPU replica, default cores/N")
+    parser.add_argument("--benchmark", action="store_true", help="time every CPU replicas x threads split and exit")
+    opt = parser.parse_args()
+
+    if opt.benchmark:
+        nms = dict(conf_thres=opt.conf_thres, iou_thres=opt.iou_thres, max_det=opt.max_det)
+        k, threads, speed, _ = benchmark_replicas(opt.weights, check_img_size(opt.imgsz), opt.max_batch, nms=nms)[0]
+        LOGGER.info(f"Best: --replicas {k} --threads {threads} ({speed:.1f} img/s at --max-batch {opt.max_batch})")
+        sys.exit()
+
+    web.run_app(create_app(opt), port=opt.port)
@@ -3,11 +3,23 @@ Run a rest API exposing the yolov5s object detection model
 """
 import argparse
 import io
+import sys
+import time
+from pathlib import Path
 
-import torch
+import numpy as np
 from flask import Flask, request
 from PIL import Image
 
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[2]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from models.common import AutoShape, DetectMultiBackend
+from utils.general import LOGGER
+from utils.torch_utils import select_device
+
 app = Flask(__name__)
 
 DETECTION_URL = "/v1/object-detection/yolov5s"
@@ -31,7 +43,19 @@ def predict():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Flask API exposing YOLOv5 model")
     parser.add_argument("--port", default=5000, type=int, help="port number")
+    parser.add_argument("--weights", default=ROOT / "yolov5s.pt", help="local model path (*.pt, *.torchscript, ...)")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
     args = parser.parse_args()
 
-    model = torch.hub.load("ultralytics/yolov5", "yolov5s", force_reload=True)  # force_reload to recache
+    # a local model instead of torch.hub.load(), which re-downloads the hub repo and rebuilds the model
+    t0 = time.time()
+    assert Path(args.weights).is_file(), f"{args.weights} not found, only local models are served"
+    model = AutoShape(DetectMultiBackend(args.weights, device=select_device(args.device)))
+    t1 = time.time()
+    im = np.full((640, 640, 3), 114, np.uint8)
+    model(im, size=640)  # warmup, also on CPU
+    t2 = time.time()
+    model(im, size=640)
+    LOGGER.info(f"Started in {time.time() - t0:.1f}s (load {t1 - t0:.1f}s, warmup {t2 - t1:.1f}s), "
+                f"first request {(time.time() - t2) * 1000:.1f}ms")
     app.run(host="0.0.0.0", port=args.port)  # debug=True causes Restarting with stat
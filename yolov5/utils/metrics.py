@@ -32,42 +32,58 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir='.', names
         The average precision as computed in py-faster-rcnn.
     """
 
-    # Sort by objectness
-    i = np.argsort(-conf)
-    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
-
     # Find unique classes
     unique_classes, nt = np.unique(target_cls, return_counts=True)
-    nc = unique_classes.shape[0]  # number of classes, number of detections
-
-    # Create Precision-Recall curve and compute AP for each class
-    px, py = np.linspace(0, 1, 1000), []  # for plotting
-    ap, p, r = np.zeros((nc, tp.shape[1])), np.zeros((nc, 1000)), np.zeros((nc, 1000))
-    for ci, c in enumerate(unique_classes):
-        i = pred_cls == c
-        n_l = nt[ci]  # number of labels
-        n_p = i.sum()  # number of predictions
-
-        if n_p == 0 or n_l == 0:
-            continue
-        else:
-            # Accumulate FPs and TPs
-            fpc = (1 - tp[i]).cumsum(0)
-            tpc = tp[i].cumsum(0)
-
-            # Recall
-            recall = tpc / (n_l + eps)  # recall curve
-            r[ci] = np.interp(-px, -conf[i], recall[:, 0], left=0)  # negative x, xp because xp decreases
-
-            # Precision
-            precision = tpc / (tpc + fpc)  # precision curve
-            p[ci] = np.interp(-px, -conf[i], precision[:, 0], left=1)  # p at pr_score
+    return ap_per_class_counts(tp, np.ones(len(tp)), conf, pred_cls, unique_classes, nt, plot, save_dir, names, eps)
+
+
+def ap_per_class_counts(tp, n, conf, pred_cls, unique_classes, nt, plot=False, save_dir='.', names=(), eps=1e-16):
+    # Returns ap_per_class() of rows each standing for n(rows) predictions of which tp(rows,10) are true positives, for
+    # unique_classes with nt labels each. All classes and IoU levels at once, the rows are sorted once
+    nc, niou = unique_classes.shape[0], tp.shape[1]  # number of classes, IoU levels
+
+    # Sort by class, then by objectness, rows of classes without labels dropped
+    i = np.lexsort((-conf, pred_cls))
+    i = i[np.isin(pred_cls[i], unique_classes)]
+    k = np.searchsorted(unique_classes, pred_cls[i])  # class index
+    tp, n, conf = np.ascontiguousarray(tp[i].T), n[i].astype(float), conf[i]  # tp(niou,rows)
+    start, end = np.searchsorted(k, np.arange(nc)), np.searchsorted(k, np.arange(nc), 'right')  # rows of each class
+    c = np.arange(nc)[start < end]  # classes with rows
+
+    # Accumulate FPs and TPs within each class
+    tpc, npc = tp.cumsum(1, dtype=float), n.cumsum()
+    tpc0, npc0 = np.zeros((niou, nc)), np.zeros(nc)  # before the first row of each class
+    tpc0[:, c], npc0[c] = tpc[:, start[c]] - tp[:, start[c]], npc[start[c]] - n[start[c]]
+    tpc -= tpc0[:, k]
+    npc -= npc0[k]
+    n_p = np.zeros(nc, dtype=bool)
+    n_p[c] = npc[end[c] - 1] > 0  # classes with predictions
+    recall = tpc / (nt[k] + eps)  # recall curve
+    precision = tpc / npc  # precision curve
+
+    # Recall and precision at pr_score, negative x, xp because xp decreases
+    px = np.linspace(0, 1, 1000)  # for plotting
+    r = interp_segments(-px, -conf, recall[0], k, nc, left=0) * n_p[:, None]
+    p = interp_segments(-px, -conf, precision[0], k, nc, left=1) * n_p[:, None]
+
+    # AP from recall-precision curves as compute_ap(), each class between a start and end sentinel
+    j = np.stack((start, end), 1).ravel()  # before the first and after the last row of each class
+    mrec = np.insert(recall, j, np.tile([0.0, 1.0], nc), axis=1)
+    mpre = np.insert(precision, j, np.tile([1.0, 0.0], nc), axis=1)
+    k2 = np.repeat(np.arange(nc), end - start + 2)  # class of each column
+
+    # Compute the precision envelope of every class at once, offsets keep classes apart
+    off = 2.0 * (nc - k2)
+    mpre += off
+    np.maximum.accumulate(mpre[:, ::-1], 1, out=mpre[:, ::-1])
+    mpre -= off
 
-            # AP from recall-precision curve
-            for j in range(tp.shape[1]):
-                ap[ci, j], mpre, mrec = compute_ap(recall[:, j], precision[:, j])
-                if plot and j == 0:
-                    py.append(np.interp(px, mrec, mpre))  # precision at mAP@0.5
+    # Integrate area under curve
+    x = np.linspace(0, 1, 101)  # 101-point interp (COCO)
+    seg = (np.arange(niou)[:, None] * nc + k2).ravel()  # (IoU level, class) segments
+    ap = np.trapz(interp_segments(x, mrec.ravel(), mpre.ravel(), seg, niou * nc), x)  # integrate
+    ap = ap.reshape(niou, nc).T * n_p[:, None]
+    py = list(interp_segments(px, mrec[0], mpre[0], k2, nc)[n_p])  # precision at mAP@0.5
 
     # Compute F1 (harmonic mean of precision and recall)
     f1 = 2 * p * r / (p + r + eps)
@@ -86,6 +102,72 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir='.', names
     return tp, fp, p, r, f1, ap, unique_classes.astype('int32')
 
 
+class APAccumulator:
+    # Streaming ap_per_class() in constant memory: per-class histograms of prediction confidences, and of those of true
+    # positives at every IoU level, instead of every prediction. Counts stay on the device of update()
+    # Precision and recall are exact at the bin edges, result() computes AP through them and sets error(nc,niou), the
+    # most the exact area under each precision envelope can exceed it by (compute_ap() samples that area at 101 points):
+    #     sum over bins of recall gained in bin * max over this and later bins of (max precision within bin - precision
+    #     at its lower edge), zero when no bin mixes true positives with other predictions
+    # Used by val.py --ap-bins only, exact ap_per_class() is the default. Counts are not merged across DDP ranks as
+    # val.py only ever validates in one process (rank 0 when called by train.py)
+    # Usage:
+    #     stats = APAccumulator(nc, niou=10, bins=10000, device=device)
+    #     stats.update(correct, conf, pred_cls, target_cls)  # per batch
+    #     tp, fp, p, r, f1, ap, ap_class = stats.result()
+    def __init__(self, nc, niou=10, bins=10000, device=None):
+        self.nc, self.bins = nc, bins
+        self.n = torch.zeros(nc, bins, dtype=torch.long, device=device)  # predictions per class and confidence bin
+        self.tp = torch.zeros(nc, bins, niou, dtype=torch.long, device=device)  # true positives among them
+        self.nt = torch.zeros(nc, dtype=torch.long, device=device)  # labels per class
+        self.error = np.zeros((0, niou))
+
+    def update(self, correct, conf, pred_cls, target_cls):
+        # Adds predictions correct(n,niou), conf(n), pred_cls(n) and labels target_cls(m), tensors on any device
+        i = pred_cls.to(self.n.device).long() * self.bins + \
+            (conf.to(self.n.device).float() * self.bins).long().clamp(0, self.bins - 1)  # class, bin
+        t = target_cls.to(self.n.device).long()
+        self.n.view(-1).index_add_(0, i, torch.ones_like(i))
+        self.tp.view(-1, self.tp.shape[2]).index_add_(0, i, correct.to(self.n.device).long())
+        self.nt.index_add_(0, t, torch.ones_like(t))
+
+    def result(self, plot=False, save_dir='.', names=(), eps=1e-16):
+        # Returns ap_per_class() of the predictions seen, with each bin as one row at its lower edge confidence
+        n, tp, nt = (x.cpu().numpy() for x in (self.n.flip(1), self.tp.flip(1), self.nt))  # decreasing conf
+        c, b = n.nonzero()  # rows, by class and decreasing conf
+        conf = (self.bins - 1 - b) / self.bins
+        classes = nt.nonzero()[0]  # classes with labels, as np.unique(target_cls)
+        results = ap_per_class_counts(tp[c, b], n[c, b], conf, c, classes, nt[classes], plot, save_dir, names, eps)
+
+        # AP error bound
+        self.error = np.zeros((len(classes), tp.shape[2]))
+        for ci, ct in enumerate(classes):
+            nb, tpc = n[ct, b[c == ct], None], tp[ct, b[c == ct]]  # bins with predictions
+            na, ta = nb.cumsum(0) - nb, tpc.cumsum(0) - tpc  # predictions and true positives before each bin
+            d = (ta + tpc) / (na + tpc + eps) - (ta + tpc) / (na + nb)  # true positives of the bin first, or last
+            d = np.maximum.accumulate(np.where(tpc > 0, d, 0)[::-1], 0)[::-1]  # max of this and later bins
+            self.error[ci] = (tpc / nt[ct] * d).sum(0)
+        return results
+
+
+def interp_segments(x, xp, fp, seg, n, left=None):
+    # Returns np.interp(x, xp[seg == i], fp[seg == i], left) of every segment i < n as (n, len(x)), rows sorted by seg
+    # then xp. One searchsorted() over all segments, kept apart by offsets, instead of n np.interp() calls
+    if not len(xp):
+        return np.full((n, len(x)), left, dtype=float)
+    xq, qseg = np.tile(x, n), np.repeat(np.arange(n), len(x))  # queries and their segment
+    off = 2 * max(np.abs(xp).max(), np.abs(x).max()) + 1  # segment offset
+    j = np.searchsorted(xp + off * seg, xq + off * qseg, 'right') - 1  # last row with xp <= x
+    start, end = np.searchsorted(seg, np.arange(n)), np.searchsorted(seg, np.arange(n), 'right')
+    s, e = start[qseg], end[qseg]
+    j0, j1 = (np.minimum(np.maximum(i, s), e - 1).clip(0) for i in (j, j + 1))  # rows of the segment around x
+    with np.errstate(divide='ignore', invalid='ignore'):  # at a row, or right of all, replaced below
+        y = (fp[j1] - fp[j0]) / (xp[j1] - xp[j0]) * (xq - xp[j0]) + fp[j0]
+    y = np.where((j0 == j1) | (xq == xp[j0]), fp[j0], y)
+    y[j < s] = fp[j0[j < s]] if left is None else left  # left of all
+    return y.reshape(n, len(x))
+
+
 def compute_ap(recall, precision):
     """ Compute the average precision, given the recall and precision curves
     # Arguments
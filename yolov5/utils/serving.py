@@ -0,0 +1,294 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Serving utils
+"""
+
+import asyncio
+import itertools
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+
+from utils.augmentations import letterbox
+from utils.general import LOGGER, non_max_suppression, scale_coords
+
+
+def core_sets(n):
+    # Splits the CPU cores this process may run on into n disjoint contiguous sets, i.e. 8 cores, n=2: [0-3], [4-7]
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    if n > len(cores):  # more sets than cores, one core each, shared
+        return [[cores[i % len(cores)]] for i in range(n)]
+    return [cores[i * len(cores) // n:(i + 1) * len(cores) // n] for i in range(n)]
+
+
+def pin_thread(cores):
+    # Pins the calling thread, and the threads it starts later (i.e. its OpenMP team), to cores. Linux only
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+
+def replica_worker(weights, cores, threads, shapes, nms, requests, results):
+    # Serves one replica process: loads weights on CPU, warms it up at shapes, then answers (id, im) requests with
+    # NMS detections until a None request
+    from models.common import DetectMultiBackend  # scoped to avoid circular import
+
+    pin_thread(cores)  # this process, before torch starts its threads
+    torch.set_num_threads(threads)
+    try:
+        model = DetectMultiBackend(weights, device=torch.device('cpu'))
+        with torch.no_grad():
+            for x in shapes:
+                model.warmup(x, cpu=True)
+    except Exception as e:  # fail ReplicaPool() instead of leaving it waiting
+        results.put((None, e))
+        return
+    results.put((None, (int(model.stride), model.names)))  # ready
+    with torch.no_grad():
+        for i, im in iter(requests.get, None):
+            try:
+                pred = non_max_suppression(model(torch.from_numpy(im).float() / 255), **nms)
+                results.put((i, [x.numpy() for x in pred]))
+            except Exception as e:
+                results.put((i, e))
+
+
+class ReplicaPool:
+    # K model replicas in separate CPU processes, each pinned to its own core set with its own intra-op thread count
+    # (PyTorch and ONNX Runtime), all fed from one shared request queue
+    # Usage:
+    #     pool = ReplicaPool('yolov5s.pt', replicas=4, imgsz=(640, 640), max_batch=8)
+    #     pred = pool.submit(im).result()  # im uint8 (b,3,640,640) RGB, returns NMS detections per image
+    def __init__(self, weights, replicas=2, threads=None, imgsz=(640, 640), max_batch=1, nms=None):
+        cores = core_sets(replicas)
+        self.replicas, self.threads = replicas, threads or len(cores[0])  # intra-op threads per replica
+        self.device = torch.device('cpu')
+        ctx = mp.get_context('spawn')  # fresh torch thread pools
+        self.requests, self.results = ctx.Queue(), ctx.Queue()
+        shapes = [(b, 3, *imgsz) for b in range(1, max_batch + 1)]  # warmup shapes
+        self.procs = [ctx.Process(target=replica_worker, daemon=True,
+                                  args=(weights, c, self.threads, shapes, nms or {}, self.requests, self.results))
+                      for c in cores]
+        for p in self.procs:
+            p.start()
+        for _ in self.procs:  # wait until all replicas are loaded and warm
+            _, ready = self.results.get()
+            if isinstance(ready, Exception):
+                self.close(dispatcher=False)
+                raise ready
+        self.stride, self.names = ready
+        self.futures, self.ids = {}, itertools.count()
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, im):
+        # Queues im(b,3,h,w) uint8 for the first free replica, returns a Future of its NMS detections
+        f, i = Future(), next(self.ids)
+        self.futures[i] = f
+        self.requests.put((i, im))
+        return f
+
+    def dispatch(self):
+        # Resolves the futures of submit() with the results of the replicas
+        for i, y in iter(self.results.get, (None, None)):
+            f = self.futures.pop(i)
+            f.set_exception(y) if isinstance(y, Exception) else f.set_result([torch.from_numpy(x) for x in y])
+
+    def close(self, dispatcher=True):
+        for _ in self.procs:
+            self.requests.put(None)
+        for p in self.procs:
+            p.join()
+        if dispatcher:
+            self.results.put((None, None))
+            self.dispatcher.join()
+
+
+def benchmark_replicas(weights, imgsz=640, batch_size=1, batches=32, nms=None):
+    # Returns images/s of every K replicas x T threads split of the CPU cores, best first, i.e. to set --replicas
+    n, results = len(core_sets(1)[0]), []
+    imgsz = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+    im = np.random.randint(0, 255, (batch_size, 3, *imgsz), dtype=np.uint8)
+    for k in (k for k in range(1, n + 1) if n % k == 0):  # replicas
+        pool = ReplicaPool(weights, replicas=k, imgsz=imgsz, max_batch=batch_size, nms=nms)
+        t = time.time()
+        for f in [pool.submit(im) for _ in range(batches)]:  # all queued, every replica kept busy
+            f.result()
+        dt = time.time() - t
+        pool.close()
+        results.append((k, n // k, batches * batch_size / dt, dt / batches * k))  # replicas, threads, img/s, latency
+        LOGGER.info(f'{k:>3} replicas x {n // k:>3} threads: {results[-1][2]:8.1f} img/s, '
+                    f'{results[-1][3] * 1000:8.1f} ms/batch')
+    return sorted(results, key=lambda x: -x[2])
+
+
+class ServerBusy(Exception):
+    # Raised when the request queue is full, the client should retry later
+    pass
+
+
+class BatchServer:
+    # Asyncio inference server collecting concurrent requests into dynamic micro-batches for a DetectMultiBackend model
+    # Stages run as a pipeline, each feeding the next through a bounded queue:
+    #     pre-process (thread pool) -> batch (event loop) -> inference (own thread) -> NMS (thread pool)
+    # model may be a list of replicas, each running its own forwards, i.e. pinned to core_sets(len(models)), or a
+    # ReplicaPool, with [pool] * pool.replicas to keep all its processes busy
+    # Usage:
+    #     server = BatchServer(model, imgsz=640, max_batch=16, max_delay=0.005)
+    #     server.warmup()  # every batch size, also on CPU
+    #     await server.start()
+    #     det = await server.detect(jpg_bytes)  # (n,6) xyxy, conf, cls in image pixels
+    def __init__(self, model, imgsz=640, max_batch=16, max_delay=0.005, max_queue=256, timeout=1.0, half=False,
+                 conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, max_det=1000, workers=4, cores=None):
+        self.models = list(model) if isinstance(model, (list, tuple)) else [model]  # replicas
+        self.model = model = self.models[0]  # names, stride
+        self.device = torch.device(model.device or 'cpu')
+        self.imgsz = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)  # square batches stack
+        self.max_batch = max_batch  # max images per forward
+        self.max_delay = max_delay  # max seconds the first request of a batch waits for more
+        self.max_queue = max_queue  # max pre-processed requests waiting for a batch, more are rejected (ServerBusy)
+        self.timeout = timeout  # default request deadline (seconds)
+        self.half = half
+        self.nms = dict(conf_thres=conf_thres, iou_thres=iou_thres, classes=classes, agnostic=agnostic, max_det=max_det)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='serve')  # decoding, letterbox and NMS
+        cores = cores or [None] * len(self.models)  # core set of each replica
+        self.infer_pools = [ThreadPoolExecutor(1, f'infer{i}', initializer=pin_thread, initargs=(c,))
+                            for i, c in enumerate(cores)]  # one forward at a time per replica
+        self.tasks = []
+        self.batches = self.images = 0  # counts
+        pin = self.device.type != 'cpu'  # page-locked for faster host to device copies
+        self.buffers = [torch.empty((max_batch, 3, *self.imgsz), dtype=torch.uint8, pin_memory=pin).numpy()
+                        for _ in self.models]  # inputs of each replica
+
+    async def start(self):
+        # Creates the queues and starts the batching, inference and NMS stages on the running event loop
+        self.requests = asyncio.Queue(self.max_queue)  # pre-processed requests waiting for a batch
+        self.inputs = asyncio.Queue(2)  # batches waiting for inference, backpressure on the batcher
+        self.outputs = asyncio.Queue(2)  # predictions waiting for NMS, backpressure on inference
+        self.tasks = [asyncio.create_task(x()) for x in (self.batcher, self.postprocessor)]
+        self.tasks += [asyncio.create_task(self.inferer(i)) for i in range(len(self.models))]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.pool.shutdown()
+        for pool in self.infer_pools:
+            pool.shutdown()
+
+    def warmup(self):
+        # Runs every replica once at every batch size, on its own pinned thread, returns the seconds taken
+        t = time.time()
+        if isinstance(self.model, ReplicaPool):  # warmed up by its processes
+            return 0.0
+        shapes = [(b, 3, *self.imgsz) for b in range(1, self.max_batch + 1)]
+
+        @torch.no_grad()
+        def run(model):
+            for x in shapes:
+                model.warmup(x, half=self.half, cpu=True)
+
+        futures = [pool.submit(run, m) for m, pool in zip(self.models, self.infer_pools)]
+        for f in futures:
+            f.result()
+        return time.time() - t
+
+    async def detect(self, data, timeout=None, shape=None):
+        # Returns detections(n,6) xyxy, conf, cls in pixels of encoded image bytes data, or of a raw BGR frame of
+        # shape (h,w) if given. Raises asyncio.TimeoutError when not done within timeout seconds and ServerBusy when
+        # the request queue is full
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        im, shape = await loop.run_in_executor(self.pool, self.preprocess, data, shape)
+        future = loop.create_future()
+        try:
+            self.requests.put_nowait((im, shape, future, deadline))
+        except asyncio.QueueFull:
+            raise ServerBusy(f'{self.max_queue} requests queued')
+        return await asyncio.wait_for(future, deadline - loop.time())
+
+    def preprocess(self, data, shape=None):
+        # Decodes image bytes, returns the letterboxed CHW RGB image and the original shape
+        if shape:  # raw BGR frame, no copy
+            assert len(data) == shape[0] * shape[1] * 3, f'{len(data)} bytes is not a {shape[0]}x{shape[1]} BGR frame'
+            im0 = np.frombuffer(data, np.uint8).reshape(shape[0], shape[1], 3)
+        else:  # encoded image
+            im0 = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)  # BGR
+            assert im0 is not None, 'Image Not Decoded'
+        im = letterbox(im0, self.imgsz, stride=self.model.stride, auto=False)[0]
+        return im.transpose((2, 0, 1))[::-1], im0.shape  # HWC to CHW, BGR to RGB
+
+    async def batcher(self):
+        # Collects requests until max_batch or max_delay after the first, drops those past their deadline
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.requests.get()]
+            end = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                if self.requests.empty():
+                    try:
+                        batch.append(await asyncio.wait_for(self.requests.get(), end - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self.requests.get_nowait())
+            now = loop.time()
+            for *_, future, deadline in batch:
+                if deadline < now and not future.done():
+                    future.set_exception(asyncio.TimeoutError())  # not worth a forward
+            batch = [x for x in batch if not x[2].done()]  # waiting clients only
+            if batch:
+                await self.inputs.put(batch)  # waits while inference is behind
+
+    async def inferer(self, i):
+        loop, model = asyncio.get_running_loop(), self.models[i]
+        while True:
+            batch = await self.inputs.get()
+            im = self.buffers[i][:len(batch)]  # free, the previous forward of this replica is done
+            for j, x in enumerate(batch):
+                im[j] = x[0]
+            try:
+                if isinstance(model, ReplicaPool):  # forward and NMS in a replica process
+                    pred = await asyncio.wrap_future(model.submit(im.copy()))
+                else:
+                    pred = await loop.run_in_executor(self.infer_pools[i], self.forward, model, im)
+            except Exception as e:  # fail this batch, keep serving
+                LOGGER.warning(f'WARNING: inference failed: {e}')
+                for *_, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches, self.images = self.batches + 1, self.images + len(batch)
+            await self.outputs.put((batch, im.shape[2:], pred))  # waits while NMS is behind
+
+    @torch.no_grad()
+    def forward(self, model, im):
+        im = torch.from_numpy(im).to(self.device)
+        im = im.half() if self.half else im.float()  # uint8 to fp16/32
+        return model(im / 255)
+
+    async def postprocessor(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch, shape, pred = await self.outputs.get()
+            try:
+                dets = await loop.run_in_executor(self.pool, self.postprocess, pred, shape, [x[1] for x in batch])
+            except Exception as e:  # fail this batch, keep serving
+                LOGGER.warning(f'WARNING: NMS failed: {e}')
+                dets = [e] * len(batch)
+            for (*_, future, _), det in zip(batch, dets):
+                if not future.done():  # client may have timed out
+                    future.set_exception(det) if isinstance(det, Exception) else future.set_result(det)
+
+    def postprocess(self, pred, shape, shapes):
+        # Returns NMS detections(n,6) of each image of a batch, boxes scaled from shape to the original image shapes
+        if not isinstance(pred, list):  # ReplicaPool ran NMS already
+            pred = non_max_suppression(pred, **self.nms)
+        for det, shape0 in zip(pred, shapes):
+            det[:, :4] = scale_coords(shape, det[:, :4], shape0).round()
+        return [det.cpu() for det in pred]
@@ -249,6 +249,27 @@ def scale_img(img, ratio=1.0, same_shape=False, gs=32):  # img(16,3,256,416)
         return F.pad(img, [0, w - s[1], 0, h - s[0]], value=0.447)  # value = imagenet mean
 
 
+def tile_img(img, tile=640, overlap=0.2):  # img(1,3,1248,1632)
+    # cuts img(bs,3,y,x) into overlapping tile x tile crops, returns crops(bs*n,3,tile,tile) and their xy offsets(n,2)
+    h, w = img.shape[2:]
+    img = F.pad(img, [0, max(tile - w, 0), 0, max(tile - h, 0)], value=114 / 255)  # pad images smaller than a tile
+
+    def starts(n):  # evenly spaced tile origins along an axis, neighbours overlap by at least overlap * tile
+        k = math.ceil(max(n - tile, 0) / (tile * (1 - overlap))) + 1  # number of tiles
+        return [round(i * max(n - tile, 0) / max(k - 1, 1)) for i in range(k)]
+
+    offsets = [(x, y) for y in starts(h) for x in starts(w)]
+    crops = torch.stack([img[..., y:y + tile, x:x + tile] for x, y in offsets], 1).flatten(0, 1)  # image-major
+    return crops, torch.tensor(offsets, device=img.device)
+
+
+def untile_pred(pred, offsets):
+    # shifts tile_img() crop predictions(bs*n,anchors,xywh...) back by offsets(n,2), returns (bs,n*anchors,xywh...)
+    pred = pred.view(-1, len(offsets), *pred.shape[1:]).clone()
+    pred[..., :2] += offsets[:, None].to(pred)  # crop to image xy
+    return pred.flatten(1, 2)  # one row per image, NMS then merges duplicates across overlapping tiles
+
+
 def copy_attr(a, b, include=(), exclude=()):
     # Copy attributes from b to a, options to only include [...] and to exclude [...]
     for k, v in b.__dict__.items():
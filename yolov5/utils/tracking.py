@@ -0,0 +1,87 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Temporal detection reuse utils
+"""
+
+import cv2
+import numpy as np
+import torch
+
+from utils.general import clip_coords
+
+
+class KeyframeTracker:
+    # Runs full inference on video keyframes only, boxes of the frames in between are propagated with optical flow
+    # Usage:
+    #     keys = tracker.select(im0s, sources)  # keyframe mask of consecutive frames, sources = video of each or None
+    #     pred = tracker.update(pred)  # pred = im0-space detections of keyframes, returns detections of all frames
+    def __init__(self, interval=5, motion_thres=0.05, size=640):
+        self.interval = interval  # max frames from one keyframe to the next
+        self.motion_thres = motion_thres  # new keyframe when the mean grey difference (0-1) to the last one exceeds it
+        self.size = size  # long side of the grey thumbnails used for motion and optical flow
+        self.source = self.key = self.prev = self.det = None  # video, keyframe and previous thumbnails, last boxes
+        self.age = 0  # frames since the last keyframe
+        self.frames = []  # (thumbnail, gain, im0 shape, is keyframe) of the frames of the last select()
+        self.keyframes = self.total = 0  # keyframes and frames seen
+
+    def thumbnail(self, im):
+        # Returns the grey thumbnail of im(h,w,3) BGR and its gain
+        g = self.size / max(im.shape[:2])  # gain
+        im = cv2.resize(im, (round(im.shape[1] * g), round(im.shape[0] * g)), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(im, cv2.COLOR_BGR2GRAY), g
+
+    def select(self, ims, sources):
+        # Returns a keyframe mask for the consecutive frames ims (list of im0), sources holds the video of each frame or
+        # None for a still image. Boxes only carry over between frames of the same video, every image is a keyframe
+        self.frames = []
+        for im, source in zip(ims, sources):
+            if source is None or source != self.source:  # image or new video, nothing to propagate from
+                self.key = self.det = None
+            self.source = source
+            grey, g = self.thumbnail(im)
+            key = self.key is None or self.age >= self.interval or grey.shape != self.key.shape or \
+                cv2.absdiff(grey, self.key).mean() / 255 > self.motion_thres  # scene change
+            if key:
+                self.key, self.age = grey, 0
+                self.keyframes += 1
+            self.age += 1
+            self.frames.append((grey, g, im.shape[:2], key))
+        self.total += len(ims)
+        return torch.tensor([key for *_, key in self.frames])
+
+    def update(self, pred):
+        # Returns detections for every frame of the last select(), pred holds those of its keyframes in im0 space
+        pred, out = iter(pred), []
+        for grey, g, shape, key in self.frames:
+            self.det = next(pred).clone() if key else self.propagate(self.prev, grey, g, shape)
+            self.prev = grey
+            out.append(self.det.clone())
+        return out
+
+    def propagate(self, prev, grey, g, shape):
+        # Moves the last boxes from thumbnail prev to grey with sparse Lucas-Kanade flow
+        det = self.det
+        if not len(det):
+            return det.clone()
+        b = det[:, :4].cpu().numpy() * g  # thumbnail xyxy
+        n, s = len(b), np.linspace(0.25, 0.75, 3)  # 3x3 points in the inner half of each box
+        x = b[:, [0]] + (b[:, [2]] - b[:, [0]]) * s
+        y = b[:, [1]] + (b[:, [3]] - b[:, [1]]) * s
+        p0 = np.stack(np.broadcast_arrays(x[:, None], y[:, :, None]), -1).reshape(-1, 1, 2).astype(np.float32)
+        p1, st, _ = cv2.calcOpticalFlowPyrLK(prev, grey, p0, None, winSize=(15, 15), maxLevel=3)
+        p0, p1, st = p0.reshape(n, 9, 2), p1.reshape(n, 9, 2), st.reshape(n, 9) == 1
+        i = st.any(1)  # boxes with at least one tracked point, the others stay in place
+        p0, p1 = p0[i], p1[i]
+        p0[~st[i]], p1[~st[i]] = np.nan, np.nan
+        c0, c1 = np.nanmedian(p0, 1), np.nanmedian(p1, 1)
+        with np.errstate(invalid='ignore', divide='ignore'):  # single tracked point, no spread
+            k = np.nanmedian(np.linalg.norm(p1 - c1[:, None], axis=2), 1) / \
+                np.nanmedian(np.linalg.norm(p0 - c0[:, None], axis=2), 1)
+        d, r = np.zeros((n, 2)), np.ones((n, 1))
+        d[i], r[i, 0] = c1 - c0, np.nan_to_num(k, nan=1.0).clip(0.8, 1.25)  # box motion and scale, bounded per frame
+        xy, wh = (b[:, :2] + b[:, 2:]) / 2 + d, (b[:, 2:] - b[:, :2]) * r
+        b = np.concatenate((xy - wh / 2, xy + wh / 2), 1) / g  # im0 xyxy
+        clip_coords(b, shape)
+        det = det.clone()
+        det[:, :4] = torch.from_numpy(b).to(det)
+        return det[(det[:, 2] > det[:, 0]) & (det[:, 3] > det[:, 1])]  # drop boxes that left the frame
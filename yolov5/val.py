@@ -26,7 +26,9 @@ from pathlib import Path
 from threading import Thread
 
 import numpy as np
+import pandas as pd
 import torch
+from torch.nn.utils.rnn import pad_sequence
 from tqdm import tqdm
 
 FILE = Path(__file__).resolve()
@@ -37,13 +39,13 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import DetectMultiBackend
 from utils.callbacks import Callbacks
-from utils.datasets import create_dataloader
-from utils.general import (LOGGER, box_iou, check_dataset, check_img_size, check_requirements, check_yaml,
+from utils.datasets import create_dataloader, create_dataloaders
+from utils.general import (LOGGER, check_dataset, check_img_size, check_requirements, check_yaml,
                            coco80_to_coco91_class, colorstr, increment_path, non_max_suppression, print_args,
                            scale_coords, xywh2xyxy, xyxy2xywh)
-from utils.metrics import ConfusionMatrix, ap_per_class
+from utils.metrics import APAccumulator, ConfusionMatrix, ap_per_class
 from utils.plots import output_to_target, plot_images, plot_val_study
-from utils.torch_utils import select_device, time_sync
+from utils.torch_utils import select_device, tile_img, time_sync, untile_pred
 
 
 def save_one_txt(predn, save_conf, shape, file):
@@ -70,31 +72,40 @@ def save_one_json(predn, jdict, path, class_map):
 
 def process_batch(detections, labels, iouv):
     """
-    Return correct predictions matrix. Both sets of boxes are in (x1, y1, x2, y2) format.
+    Return correct predictions matrix of a batch of images, matched on device in one pass without host round-trips.
+    Each detection takes its highest IoU label (ties to the last label), then each label keeps its first detection.
+    Both sets of boxes are in (x1, y1, x2, y2) format.
     Arguments:
-        detections (Array[N, 6]), x1, y1, x2, y2, conf, class
-        labels (Array[M, 5]), class, x1, y1, x2, y2
+        detections (list of Array[N, 6]), x1, y1, x2, y2, conf, class of each image
+        labels (list of Array[M, 5]), class, x1, y1, x2, y2 of each image
     Returns:
-        correct (Array[N, 10]), for 10 IoU levels
+        correct (Array[B, max(N), 10]), for 10 IoU levels, False for padding
     """
-    correct = torch.zeros(detections.shape[0], iouv.shape[0], dtype=torch.bool, device=iouv.device)
-    iou = box_iou(labels[:, 1:], detections[:, :4])
-    x = torch.where((iou >= iouv[0]) & (labels[:, 0:1] == detections[:, 5]))  # IoU above threshold and classes match
-    if x[0].shape[0]:
-        matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()  # [label, detection, iou]
-        if x[0].shape[0] > 1:
-            matches = matches[matches[:, 2].argsort()[::-1]]
-            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-            # matches = matches[matches[:, 2].argsort()[::-1]]
-            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-        matches = torch.Tensor(matches).to(iouv.device)
-        correct[matches[:, 1].long()] = matches[:, 2:3] >= iouv
-    return correct
+    b, n, m = len(detections), max(map(len, detections), default=0), max(map(len, labels), default=0)
+    if not (n and m):
+        return torch.zeros(b, n, iouv.shape[0], dtype=torch.bool, device=iouv.device)
+    d = pad_sequence(detections, batch_first=True)[:, None]  # (b,1,n,6)
+    l = pad_sequence(labels, batch_first=True)[:, :, None]  # (b,m,1,5)
+    dm = torch.arange(n, device=iouv.device) < torch.tensor(list(map(len, detections)), device=iouv.device)[:, None]
+    lm = torch.arange(m, device=iouv.device) < torch.tensor(list(map(len, labels)), device=iouv.device)[:, None]
+
+    # box_iou() of every image, iou(b,m,n)
+    area1 = (l[..., 3] - l[..., 1]) * (l[..., 4] - l[..., 2])
+    area2 = (d[..., 2] - d[..., 0]) * (d[..., 3] - d[..., 1])
+    inter = (torch.min(l[..., 3:], d[..., 2:4]) - torch.max(l[..., 1:3], d[..., :2])).clamp(0).prod(3)
+    iou = inter / (area1 + area2 - inter)
+    x = (iou >= iouv[0]) & (l[..., 0] == d[..., 5]) & lm[:, :, None] & dm[:, None]  # IoU above threshold, classes match
+
+    iou, j = iou.masked_fill(~x, -1).flip(1).max(1)  # best label of each detection (ties to the last), iou(b,n)
+    x = (m - 1 - j)[:, None] == torch.arange(m, device=iouv.device)[:, None]  # x(b,m,n) label of each detection
+    x &= (iou >= 0)[:, None]  # matched detections only
+    correct = (x & (x.cumsum(2) == 1)).any(1)  # first detection of each label
+    return correct[..., None] & (iou[..., None] >= iouv)
 
 
 @torch.no_grad()
 def run(data,
-        weights=None,  # model.pt path(s)
+        weights=None,  # model.pt path(s), or a DetectMultiBackend loaded by the caller
         batch_size=32,  # batch size
         imgsz=640,  # inference size (pixels)
         conf_thres=0.001,  # confidence threshold
@@ -114,6 +125,9 @@ def run(data,
         exist_ok=False,  # existing project/name ok, do not increment
         half=True,  # use FP16 half-precision inference
         dnn=False,  # use OpenCV DNN for ONNX inference
+        tile=0,  # sliced inference on overlapping tile x tile crops of the imgsz image, 0 for none
+        tile_overlap=0.2,  # min overlap between neighbouring tiles, fraction of tile
+        ap_bins=0,  # approximate AP from this many confidence bins per class in constant memory, 0 for exact AP
         model=None,
         dataloader=None,
         save_dir=Path(''),
@@ -123,22 +137,24 @@ def run(data,
         ):
     # Initialize/load model and set device
     training = model is not None
+    loaded = isinstance(weights, DetectMultiBackend)  # i.e. by run_matrix(), for every dataset
     if training:  # called by train.py
         device, pt, jit, engine = next(model.parameters()).device, True, False, False  # get model device, PyTorch model
 
         half &= device.type != 'cpu'  # half precision only supported on CUDA
         model.half() if half else model.float()
     else:  # called directly
-        device = select_device(device, batch_size=batch_size)
+        device = weights.device if loaded else select_device(device, batch_size=batch_size)
 
         # Directories
         save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)  # increment run
         (save_dir / 'labels' if save_txt else save_dir).mkdir(parents=True, exist_ok=True)  # make dir
 
         # Load model
-        model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data)
+        model = weights if loaded else DetectMultiBackend(weights, device=device, dnn=dnn, data=data)
         stride, pt, jit, onnx, engine = model.stride, model.pt, model.jit, model.onnx, model.engine
         imgsz = check_img_size(imgsz, s=stride)  # check image size
+        tile = check_img_size(tile, s=stride) if tile else 0  # check tile size
         half &= (pt or jit or onnx or engine) and device.type != 'cpu'  # FP16 supported on limited backends with CUDA
         if pt or jit:
             model.model.half() if half else model.model.float()
@@ -162,11 +178,14 @@ def run(data,
 
     # Dataloader
     if not training:
-        model.warmup(imgsz=(1, 3, imgsz, imgsz), half=half)  # warmup
-        pad = 0.0 if task == 'speed' else 0.5
-        task = task if task in ('train', 'val', 'test') else 'val'  # path to train/val/test images
-        dataloader = create_dataloader(data[task], imgsz, batch_size, stride, single_cls, pad=pad, rect=pt,
-                                       workers=workers, prefix=colorstr(f'{task}: '))[0]
+        if not loaded:
+            model.warmup(imgsz=(1, 3, tile or imgsz, tile or imgsz), half=half)  # warmup
+        if dataloader is None:
+            pad = 0.0 if task == 'speed' else 0.5
+            task = task if task in ('train', 'val', 'test') else 'val'  # path to train/val/test images
+            dataloader = create_dataloader(data[task], imgsz, batch_size, stride, single_cls, pad=pad, rect=pt,
+                                           workers=workers, prefix=colorstr(f'{task}: '),
+                                           label_dir=data.get('labels'), video=data.get('video', False))[0]
 
     seen = 0
     confusion_matrix = ConfusionMatrix(nc=nc)
@@ -175,7 +194,8 @@ def run(data,
     s = ('%20s' + '%11s' * 6) % ('Class', 'Images', 'Labels', 'P', 'R', 'mAP@.5', 'mAP@.5:.95')
     dt, p, r, f1, mp, mr, map50, map = [0.0, 0.0, 0.0], 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
     loss = torch.zeros(3, device=device)
-    jdict, stats, ap, ap_class = [], [], [], []
+    jdict, ap, ap_class = [], [], []
+    stats = APAccumulator(nc, niou, ap_bins, device) if ap_bins else []  # histograms, or every prediction
     pbar = tqdm(dataloader, desc=s, bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}')  # progress bar
     for batch_i, (im, targets, paths, shapes) in enumerate(pbar):
         t1 = time_sync()
@@ -189,7 +209,11 @@ def run(data,
         dt[0] += t2 - t1
 
         # Inference
-        out, train_out = model(im) if training else model(im, augment=augment, val=True)  # inference, loss outputs
+        if tile:  # overlapping tiles of the batch as one batch, NMS below merges them across tiles
+            tiles, offsets = tile_img(im, tile, tile_overlap)
+            out, train_out = untile_pred(model(tiles, augment=augment, val=True)[0], offsets), []
+        else:
+            out, train_out = model(im) if training else model(im, augment=augment, val=True)  # inference, loss outputs
         dt[1] += time_sync() - t2
 
         # Loss
@@ -204,35 +228,35 @@ def run(data,
         dt[2] += time_sync() - t3
 
         # Metrics
+        prednb, labelsnb = [], []  # native-space predictions and labels of each image
         for si, pred in enumerate(out):
+            if single_cls:
+                pred[:, 5] = 0
             labels = targets[targets[:, 0] == si, 1:]
-            nl = len(labels)
-            tcls = labels[:, 0].tolist() if nl else []  # target class
+            predn = pred.clone()
+            scale_coords(im[si].shape[1:], predn[:, :4], shapes[si][0], shapes[si][1])  # native-space pred
+            tbox = xywh2xyxy(labels[:, 1:5])  # target boxes
+            scale_coords(im[si].shape[1:], tbox, shapes[si][0], shapes[si][1])  # native-space labels
+            prednb.append(predn)
+            labelsnb.append(torch.cat((labels[:, 0:1], tbox), 1))
+        correct = process_batch(prednb, labelsnb, iouv)  # all images and IoU levels at once
+        correct, conf = torch.cat([c[:len(x)] for c, x in zip(correct, out)]), torch.cat(out)[:, 4:6]
+        if ap_bins:
+            stats.update(correct, *conf.T, targets[:, 1])  # (correct, conf, pcls, tcls)
+        else:
+            stats.append((correct.cpu(), conf[:, 0].cpu(), conf[:, 1].cpu(), targets[:, 1].cpu()))
+
+        for si, (pred, predn, labelsn) in enumerate(zip(out, prednb, labelsnb)):
+            nl, npr = len(labelsn), len(pred)
             path, shape = Path(paths[si]), shapes[si][0]
             seen += 1
 
-            if len(pred) == 0:
-                if nl:
-                    stats.append((torch.zeros(0, niou, dtype=torch.bool), torch.Tensor(), torch.Tensor(), tcls))
+            if npr == 0:
                 continue
 
-            # Predictions
-            if single_cls:
-                pred[:, 5] = 0
-            predn = pred.clone()
-            scale_coords(im[si].shape[1:], predn[:, :4], shape, shapes[si][1])  # native-space pred
-
             # Evaluate
-            if nl:
-                tbox = xywh2xyxy(labels[:, 1:5])  # target boxes
-                scale_coords(im[si].shape[1:], tbox, shape, shapes[si][1])  # native-space labels
-                labelsn = torch.cat((labels[:, 0:1], tbox), 1)  # native-space labels
-                correct = process_batch(predn, labelsn, iouv)
-                if plots:
-                    confusion_matrix.process_batch(predn, labelsn)
-            else:
-                correct = torch.zeros(pred.shape[0], niou, dtype=torch.bool)
-            stats.append((correct.cpu(), pred[:, 4].cpu(), pred[:, 5].cpu(), tcls))  # (correct, conf, pcls, tcls)
+            if nl and plots:
+                confusion_matrix.process_batch(predn, labelsn)
 
             # Save/log
             if save_txt:
@@ -249,21 +273,29 @@ def run(data,
             Thread(target=plot_images, args=(im, output_to_target(out), paths, f, names), daemon=True).start()
 
     # Compute metrics
-    stats = [np.concatenate(x, 0) for x in zip(*stats)]  # to numpy
-    if len(stats) and stats[0].any():
-        tp, fp, p, r, f1, ap, ap_class = ap_per_class(*stats, plot=plots, save_dir=save_dir, names=names)
+    if not ap_bins:
+        stats = [torch.cat(x, 0).numpy() for x in zip(*stats)]  # to numpy
+    if stats.tp.any() if ap_bins else len(stats) and stats[0].any():
+        if ap_bins:  # from the confidence histograms
+            tp, fp, p, r, f1, ap, ap_class = stats.result(plot=plots, save_dir=save_dir, names=names)
+            nt = stats.nt.cpu().numpy()  # number of targets per class
+        else:
+            tp, fp, p, r, f1, ap, ap_class = ap_per_class(*stats, plot=plots, save_dir=save_dir, names=names)
+            nt = np.bincount(stats[3].astype(np.int64), minlength=nc)  # number of targets per class
         ap50, ap = ap[:, 0], ap.mean(1)  # AP@0.5, AP@0.5:0.95
         mp, mr, map50, map = p.mean(), r.mean(), ap50.mean(), ap.mean()
-        nt = np.bincount(stats[3].astype(np.int64), minlength=nc)  # number of targets per class
     else:
         nt = torch.zeros(1)
 
     # Print results
     pf = '%20s' + '%11i' * 2 + '%11.3g' * 4  # print format
     LOGGER.info(pf % ('all', seen, nt.sum(), mp, mr, map50, map))
+    if ap_bins and not training and len(stats.error):
+        LOGGER.info(f'AP histogram error bound: mAP@.5 {stats.error[:, 0].mean():.2g}, '
+                    f'mAP@.5:.95 {stats.error.mean():.2g}')
 
     # Print results per class
-    if (verbose or (nc < 50 and not training)) and nc > 1 and len(stats):
+    if (verbose or (nc < 50 and not training)) and nc > 1 and len(ap_class):
         for i, c in enumerate(ap_class):
             LOGGER.info(pf % (names[c], seen, nt[c], p[i], r[i], ap50[i], ap[i]))
 
@@ -280,7 +312,7 @@ def run(data,
 
     # Save JSON
     if save_json and len(jdict):
-        w = Path(weights[0] if isinstance(weights, list) else weights).stem if weights is not None else ''  # weights
+        w = Path(weights[0] if isinstance(weights, list) else weights).stem if weights and not loaded else ''  # weights
         anno_json = str(Path(data.get('path', '../coco')) / 'annotations/instances_val2017.json')  # annotations json
         pred_json = str(save_dir / f"{w}_predictions.json")  # predictions json
         LOGGER.info(f'\nEvaluating pycocotools mAP... saving {pred_json}...')
@@ -315,6 +347,85 @@ def run(data,
     return (mp, mr, map50, map, *(loss.cpu() / len(dataloader)).tolist()), maps, t
 
 
+def run_matrix(data,
+               weights=None,  # model.pt path(s)
+               batch_size=32,  # batch size
+               imgsz=640,  # inference size (pixels)
+               task='val',  # dataset split of every dataset.yaml
+               device='',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+               workers=8,  # max dataloader workers, shared by all datasets
+               single_cls=False,  # treat as single-class dataset
+               project=ROOT / 'runs/val',  # save to project/name
+               name='exp',  # save to project/name
+               exist_ok=False,  # existing project/name ok, do not increment
+               half=True,  # use FP16 half-precision inference
+               dnn=False,  # use OpenCV DNN for ONNX inference
+               tile=0,  # sliced inference tile size (pixels), 0 for none
+               baseline=None,  # model.pt path to compare weights with, i.e. the FP32 model of INT8 weights
+               **kwargs,  # run() arguments
+               ):
+    # Validates every dataset.yaml under data (i.e. CURE-TSD/**/dataset.yaml) with one model, warmed up once, and one
+    # dataloader worker pool streaming the datasets back to back. Results of each dataset are saved to
+    # project/name/<dataset>, and a table by dataset folder (i.e. challenge type) and subfolder (i.e. challenge level)
+    # to project/name/matrix.csv and matrix.json
+    # With a baseline model each dataset is also validated with it, and the tables report the mAP delta of weights
+    # against baseline and the inference speedup, i.e. of INT8 over FP32
+    files = sorted(Path(data).glob('**/dataset.yaml')) if Path(data).is_dir() else [Path(data)]
+    assert files, f'No dataset.yaml found in {data}'
+    datasets = [check_dataset(check_yaml(f)) for f in files]
+    save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)  # increment run
+    save_dir.mkdir(parents=True, exist_ok=True)  # make dir
+
+    # Load models once
+    device = select_device(device, batch_size=batch_size)
+    models = {'': DetectMultiBackend(weights, device=device, dnn=dnn, data=files[0])}  # prefix of results: model
+    if baseline:
+        models['baseline '] = DetectMultiBackend(baseline, device=device, dnn=dnn, data=files[0])
+    model = models['']
+    pt = all(m.pt for m in models.values())
+    imgsz, tile = check_img_size(imgsz, s=model.stride), check_img_size(tile, s=model.stride) if tile else 0
+    half &= all(m.pt or m.jit or m.onnx or m.engine for m in models.values()) and device.type != 'cpu'  # as run()
+    batch_size = min(batch_size if m.pt or m.jit else m.batch_size if m.engine else 1 for m in models.values())
+    for m in models.values():
+        m.warmup(imgsz=(1, 3, tile or imgsz, tile or imgsz), half=half)  # warmup
+
+    # Dataloaders
+    task = task if task in ('train', 'val', 'test') else 'val'  # path to train/val/test images
+    dataloaders = create_dataloaders([x[task] for x in datasets], imgsz, batch_size, model.stride, single_cls, pad=0.5,
+                                     rect=pt, workers=workers, prefix=colorstr(f'{task}: '),
+                                     label_dirs=[x.get('labels') for x in datasets],
+                                     videos=[x.get('video', False) for x in datasets])
+
+    rows = []
+    for f, x, dataloader in zip(files, datasets, dataloaders):
+        parts = f.parent.relative_to(Path(data)).parts if Path(data).is_dir() else ()
+        parts = parts or (f.parent.name,)  # i.e. ('09', '01') or ('00',)
+        LOGGER.info(f"\n{colorstr('bold', '/'.join(parts))}: {f}")
+        row = {'dataset': str(f), 'type': parts[0], 'level': parts[-1], 'images': len(dataloader.dataset)}
+        for k, m in models.items():
+            (mp, mr, map50, map, *_), _, t = run(x, weights=m, batch_size=batch_size, imgsz=imgsz, task=task,
+                                                 single_cls=single_cls, project=save_dir,
+                                                 name='_'.join(parts) + ('_baseline' if k else ''), exist_ok=True,
+                                                 half=half, tile=tile, dataloader=dataloader, **kwargs)
+            row.update({f'{k}{n}': v for n, v in zip(('P', 'R', 'mAP@.5', 'mAP@.5:.95', 'ms', 'inference ms'),
+                                                      (mp, mr, map50, map, sum(t), t[1]))})
+        rows.append(row)
+
+    # Save table
+    df = pd.DataFrame(rows)
+    values = ['mAP@.5', 'mAP@.5:.95']
+    if baseline:
+        for k in 'mAP@.5', 'mAP@.5:.95':
+            df[f'{k} delta'] = df[k] - df[f'baseline {k}']
+        df['speedup'] = df['baseline inference ms'] / df['inference ms']
+        values += ['mAP@.5 delta', 'mAP@.5:.95 delta', 'speedup']
+    df.to_json(save_dir / 'matrix.json', orient='records', indent=2)
+    matrix = df.pivot(index='type', columns='level', values=values)
+    matrix.to_csv(save_dir / 'matrix.csv')
+    LOGGER.info(f"\n{matrix.round(3).to_string()}\nResults saved to {colorstr('bold', save_dir)}")
+    return df
+
+
 def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument('--data', type=str, default=ROOT / 'data/coco128.yaml', help='dataset.yaml path')
@@ -323,7 +434,7 @@ def parse_opt():
     parser.add_argument('--imgsz', '--img', '--img-size', type=int, default=640, help='inference size (pixels)')
     parser.add_argument('--conf-thres', type=float, default=0.001, help='confidence threshold')
     parser.add_argument('--iou-thres', type=float, default=0.6, help='NMS IoU threshold')
-    parser.add_argument('--task', default='val', help='train, val, test, speed or study')
+    parser.add_argument('--task', default='val', help='train, val, test, speed, study or matrix')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--workers', type=int, default=8, help='max dataloader workers (per RANK in DDP mode)')
     parser.add_argument('--single-cls', action='store_true', help='treat as single-class dataset')
@@ -338,9 +449,13 @@ def parse_opt():
     parser.add_argument('--exist-ok', action='store_true', help='existing project/name ok, do not increment')
     parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
     parser.add_argument('--dnn', action='store_true', help='use OpenCV DNN for ONNX inference')
+    parser.add_argument('--tile', type=int, default=0, help='sliced inference tile size (pixels), 0 for none')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='min overlap between tiles, fraction of tile')
+    parser.add_argument('--baseline', type=str, default=None, help='matrix: weights to compare with, i.e. FP32 model')
+    parser.add_argument('--ap-bins', type=int, default=0, help='approximate AP in constant memory, i.e. 10000, 0 exact')
     opt = parser.parse_args()
-    opt.data = check_yaml(opt.data)  # check YAML
-    opt.save_json |= opt.data.endswith('coco.yaml')
+    opt.data = opt.data if opt.task == 'matrix' else check_yaml(opt.data)  # check YAML, or dir of them for matrix
+    opt.save_json |= str(opt.data).endswith('coco.yaml')
     opt.save_txt |= opt.save_hybrid
     print_args(FILE.stem, opt)
     return opt
@@ -348,12 +463,18 @@ def parse_opt():
 
 def main(opt):
     check_requirements(requirements=ROOT / 'requirements.txt', exclude=('tensorboard', 'thop'))
+    baseline = vars(opt).pop('baseline')  # --task matrix only
 
     if opt.task in ('train', 'val', 'test'):  # run normally
         if opt.conf_thres > 0.001:  # https://github.com/ultralytics/yolov5/issues/1466
             LOGGER.info(f'WARNING: confidence threshold {opt.conf_thres} >> 0.001 will produce invalid mAP values.')
         run(**vars(opt))
 
+    elif opt.task == 'matrix':  # every dataset.yaml under --data with one model and dataloader
+        # python yolov5/val.py --task matrix --data CURE-TSD --weights best.pt
+        # python yolov5/val.py --task matrix --data CURE-TSD --weights best-int8.onnx --baseline best.onnx --device cpu
+        run_matrix(**vars(opt), baseline=baseline)
+
     else:
         weights = opt.weights if isinstance(opt.weights, list) else [opt.weights]
         opt.half = True  # FP16 for fastest results